@@ -0,0 +1,152 @@
+import os
+import numpy as np
+from typing import Any, Dict, List, Optional
+
+from create_midi import CreateMidi
+from examine.run import ExamineHarmonicDissonance
+from examine.examine import harmonic_dissonance_analysis_batch
+
+class CandidateRanker:
+    """
+    Best-of-N generation without a file round trip per candidate: sample N candidates in one
+    batch with the models' sample_indices, score them in memory with the examiner's interval
+    score table, keep the top K and write MIDI only for those.
+
+    The score of a candidate is its average harmonic score (as ExamineHarmonicDissonance reports
+    it), plus harmony_weight and dissonance_weight times the per-pair averages of the examine.py
+    harmony and dissonance metrics. Use a negative dissonance_weight to penalize dissonance.
+    """
+
+    def __init__(self, pitch_model, duration_model=None, harmony_weight=0.0, dissonance_weight=0.0):
+        """
+        Parameters:
+        -----------
+        pitch_model : VanillaFirstOrderMarkovChain or VanillaSecondOrderMarkovChain
+            Fitted model of MIDI pitches.
+        duration_model : VanillaFirstOrderMarkovChain, VanillaSecondOrderMarkovChain or None
+            Fitted model of durations, sampled alongside the pitches.
+        harmony_weight : float
+            Weight of the average pairwise harmony of examine.py. 0 skips computing it.
+        dissonance_weight : float
+            Weight of the average pairwise dissonance of examine.py. 0 skips computing it.
+        """
+        self.pitch_model = pitch_model
+        self.duration_model = duration_model
+        self.harmony_weight = harmony_weight
+        self.dissonance_weight = dissonance_weight
+        self.examiner = ExamineHarmonicDissonance()
+        self.examiner.set_up_harmonic_matrix()
+
+    def score(self, pitches: np.ndarray, lengths: Optional[np.ndarray] = None) -> Dict[str, np.ndarray]:
+        """
+        Score a batch of pitch sequences.
+
+        Parameters:
+        -----------
+        pitches : numpy.ndarray
+            MIDI pitches of shape (n_candidates, length).
+        lengths : numpy.ndarray or None
+            Number of generated notes of each candidate.
+
+        Returns:
+        --------
+        scores : dict
+            Arrays of shape (n_candidates,): "score", "harmonic_score" and, when weighted,
+            "harmony" and "dissonance".
+        """
+        pitches = np.atleast_2d(pitches)
+        lengths = np.full(len(pitches), pitches.shape[1]) if lengths is None else lengths
+        harmonic_score = self.examiner.score_sequences(pitches, lengths)
+        scores = {"harmonic_score": harmonic_score}
+        total = np.nan_to_num(harmonic_score, nan=-np.inf)
+        if self.harmony_weight or self.dissonance_weight:
+            harmony, dissonance = harmonic_dissonance_analysis_batch(pitches, lengths)
+            n_pairs = np.maximum(lengths * (lengths - 1) / 2, 1)
+            scores["harmony"] = harmony / n_pairs
+            scores["dissonance"] = dissonance / n_pairs
+            total = total + self.harmony_weight * scores["harmony"] + self.dissonance_weight * scores["dissonance"]
+        scores["score"] = total
+        return scores
+
+    def generate(self, n_candidates=64, length=100, top_k=1, start_state=None,
+                 random_seed: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        Sample candidates and return the best ones.
+
+        Parameters:
+        -----------
+        n_candidates : int
+            Number of candidates to sample.
+        length : int
+            Notes per candidate. Candidates reaching a dead end are shorter.
+        top_k : int
+            Number of candidates to keep.
+        start_state : state, tuple(state, state) or None
+            Starting pitch (pair) of every candidate, see the models' sample_indices.
+        random_seed : int or None
+            Random seed for reproducibility. Pitches and durations are both sampled from it.
+
+        Returns:
+        --------
+        candidates : list of dict
+            Best first, each with "pitches", "durations" (None without a duration model),
+            "score" and the individual metrics.
+        """
+        pitch_indices = self.pitch_model.sample_indices(n_candidates, length, start_state, random_seed)
+        lengths = (pitch_indices >= 0).sum(axis=1)
+        pitch_values = np.asarray(self.pitch_model.state_array.tolist())
+        pitches = pitch_values[np.maximum(pitch_indices, 0)]
+        scores = self.score(pitches, lengths)
+
+        duration_indices = None
+        if self.duration_model is not None:
+            duration_indices = self.duration_model.sample_indices(n_candidates, length, None, random_seed)
+            duration_values = np.asarray(self.duration_model.state_array.tolist())
+
+        # Stable sort so ties keep sampling order
+        best = np.argsort(-scores["score"], kind="stable")[:top_k]
+        candidates = []
+        for candidate in best.tolist():
+            result = {"pitches": pitches[candidate, :lengths[candidate]].tolist(), "durations": None}
+            if duration_indices is not None:
+                row = duration_indices[candidate]
+                result["durations"] = duration_values[row[row >= 0]].tolist()
+            result.update({name: float(values[candidate]) for name, values in scores.items()})
+            candidates.append(result)
+        return candidates
+
+    @staticmethod
+    def write_midi(candidates: List[Dict[str, Any]], output_dir: str, prefix: str,
+                   ticks_per_beat=480, tempo=500000, velocity=110) -> List[str]:
+        """
+        Write the kept candidates as MIDI files named {prefix}_{rank}.mid.
+
+        Parameters:
+        -----------
+        candidates : list of dict
+            Candidates from generate, with durations in output ticks.
+        output_dir : str
+            Directory to write to.
+        prefix : str
+            File name prefix.
+        ticks_per_beat : int
+            Resolution of the files.
+        tempo : int
+            Tempo in microseconds per beat.
+        velocity : int
+            Velocity of every note.
+
+        Returns:
+        --------
+        paths : list of str
+            Paths of the written files, best first.
+        """
+        paths = []
+        for rank, candidate in enumerate(candidates, start=1):
+            if candidate["durations"] is None:
+                raise ValueError("Candidates need durations to be written as MIDI.")
+            path = os.path.join(output_dir, f"{prefix}_{rank}.mid")
+            notes = CreateMidi.notes_from_sequences(candidate["pitches"], candidate["durations"], velocity)
+            CreateMidi.create_midi_from_notes(path, notes, ticks_per_beat, tempo)
+            paths.append(path)
+        return paths
@@ -0,0 +1 @@
+# Lets pytest import the top-level modules and the model package from tests/
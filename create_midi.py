@@ -1,12 +1,20 @@
+import io
+import os
+import struct
+from numbers import Integral
 import mido
 
 class CreateMidi:
-    def create_midi_from_notes(output_file, notes, ticks_per_beat=480, tempo=500000): #ticks per beat and tempo controls the overall pace of the song i.e how fast or slow the song will be.
+    def build_midi(notes, ticks_per_beat=480, tempo=500000): #ticks per beat and tempo controls the overall pace of the song i.e how fast or slow the song will be.
         midi = mido.MidiFile(ticks_per_beat=ticks_per_beat)
         track = mido.MidiTrack() # Create single track
         track.append(mido.MetaMessage('set_tempo', tempo=tempo))
         midi.tracks.append(track)
 
+        track.extend(CreateMidi.note_messages(notes))
+        return midi
+
+    def note_messages(notes): # Turn note dictionaries into note on/off messages with delta times, in order of start time
         # Sort notes so that its in order of the start time
         notes = sorted(notes, key=lambda x: x['start_time'])
         for note_data in notes:
@@ -17,12 +25,198 @@ class CreateMidi:
 
             # Calculate time offset for the note_on event
             if(note_data['event'] == 'note_on'):
-                track.append(mido.Message('note_on', note=note, velocity=velocity, time=0))
-            
+                yield mido.Message('note_on', note=note, velocity=velocity, time=0)
+
             if(note_data['event'] == 'note_off'):
                 # Add note_off event after the duration
-                track.append(mido.Message('note_off', note=note, velocity=0, time=duration))
+                yield mido.Message('note_off', note=note, velocity=0, time=duration)
+
+    def create_midi_from_notes(output_file, notes, ticks_per_beat=480, tempo=500000):
+        # Stream the messages to the file instead of building the whole MidiFile first
+        with MidiFileWriter(output_file, ticks_per_beat, tempo) as writer:
+            for message in CreateMidi.note_messages(notes):
+                writer.write(message)
+        print(f"MIDI file '{output_file}' created. Please find it in the root folder.")
+
+    def create_midi_bytes(notes, ticks_per_beat=480, tempo=500000): # Same as create_midi_from_notes, but returns the file contents instead of saving
+        buffer = io.BytesIO()
+        with MidiFileWriter(buffer, ticks_per_beat, tempo) as writer:
+            for message in CreateMidi.note_messages(notes):
+                writer.write(message)
+        return buffer.getvalue()
+
+    def notes_from_sequences(pitch_sequence, duration_sequence, velocity=110): # Lay generated pitches and durations out one after another as note on/off pairs
+        notes = []
+        current_time = 0
+        for pitch, duration in zip(pitch_sequence, duration_sequence):
+            notes.append({'event': 'note_on', 'note': pitch, 'start_time': current_time, 'duration': None, 'velocity': velocity})
+            notes.append({'event': 'note_off', 'note': pitch, 'start_time': current_time, 'duration': duration, 'velocity': 0})
+            current_time += duration
+        return notes
+
+
+def _encode_variable_int(value): # MIDI variable-length quantity: 7 bits per byte, most significant first, high bit set on all but the last
+    if not isinstance(value, Integral) or value < 0:
+        raise ValueError(f"Delta time must be a non-negative int, got {value!r}")
+    value = int(value)
+    data = bytearray([value & 0x7f])
+    value >>= 7
+    while value:
+        data.insert(0, (value & 0x7f) | 0x80)
+        value >>= 7
+    return data
+
+class MidiFileWriter:
+    """
+    Write a single-track MIDI file incrementally: events are appended to the file as they are
+    added, with delta times, and the track length is patched into the header on close. Memory
+    stays constant however many notes are written, so endless generation from a streaming
+    sampler can go straight to disk.
+
+    The bytes are the same as mido's MidiFile.save of the same messages, running status
+    included. Use as a context manager; the file is completed even if writing is interrupted.
+    """
+
+    def __init__(self, output_file, ticks_per_beat=480, tempo=500000):
+        """
+        Parameters:
+        -----------
+        output_file : str or binary file object
+            Path to write to, or a seekable file object opened for writing, e.g. io.BytesIO.
+            A file object is left open on close.
+        ticks_per_beat : int
+            Resolution of the delta times.
+        tempo : int
+            Tempo in microseconds per beat, written as the first event.
+        """
+        self._owns_file = isinstance(output_file, (str, bytes, os.PathLike))
+        self.file = open(output_file, 'wb') if self._owns_file else output_file
+        # Format 1 with a single track, as mido.MidiFile writes it
+        self.file.write(b'MThd' + struct.pack('>Lhhh', 6, 1, 1, ticks_per_beat))
+        self.file.write(b'MTrk')
+        self._length_position = self.file.tell()
+        self.file.write(struct.pack('>L', 0)) # patched on close
+        self._length = 0
+        self._pending = 0 # ticks of rest before the next event
+        self._running_status = None
+        self.closed = False
+        self.write(mido.MetaMessage('set_tempo', tempo=tempo))
+
+    def write(self, message, time=None):
+        """
+        Append a message.
+
+        Parameters:
+        -----------
+        message : mido.Message or mido.MetaMessage
+            Message to append. An end_of_track message only adds its delta time, the track
+            is ended on close.
+        time : int or None
+            Delta time in ticks since the previous event. Defaults to message.time.
+        """
+        delta = self._pending + (message.time if time is None else time)
+        if message.type == 'end_of_track':
+            self._pending = delta
+            return
+        if message.is_meta or message.type == 'sysex':
+            if message.type == 'sysex':
+                data = bytes([0xf0]) + _encode_variable_int(len(message.data) + 1) + bytes(message.data) + bytes([0xf7])
+            else:
+                data = bytes(message.bytes())
+            self._running_status = None
+            self._append(delta, data)
+        else:
+            self._append_channel_message(delta, bytes(message.bytes()))
+
+    def add_note(self, note, duration, velocity=110, channel=0):
+        """
+        Append a note starting after any pending rest, lasting duration ticks. Raises a ValueError,
+        before anything is written, if an argument is not an integer or is out of range.
+
+        Parameters:
+        -----------
+        note : int
+            MIDI pitch, 0-127.
+        duration : int
+            Length of the note in ticks, non-negative.
+        velocity : int
+            Velocity of the note, 1-127.
+        channel : int
+            MIDI channel, 0-15.
+        """
+        integers = all(isinstance(value, Integral) for value in (note, duration, velocity, channel))
+        if not integers or not 0 <= note <= 127 or duration < 0 or not 0 <= velocity <= 127 or not 0 <= channel <= 15:
+            raise ValueError(f"Invalid note {note!r}, duration {duration!r}, velocity {velocity!r} or channel {channel!r}")
+        note, duration, velocity, channel = int(note), int(duration), int(velocity), int(channel)
+        self._append_channel_message(self._pending, bytes([0x90 | channel, note, velocity]))
+        self._append_channel_message(duration, bytes([0x80 | channel, note, 0]))
+
+    def add_rest(self, ticks):
+        """
+        Leave ticks of silence before the next event.
+
+        Parameters:
+        -----------
+        ticks : int
+            Length of the rest in ticks.
+        """
+        self._pending += ticks
+
+    def write_notes(self, notes, velocity=110):
+        """
+        Append notes back to back, as CreateMidi.notes_from_sequences lays them out.
+
+        Parameters:
+        -----------
+        notes : iterable of tuple(pitch, duration)
+            Notes to append, e.g. from NoteStreamer.notes. Durations in ticks.
+        velocity : int
+            Velocity of every note.
+
+        Returns:
+        --------
+        count : int
+            Number of notes written.
+        """
+        count = 0
+        for pitch, duration in notes:
+            self.add_note(pitch, duration, velocity)
+            count += 1
+        return count
+
+    def close(self):
+        """
+        End the track, patch its length into the header and close the file if the writer opened it.
+        """
+        if self.closed:
+            return
+        self.closed = True
+        self._append(self._pending, bytes(mido.MetaMessage('end_of_track').bytes()))
+        end = self.file.tell()
+        self.file.seek(self._length_position)
+        self.file.write(struct.pack('>L', self._length))
+        self.file.seek(end)
+        if self._owns_file:
+            self.file.close()
+        else:
+            self.file.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _append_channel_message(self, delta, data):
+        # Running status: repeated status bytes of channel messages are left out
+        status = data[0]
+        if status == self._running_status:
+            data = data[1:]
+        self._running_status = status if status < 0xf0 else None
+        self._append(delta, data)
 
-        # Save the MIDI file
-        midi.save(output_file)
-        print(f"MIDI file '{output_file}' created. Please find it in the root folder.")
\ No newline at end of file
+    def _append(self, delta, data):
+        chunk = _encode_variable_int(delta) + data
+        self.file.write(chunk)
+        self._length += len(chunk)
+        self._pending = 0
@@ -0,0 +1,134 @@
+import numpy as np
+from typing import List, Sequence
+
+class DurationQuantizer:
+    """
+    Snaps note durations to a small vocabulary of duration states.
+
+    Durations are measured in beats using each file's ticks_per_beat, so files with different
+    resolutions share the same states. They are snapped to the nearest value on a beat grid
+    (plus optional tuplet grids), or to bins learned from the data with `fit`. States are integer
+    ticks at a fixed `resolution`, which keeps them usable as model states, and `to_ticks` maps
+    generated states back to ticks for CreateMidi.
+    """
+
+    def __init__(self, subdivisions=4, tuplets=(), max_beats=4.0, resolution=480):
+        """
+        Parameters:
+        -----------
+        subdivisions : int
+            Grid steps per beat, e.g. 4 for sixteenth notes in 4/4.
+        tuplets : tuple of int
+            Extra divisions of the beat added to the grid, e.g. (3,) for eighth-note triplets.
+        max_beats : float
+            Longest duration on the grid. Longer durations are snapped to it.
+        resolution : int
+            Ticks per beat of the states.
+        """
+        if subdivisions < 1 or any(division < 1 for division in tuplets):
+            raise ValueError("subdivisions and tuplets must be positive")
+        if max_beats <= 0:
+            raise ValueError("max_beats must be positive")
+
+        self.resolution = resolution
+        grid = [np.arange(1, int(max_beats * division) + 1) / division for division in (subdivisions, *tuplets)]
+        self._set_bins(np.concatenate(grid))
+
+    def _set_bins(self, beats: np.ndarray) -> None:
+        # Bins closer together than one tick at the state resolution would map to the same state
+        self.states = np.unique(np.maximum(np.rint(beats * self.resolution), 1).astype(np.int64))
+        bin_beats = self.states / self.resolution
+        # Durations are snapped to the nearest bin, so the boundaries are the midpoints
+        self._boundaries = (bin_beats[:-1] + bin_beats[1:]) / 2
+
+    def fit(self, beats: Sequence[float], n_bins=16) -> "DurationQuantizer":
+        """
+        Replace the grid with bins learned from observed durations: the median of each of
+        n_bins equally populated quantile ranges.
+
+        Parameters:
+        -----------
+        beats : sequence of float
+            Observed durations in beats, see to_beats.
+        n_bins : int
+            Maximum number of bins. Fewer are kept when bins coincide.
+
+        Returns:
+        --------
+        self : DurationQuantizer
+        """
+        beats = np.sort(np.asarray(beats, dtype=float))
+        beats = beats[beats > 0]
+        if len(beats) == 0:
+            raise ValueError("No positive durations to learn bins from.")
+        ranges = np.array_split(beats, min(n_bins, len(beats)))
+        self._set_bins(np.array([np.median(values) for values in ranges]))
+        return self
+
+    @staticmethod
+    def to_beats(durations: Sequence[int], ticks_per_beat: int) -> np.ndarray:
+        """
+        Convert tick durations of a file to beats.
+
+        Parameters:
+        -----------
+        durations : sequence of int
+            Durations in ticks.
+        ticks_per_beat : int
+            Resolution of the file the durations come from.
+
+        Returns:
+        --------
+        beats : numpy.ndarray
+            Durations in beats.
+        """
+        return np.asarray(durations, dtype=float) / ticks_per_beat
+
+    def quantize(self, durations: Sequence[int], ticks_per_beat: int) -> np.ndarray:
+        """
+        Snap tick durations of a file to the nearest state.
+
+        Parameters:
+        -----------
+        durations : sequence of int
+            Durations in ticks.
+        ticks_per_beat : int
+            Resolution of the file the durations come from.
+
+        Returns:
+        --------
+        states : numpy.ndarray
+            Integer duration states, in ticks at the quantizer's resolution.
+        """
+        beats = self.to_beats(durations, ticks_per_beat)
+        return self.states[np.searchsorted(self._boundaries, beats)]
+
+    def to_ticks(self, states: Sequence[int], ticks_per_beat: int) -> List[int]:
+        """
+        Map duration states back to ticks at an output resolution.
+
+        Parameters:
+        -----------
+        states : sequence of int
+            Duration states, e.g. generated by a model.
+        ticks_per_beat : int
+            Resolution of the output file.
+
+        Returns:
+        --------
+        durations : list of int
+            Durations in ticks, at least 1.
+        """
+        ticks = np.rint(np.asarray(states, dtype=float) * ticks_per_beat / self.resolution)
+        return np.maximum(ticks, 1).astype(np.int64).tolist()
+
+    def state_space(self) -> List[int]:
+        """
+        Get the duration states, sorted, for use as a model state space.
+
+        Returns:
+        --------
+        state_space : list of int
+            The possible states.
+        """
+        return self.states.tolist()
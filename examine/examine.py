@@ -1,4 +1,5 @@
 import numpy as np
+from functools import lru_cache
 
 def frequency(p):
     """calculate corresponding frequency of p (based on A0 = 27.5 Hz)"""
@@ -48,8 +49,39 @@ def check_harmonic_dissonance_score(harmony_score, dissonance_score, threshold=0
     elif harmony_score < 5.0 and dissonance_score > 5.0:
         return "Dissonance"
 
-# example: C major scale (C, D, E, F, G, A, B, C)
-c_major_scale = [40, 42, 44, 45, 47, 49, 51, 52]
-harmony_score, dissonance_score = harmonic_dissonance_analysis(c_major_scale)
-print("Harmony Score: %.4f" % harmony_score)
-print("Dissonance Score: %.4f" % dissonance_score)
\ No newline at end of file
+@lru_cache(maxsize=None)
+def pair_tables(alpha=0.1, n_pitches=128):
+    """harmonic ratio and dissonance of every ordered pair of pitches 0..n_pitches-1, from the functions above"""
+    pitches = range(n_pitches)
+    harmony_table = np.array([[harmonic_ratio(p1, p2) for p2 in pitches] for p1 in pitches])
+    dissonance_table = np.array([[dissonance(p1, p2, alpha) for p2 in pitches] for p1 in pitches])
+    return harmony_table, dissonance_table
+
+def harmonic_dissonance_analysis_batch(scales, lengths=None, alpha=0.1, max_pairs=2**22):
+    """harmonic_dissonance_analysis of every row of a (n_scales, length) pitch array, rows cut at lengths"""
+    scales = np.atleast_2d(np.asarray(scales, dtype=np.int64))
+    n_scales, length = scales.shape
+    lengths = np.full(n_scales, length) if lengths is None else np.asarray(lengths)
+    harmony_table, dissonance_table = pair_tables(alpha)
+    if scales.size and (scales.min() < 0 or scales.max() >= len(harmony_table)):
+        raise ValueError(f"Pitches must be between 0 and {len(harmony_table) - 1}")
+
+    # Every pair i < j of a row, in chunks of rows to bound the memory of the gathered pairs
+    first, second = np.triu_indices(length, 1)
+    harmony = np.zeros(n_scales)
+    dissonance_score = np.zeros(n_scales)
+    chunk = max(1, max_pairs // max(len(first), 1))
+    for start in range(0, n_scales, chunk):
+        rows = scales[start:start + chunk]
+        valid = second[None, :] < lengths[start:start + chunk, None]
+        p1, p2 = rows[:, first], rows[:, second]
+        harmony[start:start + chunk] = np.where(valid, harmony_table[p1, p2], 0.0).sum(axis=1)
+        dissonance_score[start:start + chunk] = np.where(valid, dissonance_table[p1, p2], 0.0).sum(axis=1)
+    return harmony, dissonance_score
+
+if __name__ == "__main__":
+    # example: C major scale (C, D, E, F, G, A, B, C)
+    c_major_scale = [40, 42, 44, 45, 47, 49, 51, 52]
+    harmony_score, dissonance_score = harmonic_dissonance_analysis(c_major_scale)
+    print("Harmony Score: %.4f" % harmony_score)
+    print("Dissonance Score: %.4f" % dissonance_score)
\ No newline at end of file
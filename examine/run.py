@@ -1,6 +1,7 @@
 import numpy as np
 import matplotlib.pyplot as plt
 from extract_midi import ExtractMidi
+from model.IntervalWeights import interval_scores
 
 class ExamineHarmonicDissonance():
     def __init__(self):
@@ -9,29 +10,8 @@ class ExamineHarmonicDissonance():
 
 
     def set_up_harmonic_matrix(self):
-        interval_weights = {
-            0: 1.0, 
-            7: 0.9, 
-            5: 0.8, 
-            4: 0.7, 
-            3: 0.6,
-            8: 0.5, 
-            9: 0.5, 
-            2: 0.2, 
-            10: 0.2, 
-            6: -0.8,
-            1: -0.5, 
-            11: -0.3,
-        }
-
-        self.score_matrix = np.zeros((88, 88))
-
-        for i in range(88):
-            for j in range(88):
-                pitch1 = i + 21  # MIDI note
-                pitch2 = j + 21
-                interval = abs(pitch1 - pitch2) % 12
-                self.score_matrix[i][j] = interval_weights.get(interval, 0)
+        pitches = np.arange(88) + 21  # MIDI notes
+        self.score_matrix = interval_scores(pitches[:, None], pitches[None, :])
     
 
     def read_input_file(self, input_path):
@@ -69,6 +49,29 @@ class ExamineHarmonicDissonance():
         self.plot_harmonic_scores(scores, "Harmonic scroes is " + str(average_score), save_path)
         
 
+    def score_sequences(self, pitch_sequences, lengths=None):
+        # Average harmonic score of every row of a (n_sequences, length) pitch array at once, computed
+        # like get_harmonic_dissonance: each note against the next, the last note against the first,
+        # skipping pairs with a pitch outside the piano range. Rows are cut at lengths when given.
+        # Rows without any valid pair score nan.
+        if not hasattr(self, "score_matrix"):
+            self.set_up_harmonic_matrix()
+        pitches = np.atleast_2d(np.asarray(pitch_sequences, dtype=np.int64))
+        n_sequences, length = pitches.shape
+        lengths = np.full(n_sequences, length) if lengths is None else np.asarray(lengths)
+
+        positions = np.arange(length)[None, :]
+        next_positions = np.where(positions + 1 < lengths[:, None], positions + 1, 0)
+        next_pitches = np.take_along_axis(pitches, next_positions, axis=1)
+        valid = ((positions < lengths[:, None]) & (pitches >= 21) & (pitches <= 108)
+                 & (next_pitches >= 21) & (next_pitches <= 108))
+
+        pair_scores = self.score_matrix[np.clip(pitches - 21, 0, 87), np.clip(next_pitches - 21, 0, 87)]
+        totals = np.where(valid, pair_scores, 0.0).sum(axis=1)
+        counts = valid.sum(axis=1)
+        return np.divide(totals, counts, out=np.full(n_sequences, np.nan), where=counts > 0)
+
+
     def plot_harmonic_scores(self, scores, label_content, save_path=None):
         # plt.figure(figsize=(10, 6))
         # plt.plot(scores, marker='o', linestyle='-', color='blue')
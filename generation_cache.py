@@ -0,0 +1,189 @@
+import hashlib
+import json
+import os
+from collections import OrderedDict
+
+class GenerationCache:
+    """
+    Bounded LRU cache of generated MIDI bytes, in memory with an optional disk tier.
+
+    Keys are content hashes of a model fingerprint and the request parameters, so refitting a
+    model changes every key and stale entries are never returned; they age out of the LRU order.
+    Only seeded requests are reproducible and worth caching. Disk entries are shared by every
+    process using the same directory and are written atomically.
+    """
+
+    def __init__(self, max_entries=1024, max_bytes=64 * 2**20, disk_dir=None, max_disk_entries=100000):
+        """
+        Parameters:
+        -----------
+        max_entries : int
+            Maximum number of entries kept in memory.
+        max_bytes : int
+            Maximum total size of the entries kept in memory.
+        disk_dir : str or None
+            Directory of the disk tier. Entries evicted from memory are still found there.
+        max_disk_entries : int
+            Maximum number of files in the disk tier. The least recently used are deleted first.
+        """
+        if max_entries < 1 or max_bytes < 1 or max_disk_entries < 1:
+            raise ValueError("max_entries, max_bytes and max_disk_entries must be positive")
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self.max_disk_entries = max_disk_entries
+        self._entries = OrderedDict() # key -> bytes, least recently used first
+        self._bytes = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._disk_entries = 0
+        if disk_dir is not None:
+            os.makedirs(disk_dir, exist_ok=True)
+            self._disk_entries = len(self._disk_files())
+
+    @staticmethod
+    def key(fingerprint, params):
+        """
+        Build the cache key of a request.
+
+        Parameters:
+        -----------
+        fingerprint : str
+            Content hash of the models and output settings answering the request.
+        params : dict
+            JSON-serializable request parameters, e.g. order, length, seed, start state and tempo.
+
+        Returns:
+        --------
+        key : str
+            Hex digest of the fingerprint and parameters.
+        """
+        digest = hashlib.sha256(fingerprint.encode())
+        digest.update(json.dumps(params, sort_keys=True).encode())
+        return digest.hexdigest()
+
+    def get(self, key):
+        """
+        Look up an entry, from memory first and then from disk.
+
+        Parameters:
+        -----------
+        key : str
+            Key built with GenerationCache.key.
+
+        Returns:
+        --------
+        midi_bytes : bytes or None
+            The cached bytes, or None on a miss.
+        """
+        data = self._entries.get(key)
+        if data is not None:
+            self._entries.move_to_end(key)
+            self.memory_hits += 1
+            return data
+        if self.disk_dir is not None:
+            path = self._disk_path(key)
+            try:
+                with open(path, "rb") as f:
+                    data = f.read()
+                os.utime(path) # mark as recently used for disk eviction
+            except OSError:
+                data = None
+            if data is not None:
+                self.disk_hits += 1
+                self._remember(key, data)
+                return data
+        self.misses += 1
+        return None
+
+    def put(self, key, data):
+        """
+        Store an entry in memory and, with a disk tier, on disk.
+
+        Parameters:
+        -----------
+        key : str
+            Key built with GenerationCache.key.
+        data : bytes
+            MIDI bytes to cache.
+        """
+        self._remember(key, data)
+        if self.disk_dir is None:
+            return
+        path = self._disk_path(key)
+        if os.path.exists(path):
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary_path = f"{path}.{os.getpid()}.tmp"
+        with open(temporary_path, "wb") as f:
+            f.write(data)
+        os.replace(temporary_path, path)
+        self._disk_entries += 1
+        if self._disk_entries > self.max_disk_entries:
+            self._evict_disk()
+
+    def clear(self):
+        """Drop the in-memory entries and reset the statistics. The disk tier is kept."""
+        self._entries.clear()
+        self._bytes = 0
+        self.memory_hits = self.disk_hits = self.misses = 0
+
+    def stats(self):
+        """
+        Get hit and miss statistics.
+
+        Returns:
+        --------
+        stats : dict
+            Hits (memory and disk), misses, hit rate, and the number and size of memory entries.
+        """
+        hits = self.memory_hits + self.disk_hits
+        lookups = hits + self.misses
+        return {
+            "hits": hits,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": hits / lookups if lookups else 0.0,
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "disk_entries": self._disk_entries,
+        }
+
+    def _remember(self, key, data):
+        if len(data) > self.max_bytes:
+            return
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self._bytes -= len(previous)
+        self._entries[key] = data
+        self._bytes += len(data)
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= len(evicted)
+
+    def _disk_path(self, key):
+        # Two-character subdirectories keep directory listings short
+        return os.path.join(self.disk_dir, key[:2], f"{key}.mid")
+
+    def _disk_files(self):
+        return [os.path.join(root, name) for root, _, names in os.walk(self.disk_dir)
+                for name in names if name.endswith(".mid")]
+
+    def _evict_disk(self):
+        # Delete down to 90% of the limit, so the directory is not scanned on every put
+        files = []
+        for path in self._disk_files():
+            try:
+                files.append((os.path.getmtime(path), path))
+            except OSError:
+                pass
+        files.sort()
+        excess = len(files) - int(self.max_disk_entries * 0.9)
+        for _, path in files[:max(excess, 0)]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        self._disk_entries = len(files) - max(excess, 0)
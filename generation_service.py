@@ -0,0 +1,487 @@
+import argparse
+import asyncio
+import hashlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import time
+import urllib.parse
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from create_midi import MidiFileWriter
+from generation_cache import GenerationCache
+from model.VanillaFirstOrderMarkovChain import VanillaFirstOrderMarkovChain
+from model.VanillaSecondOrderMarkovChain import VanillaSecondOrderMarkovChain
+from model.SharedModelTables import SharedModelTables, default_shared_directory
+
+MODEL_CLASSES = {1: VanillaFirstOrderMarkovChain, 2: VanillaSecondOrderMarkovChain}
+SETTINGS_FILE = "settings.json"
+MAX_LENGTH = 10000
+MAX_BODY = 64 * 1024 # bytes of a POST body
+
+def save_generation_models(model_dir, models, ticks_per_beat, tempo, duration_scale=1.0):
+    """
+    Save fitted models and output settings for the generation service.
+
+    Parameters:
+    -----------
+    model_dir : str
+        Directory to write to.
+    models : dict
+        {order: (pitch_model, duration_model)} with order 1 or 2.
+    ticks_per_beat : int
+        Resolution of the generated MIDI files.
+    tempo : int
+        Default tempo of the generated MIDI files, in microseconds per beat.
+    duration_scale : float
+        Factor converting duration states to output ticks, e.g. for quantized durations.
+    """
+    os.makedirs(model_dir, exist_ok=True)
+    for order, (pitch_model, duration_model) in models.items():
+        pitch_model.save_counts(os.path.join(model_dir, f"pitch_order{order}.npz"))
+        duration_model.save_counts(os.path.join(model_dir, f"duration_order{order}.npz"))
+    settings = {
+        "orders": sorted(models),
+        "ticks_per_beat": int(ticks_per_beat),
+        "tempo": int(tempo),
+        "duration_scale": float(duration_scale),
+    }
+    with open(os.path.join(model_dir, SETTINGS_FILE), "w") as f:
+        json.dump(settings, f, indent=2)
+
+class Generator:
+    """
+    Models loaded once from a directory written by save_generation_models, turning generation
+    requests into MIDI bytes.
+    """
+
+    def __init__(self, model_dir, cdf_dtype=np.float32, tables_dir=None, cache=None):
+        """
+        Parameters:
+        -----------
+        model_dir : str
+            Directory written by save_generation_models.
+        cdf_dtype : numpy dtype or None
+            Sampling table type of the loaded models, see the models' cdf_dtype.
+        tables_dir : str or None
+            Directory written by publish_tables. The models then attach to the published tables
+            instead of being fitted from the saved counts.
+        cache : GenerationCache or None
+            Cache of the MIDI bytes of seeded requests.
+        """
+        with open(os.path.join(model_dir, SETTINGS_FILE)) as f:
+            settings = json.load(f)
+        self.ticks_per_beat = settings["ticks_per_beat"]
+        self.tempo = settings["tempo"]
+        self.duration_scale = settings["duration_scale"]
+        self.cache = cache
+        self.models = {}
+        for order in settings["orders"]:
+            if tables_dir is not None:
+                self.models[order] = (
+                    SharedModelTables(os.path.join(tables_dir, f"pitch_order{order}")).attach(),
+                    SharedModelTables(os.path.join(tables_dir, f"duration_order{order}")).attach(),
+                )
+                continue
+            model_class = MODEL_CLASSES[order]
+            self.models[order] = (
+                model_class.load_counts(os.path.join(model_dir, f"pitch_order{order}.npz"), cdf_dtype=cdf_dtype),
+                model_class.load_counts(os.path.join(model_dir, f"duration_order{order}.npz"), cdf_dtype=cdf_dtype),
+            )
+
+    def publish_tables(self, tables_dir):
+        """
+        Publish the tables of every model once, for other processes to attach to with tables_dir.
+
+        Parameters:
+        -----------
+        tables_dir : str
+            Directory to write to, ideally on a RAM-backed file system such as /dev/shm.
+        """
+        for order, (pitch_model, duration_model) in self.models.items():
+            SharedModelTables(os.path.join(tables_dir, f"pitch_order{order}")).publish(pitch_model)
+            SharedModelTables(os.path.join(tables_dir, f"duration_order{order}")).publish(duration_model)
+
+    def fingerprint(self, order):
+        """
+        Get a content hash of the models and output settings of one order, for cache keys.
+
+        Parameters:
+        -----------
+        order : int
+            Markov chain order, 1 or 2.
+
+        Returns:
+        --------
+        fingerprint : str
+            Hex digest, changing whenever a model is refit.
+        """
+        pitch_model, duration_model = self.models[order]
+        settings = (pitch_model.fingerprint(), duration_model.fingerprint(),
+                    self.ticks_per_beat, self.tempo, self.duration_scale)
+        return hashlib.sha256(repr(settings).encode()).hexdigest()
+
+    def generate(self, order=1, length=100, seed=None, start_state=None, tempo=None):
+        """
+        Generate a melody and encode it as a MIDI file.
+
+        Parameters:
+        -----------
+        order : int
+            Markov chain order, 1 or 2.
+        length : int
+            Number of notes.
+        seed : int or None
+            Random seed. Pitches and durations are both sampled from this seed, as in run_model.py.
+        start_state : int, pair of int or None
+            First pitch (order 1) or first two pitches (order 2).
+        tempo : int or None
+            Tempo in microseconds per beat. Defaults to the saved tempo.
+
+        Returns:
+        --------
+        midi_bytes : bytes
+            Contents of the MIDI file.
+        """
+        key = None
+        if self.cache is not None and seed is not None:
+            params = {"order": order, "length": length, "seed": seed, "start_state": start_state, "tempo": tempo}
+            key = GenerationCache.key(self.fingerprint(order), params)
+            midi_bytes = self.cache.get(key)
+            if midi_bytes is not None:
+                return midi_bytes
+
+        pitch_model, duration_model = self.models[order]
+        if start_state is not None and order == 2:
+            start_state = tuple(start_state)
+        pitches = pitch_model.inference_prob(start_state=start_state, length=length, random_seed=seed)
+        durations = duration_model.inference_prob(start_state=None, length=length, random_seed=seed)
+        if self.duration_scale != 1.0:
+            durations = np.maximum(np.rint(np.asarray(durations) * self.duration_scale), 1).astype(int).tolist()
+        buffer = io.BytesIO()
+        with MidiFileWriter(buffer, self.ticks_per_beat, tempo or self.tempo) as writer:
+            writer.write_notes(zip(pitches, durations))
+        midi_bytes = buffer.getvalue()
+        if key is not None:
+            self.cache.put(key, midi_bytes)
+        return midi_bytes
+
+def parse_generation_request(params, orders=(1, 2)):
+    """
+    Validate generation parameters from a query string or JSON body.
+
+    Parameters:
+    -----------
+    params : dict
+        Raw values. Query string values are strings; start_state may be "60" or "60,62".
+    orders : iterable of int
+        Orders of the loaded models.
+
+    Returns:
+    --------
+    request : dict
+        Keyword arguments for Generator.generate.
+    """
+    def integer(name, default=None):
+        value = params.get(name, default)
+        if value is None or value == "":
+            return default
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"{name} must be an integer, got {value!r}")
+
+    order = integer("order", 1)
+    if order not in orders:
+        raise ValueError(f"order must be one of {sorted(orders)}, got {order}")
+    length = integer("length", 100)
+    if not 2 <= length <= MAX_LENGTH:
+        raise ValueError(f"length must be between 2 and {MAX_LENGTH}, got {length}")
+    tempo = integer("tempo")
+    if tempo is not None and tempo <= 0:
+        raise ValueError(f"tempo must be positive, got {tempo}")
+
+    start_state = params.get("start_state")
+    if isinstance(start_state, str):
+        start_state = [part for part in start_state.split(",") if part.strip()] or None
+    if start_state is not None:
+        if not isinstance(start_state, list):
+            start_state = [start_state]
+        try:
+            start_state = [int(state) for state in start_state]
+        except (TypeError, ValueError):
+            raise ValueError(f"start_state must be integers, got {params.get('start_state')!r}")
+        if len(start_state) != order:
+            raise ValueError(f"start_state needs {order} pitch(es) for order {order}")
+        start_state = start_state[0] if order == 1 else start_state
+
+    return {"order": order, "length": length, "seed": integer("seed"), "start_state": start_state, "tempo": tempo}
+
+# Generator of the worker process, created once per worker
+_worker_generator = None
+
+def _init_worker(model_dir, cdf_dtype, tables_dir):
+    global _worker_generator
+    _worker_generator = Generator(model_dir, cdf_dtype, tables_dir)
+
+def _publish_worker(model_dir, cdf_dtype, tables_dir):
+    Generator(model_dir, cdf_dtype).publish_tables(tables_dir)
+
+def _generate_worker(request):
+    return _worker_generator.generate(**request)
+
+def _worker_fingerprints():
+    return {order: _worker_generator.fingerprint(order) for order in _worker_generator.models}
+
+def _worker_ready():
+    time.sleep(0.05) # keep the worker busy so the warm-up tasks start every worker
+    return os.getpid()
+
+class GenerationServer:
+    """
+    Asyncio HTTP server answering generation requests with MIDI bytes.
+
+    GET /generate?order=1&length=100&seed=42&start_state=60&tempo=500000, or POST /generate with
+    the same fields as a JSON object. Sampling runs in a process pool whose workers load the
+    models once; process-local random state keeps seeded requests reproducible under concurrency.
+    With share_tables, the models are fitted once and published as memory-mapped tables that every
+    worker attaches to, so memory use does not grow with the number of workers.
+    Seeded requests are answered from a GenerationCache when cache_size is nonzero.
+    GET /health reports the loaded orders and the cache statistics.
+    """
+
+    def __init__(self, model_dir, host="127.0.0.1", port=8765, workers=None, cdf_dtype=np.float32,
+                 share_tables=True, cache_size=1024, cache_dir=None):
+        self.model_dir = model_dir
+        self.host = host
+        self.port = port
+        self.workers = workers or os.cpu_count() or 1
+        self.cdf_dtype = cdf_dtype
+        self.share_tables = share_tables
+        with open(os.path.join(model_dir, SETTINGS_FILE)) as f:
+            self.orders = tuple(json.load(f)["orders"])
+        self.cache = GenerationCache(cache_size, disk_dir=cache_dir) if cache_size else None
+        self._fingerprints = {}
+        self._executor = None
+        self._server = None
+        self._tables_dir = None
+
+    async def start(self):
+        """Start the worker pool and the server. Returns the bound port."""
+        if self.share_tables:
+            self._tables_dir = tempfile.mkdtemp(prefix="generation-tables-", dir=default_shared_directory())
+            # Fit in a helper process: freed model memory in this process would otherwise be inherited
+            # by the forked workers and rewritten by their allocations, giving each worker a private copy
+            with ProcessPoolExecutor(max_workers=1) as executor:
+                executor.submit(_publish_worker, self.model_dir, self.cdf_dtype, self._tables_dir).result()
+        self._executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                             initargs=(self.model_dir, self.cdf_dtype, self._tables_dir))
+        loop = asyncio.get_running_loop()
+        # Start and load every worker before accepting requests
+        await asyncio.gather(*[loop.run_in_executor(self._executor, _worker_ready) for _ in range(self.workers)])
+        self._fingerprints = await loop.run_in_executor(self._executor, _worker_fingerprints)
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self.port
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        if self._executor is not None:
+            self._executor.shutdown()
+        if self._tables_dir is not None:
+            shutil.rmtree(self._tables_dir, ignore_errors=True)
+            self._tables_dir = None
+
+    async def _handle_connection(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                try:
+                    method, target, version = request_line.decode("latin-1").split()
+                except ValueError:
+                    await self._respond(writer, 400, "application/json", b'{"error": "Malformed request line"}', False)
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                try:
+                    length = int(headers.get("content-length", 0) or 0)
+                    if length < 0:
+                        raise ValueError
+                except ValueError:
+                    await self._respond(writer, 400, "application/json", b'{"error": "Invalid Content-Length"}', False)
+                    break
+                if length > MAX_BODY:
+                    # Answer before reading, and close since the unread body is still in the stream
+                    await self._respond(writer, 413, "application/json",
+                                        json.dumps({"error": f"Body exceeds {MAX_BODY} bytes"}).encode(), False)
+                    break
+                body = await reader.readexactly(length)
+                keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+
+                status, content_type, payload = await self._dispatch(method, target, body)
+                await self._respond(writer, status, content_type, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _dispatch(self, method, target, body):
+        url = urllib.parse.urlsplit(target)
+        if url.path == "/health" and method == "GET":
+            health = {"status": "ok", "orders": list(self.orders),
+                      "cache": self.cache.stats() if self.cache is not None else None}
+            return 200, "application/json", json.dumps(health).encode()
+        if url.path != "/generate":
+            return 404, "application/json", b'{"error": "Not found"}'
+        try:
+            if method == "GET":
+                params = dict(urllib.parse.parse_qsl(url.query))
+            elif method == "POST":
+                params = json.loads(body or b"{}")
+                if not isinstance(params, dict):
+                    raise ValueError("Request body must be a JSON object")
+            else:
+                return 405, "application/json", b'{"error": "Method not allowed"}'
+            request = parse_generation_request(params, self.orders)
+            key = None
+            if self.cache is not None and request["seed"] is not None:
+                key = GenerationCache.key(self._fingerprints[request["order"]], request)
+                midi_bytes = self.cache.get(key)
+                if midi_bytes is not None:
+                    return 200, "audio/midi", midi_bytes
+            loop = asyncio.get_running_loop()
+            midi_bytes = await loop.run_in_executor(self._executor, _generate_worker, request)
+            if key is not None:
+                self.cache.put(key, midi_bytes)
+        except ValueError as e: # includes invalid JSON and start states outside the state space
+            return 400, "application/json", json.dumps({"error": str(e)}).encode()
+        except Exception as e:
+            return 500, "application/json", json.dumps({"error": f"{type(e).__name__}: {e}"}).encode()
+        return 200, "audio/midi", midi_bytes
+
+    async def _respond(self, writer, status, content_type, payload, keep_alive):
+        reasons = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+                   413: "Payload Too Large", 500: "Internal Server Error"}
+        head = (f"HTTP/1.1 {status} {reasons[status]}\r\n"
+                f"Content-Type: {content_type}\r\n"
+                f"Content-Length: {len(payload)}\r\n"
+                f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+        writer.write(head.encode("latin-1") + payload)
+        await writer.drain()
+
+async def _benchmark_client(host, port, targets, latencies):
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        for target in targets:
+            start = time.perf_counter()
+            writer.write(f"GET {target} HTTP/1.1\r\nHost: {host}\r\n\r\n".encode("latin-1"))
+            await writer.drain()
+            status = (await reader.readline()).split()[1]
+            length = 0
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b""):
+                    break
+                name, _, value = line.decode("latin-1").partition(":")
+                if name.lower() == "content-length":
+                    length = int(value)
+            await reader.readexactly(length)
+            if status != b"200":
+                raise RuntimeError(f"Request {target} failed with status {status.decode()}")
+            latencies.append(time.perf_counter() - start)
+    finally:
+        writer.close()
+
+def _print_latencies(label, latencies, elapsed=None):
+    milliseconds = np.asarray(latencies) * 1000
+    p50, p95, p99 = np.percentile(milliseconds, [50, 95, 99])
+    message = f"{label}: {len(latencies)} requests, p50 {p50:.2f} ms, p95 {p95:.2f} ms, p99 {p99:.2f} ms"
+    if elapsed:
+        message += f", {len(latencies) / elapsed:.0f} requests/s"
+    print(message)
+
+async def run_benchmark(model_dir, n_requests=1000, concurrency=8, workers=None, order=1, length=100,
+                        share_tables=True, cache_size=1024):
+    """
+    Measure single-request latency in process, then latency and throughput of the HTTP server
+    under concurrent keep-alive clients. Every request uses a different seed; with a cache, the
+    same requests are sent a second time to measure cached responses.
+    """
+    generator = Generator(model_dir)
+    latencies = []
+    for seed in range(min(n_requests, 200)):
+        start = time.perf_counter()
+        generator.generate(order=order, length=length, seed=seed)
+        latencies.append(time.perf_counter() - start)
+    _print_latencies("In-process generate", latencies)
+
+    server = GenerationServer(model_dir, port=0, workers=workers, share_tables=share_tables, cache_size=cache_size)
+    port = await server.start()
+    try:
+        targets = [f"/generate?order={order}&length={length}&seed={seed}" for seed in range(n_requests)]
+        for label in ("HTTP", "HTTP, cached")[:2 if server.cache is not None else 1]:
+            latencies = []
+            start = time.perf_counter()
+            await asyncio.gather(*[
+                _benchmark_client(server.host, port, targets[client::concurrency], latencies)
+                for client in range(concurrency)
+            ])
+            _print_latencies(f"{label}, {concurrency} concurrent clients, {server.workers} workers", latencies,
+                             time.perf_counter() - start)
+        if server.cache is not None:
+            print(f"Cache: {server.cache.stats()}")
+    finally:
+        await server.stop()
+
+async def serve(model_dir, host, port, workers, share_tables=True, cache_size=1024, cache_dir=None):
+    server = GenerationServer(model_dir, host, port, workers, share_tables=share_tables,
+                              cache_size=cache_size, cache_dir=cache_dir)
+    await server.start()
+    print(f"Serving {model_dir} on http://{server.host}:{server.port} with {server.workers} workers")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.stop()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local MIDI generation service for saved models")
+    parser.add_argument("-m", "--model_dir", default="models", help="Directory written by save_generation_models")
+    parser.add_argument("--host", default="127.0.0.1", help="Address to listen on")
+    parser.add_argument("-p", "--port", type=int, default=8765, help="Port to listen on")
+    parser.add_argument("-w", "--workers", type=int, default=None, help="Number of worker processes")
+    parser.add_argument("--no_shared_tables", action="store_true",
+                        help="Fit the models in every worker instead of sharing one copy of the tables")
+    parser.add_argument("--cache_size", type=int, default=1024,
+                        help="Seeded responses kept in memory, 0 to disable the cache")
+    parser.add_argument("--cache_dir", default=None, help="Directory of the on-disk response cache")
+    parser.add_argument("--benchmark", action="store_true", help="Measure latency and throughput, then exit")
+    parser.add_argument("--requests", type=int, default=1000, help="Number of benchmark requests")
+    parser.add_argument("--concurrency", type=int, default=8, help="Number of concurrent benchmark clients")
+    parser.add_argument("--order", type=int, default=1, help="Model order used by the benchmark")
+    parser.add_argument("--length", type=int, default=100, help="Notes per benchmark request")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        asyncio.run(run_benchmark(args.model_dir, args.requests, args.concurrency, args.workers, args.order, args.length,
+                                  not args.no_shared_tables, args.cache_size))
+    else:
+        try:
+            asyncio.run(serve(args.model_dir, args.host, args.port, args.workers, not args.no_shared_tables,
+                              args.cache_size, args.cache_dir))
+        except KeyboardInterrupt:
+            pass
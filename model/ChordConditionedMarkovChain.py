@@ -0,0 +1,273 @@
+import numpy as np
+import random
+from itertools import chain
+from typing import List, Optional, Any, Dict, Tuple
+import matplotlib.pyplot as plt
+import seaborn as sns
+
+from model.MarkovChainMixins import StateSpaceMixin
+
+class ChordConditionedMarkovChain(StateSpaceMixin):
+    """
+    A first-order Markov chain model conditioned on the current chord, learned from the
+    chord-labelled melody segments produced by the preprocessing scripts (m21/m22).
+
+    All transition counts live in one stacked (n_chords, n_states, n_states) array, so sampling
+    under a chord progression only indexes into it. Counts are stored as uint32 and sampling
+    CDFs as float32 to keep hundreds of chord symbols affordable.
+    """
+
+    def __init__(self, state_space: List[Any], chord_space: List[str]):
+        """
+        Initialize the Markov chain model.
+
+        Parameters:
+        -----------
+        state_space : list
+            List of possible states. Must be provided. Sets are sorted so state indices are deterministic.
+        chord_space : list
+            List of possible chord symbols. Must be provided.
+        """
+        self._init_state_space(state_space)
+        if chord_space is None or len(chord_space) == 0:
+            raise ValueError("chord_space must be provided and non-empty")
+
+        self.chord_space = list(chord_space)
+        self.chord_to_idx = {chord: idx for idx, chord in enumerate(self.chord_space)}
+        self.n_chords = len(self.chord_space)
+
+        # count_tensor[chord, from, to]
+        self.count_tensor = np.zeros((self.n_chords, self.n_states, self.n_states), dtype=np.uint32)
+        self._cdf_tensor = None
+
+        self.is_fitted = False
+
+    def _chord_index(self, chord: str) -> int:
+        if chord not in self.chord_to_idx:
+            raise ValueError(f"Chord '{chord}' not in the chord space.")
+        return self.chord_to_idx[chord]
+
+    def _count(self, flat_indices: np.ndarray, offsets: np.ndarray, segment_chords: np.ndarray, isPitch: bool) -> np.ndarray:
+        """
+        Count the weighted transitions within each segment, under the segment's chord.
+        """
+        n = self.n_states
+        shape = (self.n_chords, n, n)
+        if len(flat_indices) < 2:
+            return np.zeros(shape, dtype=np.uint32)
+
+        within_segment = np.ones(len(flat_indices) - 1, dtype=bool)
+        boundaries = offsets[1:-1] - 1
+        within_segment[boundaries[(boundaries >= 0) & (boundaries < len(within_segment))]] = False
+        step_chords = np.repeat(segment_chords, np.diff(offsets))[:-1][within_segment]
+        current_indices = flat_indices[:-1][within_segment]
+        next_indices = flat_indices[1:][within_segment]
+
+        state_values = np.asarray(self.state_array.tolist(), dtype=float)
+        weights = self._transition_weights(state_values[current_indices], state_values[next_indices], isPitch)
+        flat_ids = (step_chords * n + current_indices) * n + next_indices
+        counts = np.bincount(flat_ids, weights=weights, minlength=self.n_chords * n * n)
+        return counts.astype(np.uint32).reshape(shape)
+
+    def calculate_transition_matrix(self, segments: List[Tuple[str, List[Any]]], isPitch = True) -> None:
+        """
+        Calculate the per-chord transition matrices from chord-labelled segments.
+        Transitions are only counted within a segment.
+
+        Parameters:
+        -----------
+        segments : list of (chord, sequence)
+            Chord symbol and state sequence of each segment. The m21 output can be passed as
+            [(seg["CHORD_SYMBOL"], seg["notes"]) for seg in segments].
+        isPitch : bool
+            Whether the states are pitches, selecting the transition weights.
+        """
+        offsets = np.zeros(len(segments) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(sequence) for _, sequence in segments])
+        flat_indices = self._to_indices(list(chain.from_iterable(sequence for _, sequence in segments)))
+        segment_chords = np.array([self._chord_index(chord) for chord, _ in segments], dtype=np.int64)
+
+        self.count_tensor = self._count(flat_indices, offsets, segment_chords, isPitch)
+        self._calculate_probabilities()
+        self.is_fitted = True
+
+    def calculate_transition_matrix_from_columns(self, columns: Dict[str, np.ndarray], isPitch = True) -> None:
+        """
+        Calculate the per-chord transition matrices from the columnar output of the preprocessing
+        scripts (see preprocessing/columnar.py), without per-note Python objects.
+
+        Parameters:
+        -----------
+        columns : dict of numpy.ndarray
+            Arrays "notes", "segment_offsets", "chord_ids" and "chord_symbols".
+        isPitch : bool
+            Whether the states are pitches, selecting the transition weights.
+        """
+        note_indices = self._to_indices(columns["notes"])
+        chord_remap = np.array([self._chord_index(chord) for chord in columns["chord_symbols"].tolist()], dtype=np.int64)
+        segment_chords = chord_remap[columns["chord_ids"]] if len(chord_remap) else np.zeros(0, dtype=np.int64)
+
+        self.count_tensor = self._count(note_indices, np.asarray(columns["segment_offsets"]), segment_chords, isPitch)
+        self._calculate_probabilities()
+        self.is_fitted = True
+
+    def _calculate_probabilities(self) -> None:
+        """
+        Build the sampling CDFs from the count tensor. Rows never observed under a chord back off
+        to the chord-independent row, i.e. the counts summed over all chords.
+        """
+        cdf = np.cumsum(self.count_tensor, axis=2, dtype=float)
+        marginal_cdf = cdf.sum(axis=0)
+        unseen = cdf[:, :, -1] == 0
+        cdf[unseen] = np.broadcast_to(marginal_cdf, cdf.shape)[unseen]
+
+        totals = cdf[:, :, -1:]
+        np.divide(cdf, totals, out=cdf, where=totals > 0)
+        cdf[:, :, -1] = np.where(totals[:, :, 0] > 0, 1.0, 0.0) # guard against rounding below 1
+        self._cdf_tensor = cdf.astype(np.float32)
+
+    def _get_initial_state(self, chord_idx: int, start_state: Optional[Any] = None, random_seed: Optional[int] = None) -> int:
+        """
+        Helper function to handle the common pre-check logic for inference methods.
+
+        Returns:
+        --------
+        current_idx : int
+            Index of the starting state.
+        """
+        if not self.is_fitted:
+            raise ValueError("Model not fitted. Call calculate_transition_matrix first.")
+
+        if random_seed is not None:
+            np.random.seed(random_seed)
+            random.seed(random_seed)
+
+        if start_state is None:
+            # Prefer states with outgoing transitions under the first chord
+            valid_start_indices = np.where(self._cdf_tensor[chord_idx, :, -1] > 0)[0]
+            if len(valid_start_indices) == 0:
+                raise ValueError("No valid start states found in the transition matrix.")
+            return int(np.random.choice(valid_start_indices))
+        if start_state not in self.state_to_idx:
+            raise ValueError(f"Start state '{start_state}' not in the state space.")
+        return self.state_to_idx[start_state]
+
+    def inference_prob(self, chord_progression: List[Tuple[str, int]], start_state: Optional[Any] = None,
+                       random_seed: Optional[int] = None) -> List[Any]:
+        """
+        Generate a new sequence under a chord progression, using weighted random selection
+        according to the transition probabilities of the chord each note falls under.
+
+        Parameters:
+        -----------
+        chord_progression : list of (chord, length)
+            Chord symbols and the number of states to generate under each.
+        start_state : state or None
+            The starting state. If None, will be chosen randomly.
+        random_seed : int or None
+            Random seed for reproducibility.
+
+        Returns:
+        --------
+        sequence : list
+            The generated sequence. It stops early if a state has no outgoing transitions.
+        """
+        chord_indices = np.array([self._chord_index(chord) for chord, _ in chord_progression], dtype=np.int64)
+        lengths = np.array([length for _, length in chord_progression], dtype=np.int64)
+        if len(chord_indices) == 0 or lengths.sum() <= 0:
+            return []
+        step_chords = np.repeat(chord_indices, np.maximum(lengths, 0))
+
+        current_idx = self._get_initial_state(int(step_chords[0]), start_state, random_seed)
+        uniforms = np.random.random_sample(len(step_chords) - 1)
+        cdf_tensor = self._cdf_tensor
+        indices = [current_idx]
+
+        for chord_idx, u in zip(step_chords[1:].tolist(), uniforms.tolist()):
+            cdf = cdf_tensor[chord_idx, current_idx]
+            # If there are no transitions from current state, break
+            if cdf[-1] == 0:
+                break
+            current_idx = int(np.searchsorted(cdf, u, side='right'))
+            indices.append(current_idx)
+
+        return self.state_array[indices].tolist()
+
+    def get_transition_matrix(self, chord: str) -> np.ndarray:
+        """
+        Get the transition matrix under one chord, including the backed-off rows.
+
+        Parameters:
+        -----------
+        chord : str
+            The chord symbol.
+
+        Returns:
+        --------
+        transition_matrix : numpy.ndarray
+            The (n_states, n_states) transition probability matrix.
+        """
+        if not self.is_fitted:
+            raise ValueError("Model not fitted. Call calculate_transition_matrix first.")
+        cdf = self._cdf_tensor[self._chord_index(chord)].astype(float)
+        return np.diff(cdf, axis=1, prepend=0.0)
+
+    def get_count_tensor(self) -> np.ndarray:
+        """
+        Get the count tensor.
+
+        Returns:
+        --------
+        count_tensor : numpy.ndarray
+            The (n_chords, n_states, n_states) transition counts.
+        """
+        return self.count_tensor
+
+    def get_chord_space(self) -> List[str]:
+        """
+        Get the chord space.
+
+        Returns:
+        --------
+        chord_space : list
+            The list of chord symbols.
+        """
+        return self.chord_space
+
+    def visualize_transition_matrix(self, chord: str, save_path=None):
+        """
+        Visualize the transition matrix under one chord as a heatmap.
+
+        Parameters:
+        -----------
+        chord : str
+            The chord symbol.
+        save_path : str or None
+            If provided, save the visualization to this path.
+
+        Returns:
+        --------
+        fig : matplotlib.figure.Figure
+            The figure containing the visualization.
+        """
+        transition_matrix = self.get_transition_matrix(chord)
+        labels = [str(state) for state in self.state_space]
+
+        plt.figure(figsize=(10, 8))
+        sns.heatmap(
+            transition_matrix,
+            cmap='viridis',
+            xticklabels=labels,
+            yticklabels=labels,
+            vmin=0,
+            vmax=1.0
+        )
+        plt.title(f'Transition Matrix Heatmap ({chord})')
+        plt.xlabel('To State')
+        plt.ylabel('From State')
+        plt.tight_layout()
+
+        if save_path:
+            plt.savefig(save_path)
+
+        return plt.gcf()
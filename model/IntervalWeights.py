@@ -0,0 +1,36 @@
+import numpy as np
+
+# Harmonic weight of every interval modulo the octave, in semitones: consonant intervals score
+# high, dissonant ones negative. Shared by the examiner's harmonic score and harmony-biased sampling.
+INTERVAL_WEIGHTS = {
+    0: 1.0,
+    7: 0.9,
+    5: 0.8,
+    4: 0.7,
+    3: 0.6,
+    8: 0.5,
+    9: 0.5,
+    2: 0.2,
+    10: 0.2,
+    6: -0.8,
+    1: -0.5,
+    11: -0.3,
+}
+
+def interval_scores(first_pitches, second_pitches) -> np.ndarray:
+    """
+    Interval weight between MIDI pitches, broadcasting like numpy arithmetic.
+
+    Parameters:
+    -----------
+    first_pitches, second_pitches : array-like of int
+        MIDI pitches.
+
+    Returns:
+    --------
+    scores : numpy.ndarray
+        INTERVAL_WEIGHTS of abs(first - second) % 12.
+    """
+    weights = np.array([INTERVAL_WEIGHTS.get(interval, 0) for interval in range(12)], dtype=float)
+    intervals = np.abs(np.asarray(first_pitches) - np.asarray(second_pitches)) % 12
+    return weights[intervals]
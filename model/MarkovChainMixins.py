@@ -0,0 +1,369 @@
+import hashlib
+import numpy as np
+from itertools import chain
+from typing import Iterable, List, Optional, Any, Tuple
+
+from model.IntervalWeights import interval_scores
+
+class StateSpaceMixin:
+    """
+    State space handling shared by the Markov chain models: the state to index mappings, the
+    vectorized lookup of integer states and the pitch and duration transition weights.
+    """
+    
+    def _init_state_space(self, state_space: List[Any]) -> None:
+        """
+        Set up the state space and its index mappings. Sets are sorted so state indices are
+        deterministic.
+        """
+        if state_space is None or len(state_space) == 0:
+            raise ValueError("state_space must be provided and non-empty")
+        if isinstance(state_space, (set, frozenset)):
+            # Sets have no stable order, so sort them to get the same state indices on every run
+            try:
+                state_space = sorted(state_space)
+            except TypeError:
+                state_space = sorted(state_space, key=repr)
+        self.state_space = state_space
+        self.state_to_idx = {state: idx for idx, state in enumerate(state_space)}
+        self.idx_to_state = {idx: state for idx, state in enumerate(state_space)}
+        self.n_states = len(state_space)
+        self.state_array = np.empty(self.n_states, dtype=object) # idx -> state, for mapping index arrays back to states
+        self.state_array[:] = [self.idx_to_state[idx] for idx in range(self.n_states)]
+        self._state_lookup, self._state_offset = self._build_state_lookup()
+    
+    def get_state_space(self) -> List[Any]:
+        """
+        Get the state space.
+        
+        Returns:
+        --------
+        state_space : list
+            The list of states.
+        """
+        return self.state_space
+    
+    def _build_state_lookup(self) -> Tuple[Optional[np.ndarray], int]:
+        """
+        Build a lookup array from integer state value to state index, so whole sequences of
+        integer states (pitches, tick durations) are mapped in one vectorized operation.
+        
+        Returns:
+        --------
+        lookup, offset : numpy.ndarray or None, int
+            lookup[value - offset] is the index of state value, or -1 if it is not a state.
+            None if the states are not all integers or span more than 2**20 values.
+        """
+        values = self.state_array.tolist()
+        if not all(isinstance(value, (int, np.integer)) and not isinstance(value, bool) for value in values):
+            return None, 0
+        low, high = int(min(values)), int(max(values))
+        if high - low >= 1 << 20:
+            return None, 0
+        lookup = np.full(high - low + 1, -1, dtype=np.int64)
+        lookup[np.array(values, dtype=np.int64) - low] = np.arange(self.n_states)
+        return lookup, low
+    
+    def _to_indices(self, sequence: List[Any]) -> np.ndarray:
+        """
+        Map a sequence of states to an array of state indices. Raises a ValueError listing
+        every state that is not in the state space.
+        """
+        if self._state_lookup is not None:
+            values = np.asarray(sequence)
+            if values.ndim == 1 and (values.dtype.kind in 'iu' or values.size == 0):
+                positions = values.astype(np.int64) - self._state_offset
+                in_range = (positions >= 0) & (positions < len(self._state_lookup))
+                indices = np.full(len(positions), -1, dtype=np.int64)
+                indices[in_range] = self._state_lookup[positions[in_range]]
+                if (indices < 0).any():
+                    self._raise_unknown_states(values[indices < 0].tolist())
+                return indices
+        
+        indices = np.fromiter((self.state_to_idx.get(state, -1) for state in sequence), dtype=np.int64,
+                              count=len(sequence))
+        if (indices < 0).any():
+            self._raise_unknown_states([state for state in sequence if state not in self.state_to_idx])
+        return indices
+    
+    def _raise_unknown_states(self, states: List[Any]) -> None:
+        unknown = list(dict.fromkeys(states))
+        if len(unknown) == 1:
+            raise ValueError(f"State '{unknown[0]}' not in the state space.")
+        listed = ", ".join(repr(state) for state in unknown[:20]) + (", ..." if len(unknown) > 20 else "")
+        raise ValueError(f"{len(unknown)} states not in the state space: {listed}")
+    
+    def _transition_weights(self, current_values: np.ndarray, next_values: np.ndarray, isPitch: bool) -> np.ndarray:
+        """
+        Vectorized form of the transition weights used when counting transitions:
+        2 for transitions within an octave (pitch) or within 100 ticks (duration), 1 otherwise.
+        """
+        if isPitch:
+            return np.where(np.abs(current_values - next_values) <= 12, 2, 1)
+        return np.where(np.abs(current_values - next_values) > 100, 1, 2)
+
+class CountModelMixin(StateSpaceMixin):
+    """
+    Helpers shared by the first- and second-order models, which keep their counts in one
+    array (get_count_array / set_count_array) with the last axis indexing the next state:
+    storage options, sequence flattening, the sampling-table transforms, transposition,
+    fingerprints and saving.
+    """
+    
+    def _init_storage_options(self, count_dtype, prob_dtype, cdf_dtype, cdf_tolerance: float) -> None:
+        """
+        Validate and set the storage types, see the models' constructors.
+        """
+        if cdf_dtype is not None and np.dtype(cdf_dtype) not in (np.dtype(np.float32), np.dtype(np.uint16)):
+            raise ValueError(f"cdf_dtype must be None, float32 or uint16, got {np.dtype(cdf_dtype)}")
+        self.count_dtype = np.dtype(count_dtype)
+        self.prob_dtype = np.dtype(prob_dtype)
+        self.cdf_dtype = None if cdf_dtype is None else np.dtype(cdf_dtype)
+        self.cdf_tolerance = cdf_tolerance
+    
+    def _flatten_sequences(self, sequences: List[List[Any]],
+                           offsets: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Map sequences of states to one flat index array plus sequence offsets.
+        If offsets are given, sequences is already one flat array of states.
+        
+        Returns:
+        --------
+        flat_indices : numpy.ndarray
+            Indices of all sequences, concatenated.
+        offsets : numpy.ndarray
+            Array of length len(sequences) + 1. Sequence k spans flat_indices[offsets[k]:offsets[k + 1]].
+        """
+        if offsets is not None:
+            offsets = np.asarray(offsets, dtype=np.int64)
+            if (offsets.ndim != 1 or len(offsets) == 0 or offsets[0] != 0 or offsets[-1] != len(sequences)
+                    or np.any(np.diff(offsets) < 0)):
+                raise ValueError("offsets must start at 0, end at the number of states and be non-decreasing.")
+            return self._to_indices(sequences), offsets
+        
+        offsets = np.zeros(len(sequences) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(sequence) for sequence in sequences])
+        flat_indices = self._to_indices(list(chain.from_iterable(sequences)))
+        return flat_indices, offsets
+    
+    def count_starts(self, sequences: List[List[Any]], offsets: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Count how often each state (pair) starts a sequence, without modifying the model.
+        Counts from different shards of a corpus can be summed and assigned to start_counts.
+        
+        Parameters:
+        -----------
+        sequences : list of lists
+            List of sequences, where each sequence is a list of states.
+        offsets : numpy.ndarray or None
+            Sequence boundaries when sequences is one flat array, see calculate_transition_matrix.
+        
+        Returns:
+        --------
+        start_counts : numpy.ndarray
+            Integer array of start counts, shaped like start_counts after calculate_transition_matrix.
+        """
+        flat_indices, offsets = self._flatten_sequences(sequences, offsets)
+        return self._count_starts(flat_indices, offsets)
+    
+    @staticmethod
+    def _pitch_class_key(pitch_classes: Iterable) -> Tuple[bool, ...]:
+        """
+        Normalize a scale given as pitch classes (0 = C ... 11 = B) or a mask of 12 booleans.
+        """
+        values = np.asarray(list(pitch_classes))
+        if values.dtype == bool:
+            if values.shape != (12,):
+                raise ValueError(f"A pitch class mask needs 12 values, got {values.shape[0]}")
+            mask = values
+        else:
+            if values.size == 0 or not np.issubdtype(values.dtype, np.integer) or values.min() < 0 or values.max() > 11:
+                raise ValueError(f"pitch_classes must be integers between 0 and 11, got {list(pitch_classes)}")
+            mask = np.zeros(12, dtype=bool)
+            mask[values] = True
+        return tuple(bool(allowed) for allowed in mask)
+    
+    def _pitch_class_states(self, pitch_class_key: Tuple[bool, ...]) -> np.ndarray:
+        """
+        Boolean mask of the MIDI pitch states whose pitch class is allowed.
+        """
+        try:
+            values = np.asarray(self.state_array.tolist(), dtype=float)
+        except (TypeError, ValueError):
+            raise ValueError("Pitch classes need MIDI pitch states.")
+        integral = values == np.rint(values)
+        pitch_class = np.where(integral, values, 0).astype(np.int64) % 12
+        return integral & np.asarray(pitch_class_key)[pitch_class]
+    
+    @staticmethod
+    def _truncate_weights(weights: np.ndarray, temperature: Optional[float] = None, top_k: Optional[int] = None,
+                          top_p: Optional[float] = None) -> np.ndarray:
+        """
+        Apply temperature, then keep only the top_k most likely next states and the smallest
+        set of most likely next states covering top_p of each row's probability. Works on the
+        last axis; rows are left unnormalized.
+        """
+        if temperature is not None:
+            # Scale rows by their maximum first so small temperatures do not underflow
+            row_max = weights.max(axis=-1, keepdims=True)
+            np.divide(weights, row_max, out=weights, where=row_max > 0)
+            weights **= 1.0 / temperature
+        if top_k is None and top_p is None:
+            return weights
+        
+        # Descending order per row; the stable sort keeps ties in state order
+        order = np.argsort(-weights, axis=-1, kind='stable')
+        sorted_weights = np.take_along_axis(weights, order, axis=-1)
+        keep_sorted = np.ones(sorted_weights.shape, dtype=bool)
+        if top_k is not None:
+            keep_sorted[..., top_k:] = False
+        if top_p is not None:
+            cumulative = np.cumsum(sorted_weights, axis=-1)
+            totals = cumulative[..., -1:]
+            # Keep a state while the mass before it is still short of top_p, so the top state is always kept
+            keep_sorted &= (cumulative - sorted_weights) < top_p * totals
+        keep = np.empty_like(keep_sorted)
+        np.put_along_axis(keep, order, keep_sorted, axis=-1)
+        return np.where(keep, weights, 0.0)
+    
+    def _weights_to_cdf(self, weights: np.ndarray) -> np.ndarray:
+        """
+        Normalize non-negative weights per row into a CDF table. Rows without weight stay zero,
+        so they remain dead ends. Stored as float32 when the model uses reduced-precision CDFs.
+        """
+        cdf = np.cumsum(weights, axis=-1)
+        totals = cdf[..., -1:]
+        np.divide(cdf, totals, out=cdf, where=totals > 0)
+        return cdf if self.cdf_dtype is None else cdf.astype(np.float32)
+    
+    def _harmony_scores(self) -> np.ndarray:
+        """
+        Examiner interval score (see model.IntervalWeights) of every transition between MIDI
+        pitch states, shape (n_states, n_states). Transitions from or to states outside the piano
+        range score 0.
+        """
+        try:
+            values = np.asarray(self.state_array.tolist(), dtype=float)
+        except (TypeError, ValueError):
+            raise ValueError("Harmony bias needs MIDI pitch states.")
+        piano = (values == np.rint(values)) & (values >= 21) & (values <= 108)
+        pitches = values[piano].astype(np.int64)
+        scores = np.zeros((self.n_states, self.n_states))
+        scores[np.ix_(piano, piano)] = interval_scores(pitches[:, None], pitches[None, :])
+        return scores
+    
+    def augment_transpositions(self, shifts=range(-5, 7)) -> None:
+        """
+        Add the counts of the training data transposed by each shift in semitones, without
+        re-counting it. Transposing moves every transition to shifted state indices and keeps
+        its pitch weight, so the count array is shifted and added once per shift. The start
+        counts used by start_mode='empirical' are transposed the same way. Transitions and
+        starts that would leave the state space are dropped, so use a state space covering the
+        transposed range (e.g. range(128)) to keep them.
+        
+        Parameters:
+        -----------
+        shifts : iterable of int
+            Transpositions in semitones. Include 0 to keep the original counts.
+            The default covers all 12 keys.
+        """
+        if not self.is_fitted:
+            raise ValueError("Model not fitted. Call calculate_transition_matrix first.")
+        if not all(isinstance(state, (int, np.integer)) and not isinstance(state, bool) for state in self.state_array):
+            raise ValueError("Transposition needs integer pitch states.")
+        
+        counts = self.get_count_array()
+        augmented = np.zeros(counts.shape, dtype=np.int64 if np.issubdtype(counts.dtype, np.integer) else float)
+        start_counts = self.start_counts
+        augmented_starts = None if start_counts is None else np.zeros(start_counts.shape, dtype=np.int64)
+        for shift in shifts:
+            target = np.array([self.state_to_idx.get(state + shift, -1) for state in self.state_array.tolist()])
+            source = np.flatnonzero(target >= 0)
+            if len(source) == 0:
+                continue
+            target = target[source]
+            if source[-1] - source[0] + 1 == len(source) and np.all(np.diff(target) == 1):
+                # Contiguous runs of states (e.g. a pitch range) shift as plain slices
+                source = slice(source[0], source[-1] + 1)
+                target = slice(target[0], target[-1] + 1)
+                augmented[(target,) * counts.ndim] += counts[(source,) * counts.ndim]
+                if augmented_starts is not None:
+                    augmented_starts[(target,) * start_counts.ndim] += start_counts[(source,) * start_counts.ndim]
+            else:
+                augmented[np.ix_(*[target] * counts.ndim)] += counts[np.ix_(*[source] * counts.ndim)]
+                if augmented_starts is not None:
+                    start_index = np.ix_(*[target] * start_counts.ndim)
+                    augmented_starts[start_index] += start_counts[np.ix_(*[source] * start_counts.ndim)]
+        self.set_count_array(augmented)
+        self.start_counts = augmented_starts
+    
+    def fingerprint(self) -> str:
+        """
+        Get a content hash of the fitted model: its state space, counts, start counts and
+        storage options. Equal fingerprints give equal seeded samples. The hash of the counts is
+        cached until the probabilities are recalculated, e.g. by refitting or
+        update_transition_matrix; the start counts are small and hashed on every call, as they
+        can be set after fitting (load_counts, ShardedTrainer.finalize).
+        
+        Returns:
+        --------
+        fingerprint : str
+            Hex digest of the model.
+        """
+        if not self.is_fitted:
+            raise ValueError("Model not fitted. Call calculate_transition_matrix first.")
+        if self._fingerprint is None:
+            digest = hashlib.sha256()
+            counts = self.get_count_array()
+            options = (type(self).__name__, self.state_array.tolist(), counts.dtype.str,
+                       self.prob_dtype.str, None if self.cdf_dtype is None else self.cdf_dtype.str)
+            digest.update(repr(options).encode())
+            digest.update(np.ascontiguousarray(counts).data)
+            self._fingerprint = digest
+        digest = self._fingerprint.copy()
+        if self.start_counts is not None:
+            digest.update(b"start_counts")
+            digest.update(np.ascontiguousarray(self.start_counts, dtype=np.int64).data)
+        return digest.hexdigest()
+    
+    def save_counts(self, output_path: str) -> None:
+        """
+        Save the state space, counts and start counts to a .npz file. The probabilities are
+        recalculated on load.
+        
+        Parameters:
+        -----------
+        output_path : str
+            Path of the .npz file to write.
+        """
+        state_values = np.asarray(self.state_array.tolist())
+        if state_values.dtype == object or state_values.shape != (self.n_states,):
+            raise ValueError("Only state spaces of numbers or strings can be saved.")
+        arrays = {"state_space": state_values, "counts": self.get_count_array()}
+        if self.start_counts is not None:
+            arrays["start_counts"] = self.start_counts
+        np.savez(output_path, **arrays)
+    
+    @classmethod
+    def load_counts(cls, input_path: str, **kwargs) -> "CountModelMixin":
+        """
+        Load a model saved with save_counts.
+        
+        Parameters:
+        -----------
+        input_path : str
+            Path of the .npz file to read.
+        **kwargs
+            Storage options passed to the constructor, e.g. count_dtype and cdf_dtype.
+            
+        Returns:
+        --------
+        model : VanillaFirstOrderMarkovChain or VanillaSecondOrderMarkovChain
+            The fitted model, of the class load_counts is called on.
+        """
+        with np.load(input_path, allow_pickle=False) as data:
+            model = cls(data["state_space"].tolist(), **kwargs)
+            model.set_count_array(data["counts"])
+            if "start_counts" in data:
+                model.start_counts = data["start_counts"]
+        return model
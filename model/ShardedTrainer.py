@@ -0,0 +1,300 @@
+import os
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Any, Tuple
+
+# Model used by the counting workers, created once per worker process
+_worker_model = None
+
+def _init_worker(model_class, state_space, isPitch):
+    global _worker_model
+    _worker_model = (model_class(state_space), isPitch)
+
+def _count_worker(sequences):
+    model, isPitch = _worker_model
+    return model.count_transitions(sequences, isPitch), model.count_starts(sequences)
+
+class ShardedTrainer:
+    """
+    Map-reduce training for the Markov chain models.
+
+    Transition counts add up, so a corpus can be split into shards that are counted independently
+    (in worker processes, or on other machines by shipping the saved count files), summed, and
+    normalized once at the end. The start counts used by start_mode='empirical' are summed the
+    same way. Works with any model class providing count_transitions, count_starts and
+    set_count_array, e.g. VanillaFirstOrderMarkovChain and VanillaSecondOrderMarkovChain.
+
+    A shard is a (state_space, counts, start_counts) tuple; start_counts may be None.
+    """
+
+    def __init__(self, model_class, state_space: List[Any], isPitch = True):
+        """
+        Initialize the trainer.
+
+        Parameters:
+        -----------
+        model_class : type
+            The model class to train.
+        state_space : list
+            The shared state space. Every shard is counted against this fixed state index.
+        isPitch : bool
+            Whether the states are pitches, selecting the transition weights.
+        """
+        if state_space is None or len(state_space) == 0:
+            raise ValueError("state_space must be provided and non-empty")
+
+        self.model_class = model_class
+        if isinstance(state_space, (set, frozenset)):
+            # Same order as the models give a set, so the count arrays line up
+            try:
+                state_space = sorted(state_space)
+            except TypeError:
+                state_space = sorted(state_space, key=repr)
+        self.state_space = list(state_space)
+        self.isPitch = isPitch
+        self._model = None # local model used for in-process counting
+
+    def split_shards(self, sequences: List[List[Any]], n_shards: int) -> List[List[List[Any]]]:
+        """
+        Split sequences into n_shards contiguous shards of roughly equal total length.
+
+        Parameters:
+        -----------
+        sequences : list of lists
+            List of sequences, where each sequence is a list of states.
+        n_shards : int
+            Number of shards to produce.
+
+        Returns:
+        --------
+        shards : list of lists of lists
+            The sequences of each shard.
+        """
+        if n_shards < 1:
+            raise ValueError("n_shards must be at least 1")
+        cumulative_lengths = np.cumsum([len(sequence) for sequence in sequences])
+        total = cumulative_lengths[-1] if len(cumulative_lengths) else 0
+        # Shard k takes the sequences whose cumulative length falls in its equal share of the total
+        shard_ids = np.minimum((cumulative_lengths - 1) * n_shards // max(total, 1), n_shards - 1)
+        shards = [[] for _ in range(n_shards)]
+        for shard_id, sequence in zip(shard_ids.tolist(), sequences):
+            shards[shard_id].append(sequence)
+        return [shard for shard in shards if shard]
+
+    def count_shard(self, sequences: List[List[Any]]) -> Tuple[List[Any], np.ndarray, np.ndarray]:
+        """
+        Count the transitions and start states of one shard in this process.
+
+        Parameters:
+        -----------
+        sequences : list of lists
+            The sequences of the shard.
+
+        Returns:
+        --------
+        state_space, counts, start_counts : list, numpy.ndarray, numpy.ndarray
+            The trainer's state space and the integer count and start count arrays against it.
+        """
+        if self._model is None:
+            self._model = self.model_class(self.state_space)
+        return (self.state_space, self._model.count_transitions(sequences, self.isPitch),
+                self._model.count_starts(sequences))
+
+    def count_shards(self, shards: List[List[List[Any]]],
+                     n_workers: Optional[int] = None) -> List[Tuple[List[Any], np.ndarray, np.ndarray]]:
+        """
+        Count the transitions of every shard in a pool of worker processes.
+
+        Parameters:
+        -----------
+        shards : list of lists of lists
+            The sequences of each shard.
+        n_workers : int or None
+            Number of worker processes. Defaults to the number of CPUs.
+
+        Returns:
+        --------
+        shards : list of tuple(state_space, counts, start_counts)
+            Integer count and start count arrays of each shard, see count_shard.
+        """
+        n_workers = min(n_workers or os.cpu_count() or 1, len(shards))
+        if n_workers <= 1:
+            return [self.count_shard(shard) for shard in shards]
+        with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_worker,
+                                 initargs=(self.model_class, self.state_space, self.isPitch)) as executor:
+            return [(self.state_space, counts, start_counts)
+                    for counts, start_counts in executor.map(_count_worker, shards)]
+
+    def save_shard(self, shard: Any, output_path: str) -> None:
+        """
+        Save shard counts with the state space they are indexed by, to be merged elsewhere.
+
+        Parameters:
+        -----------
+        shard : tuple(state_space, counts, start_counts) or numpy.ndarray
+            The shard, e.g. from count_shard or merge, or a bare count array over the
+            trainer's state space.
+        output_path : str
+            Path of the .npz file to write.
+        """
+        state_space, counts, start_counts = self._unpack_shard(shard)
+        state_values = np.asarray(state_space)
+        if state_values.dtype == object or state_values.shape != (len(state_space),):
+            raise ValueError("Only state spaces of numbers or strings can be saved.")
+        arrays = {"state_space": state_values, "counts": counts}
+        if start_counts is not None:
+            arrays["start_counts"] = start_counts
+        np.savez(output_path, **arrays)
+
+    @staticmethod
+    def load_shard(input_path: str) -> Tuple[List[Any], np.ndarray, Optional[np.ndarray]]:
+        """
+        Load shard counts saved with save_shard or a model's save_counts.
+
+        Parameters:
+        -----------
+        input_path : str
+            Path of the .npz file to read.
+
+        Returns:
+        --------
+        state_space, counts, start_counts : list, numpy.ndarray, numpy.ndarray or None
+            The state space of the shard, its count array and its start counts if saved.
+        """
+        with np.load(input_path, allow_pickle=False) as data:
+            start_counts = data["start_counts"] if "start_counts" in data else None
+            return data["state_space"].tolist(), data["counts"], start_counts
+
+    def _unpack_shard(self, shard: Any) -> Tuple[List[Any], np.ndarray, Optional[np.ndarray]]:
+        """
+        Get (state_space, counts, start_counts) of a shard tuple, fitted model or bare count array.
+        Two-element (state_space, counts) tuples have no start counts.
+        """
+        if hasattr(shard, "get_count_array"):
+            return list(shard.state_array), shard.get_count_array(), getattr(shard, "start_counts", None)
+        if isinstance(shard, tuple):
+            if len(shard) == 2:
+                return shard[0], shard[1], None
+            return shard
+        return self.state_space, shard, None
+
+    def merge(self, shards: List[Any]) -> Tuple[List[Any], np.ndarray, Optional[np.ndarray]]:
+        """
+        Sum shard counts and start counts over the trainer's state space.
+
+        Parameters:
+        -----------
+        shards : list
+            Shard tuples, (state_space, counts) tuples, fitted models, or count arrays already
+            indexed by the trainer's state space. Shards over a different state space are
+            remapped by state; a shard with counts for a state outside the trainer's state
+            space raises a ValueError.
+
+        Returns:
+        --------
+        state_space, counts, start_counts : list, numpy.ndarray, numpy.ndarray or None
+            The trainer's state space, the summed count array and the summed start counts.
+            start_counts is None if any shard has no start counts, as a partial sum would
+            skew start_mode='empirical'.
+        """
+        n = len(self.state_space)
+        state_to_idx = {state: idx for idx, state in enumerate(self.state_space)}
+        merged = None
+        merged_starts = None
+        has_starts = True
+
+        for shard in shards:
+            shard_states, counts, start_counts = self._unpack_shard(shard)
+            counts = np.asarray(counts)
+            if merged is None:
+                dtype = np.int64 if np.issubdtype(counts.dtype, np.integer) else float
+                merged = np.zeros((n,) * counts.ndim, dtype=dtype)
+            elif not np.issubdtype(counts.dtype, np.integer) and merged.dtype != float:
+                merged = merged.astype(float)
+            if counts.shape != (len(shard_states),) * merged.ndim:
+                raise ValueError(f"Shard counts of shape {counts.shape} do not match its state space.")
+
+            has_starts = has_starts and start_counts is not None
+            if has_starts:
+                start_counts = np.asarray(start_counts, dtype=np.int64)
+                if start_counts.shape != (len(shard_states),) * (merged.ndim - 1):
+                    raise ValueError(f"Shard start counts of shape {start_counts.shape} do not match its state space.")
+                if merged_starts is None:
+                    merged_starts = np.zeros((n,) * start_counts.ndim, dtype=np.int64)
+
+            if list(shard_states) == self.state_space:
+                merged += counts
+                if has_starts:
+                    merged_starts += start_counts
+                continue
+
+            # Remap the shard's indices onto the trainer's state index
+            target = np.array([state_to_idx.get(state, -1) for state in shard_states], dtype=np.int64)
+            self._add_remapped(merged, counts, target, shard_states)
+            if has_starts:
+                self._add_remapped(merged_starts, start_counts, target, shard_states)
+
+        if merged is None:
+            raise ValueError("No shards to merge.")
+        return self.state_space, merged, merged_starts if has_starts else None
+
+    @staticmethod
+    def _add_remapped(merged: np.ndarray, counts: np.ndarray, target: np.ndarray, shard_states: List[Any]) -> None:
+        """
+        Add counts indexed by a shard's state space to merged, where target maps each shard state
+        index to the trainer's state index, or -1 for states outside the trainer's state space.
+        """
+        known = target >= 0
+        if not known.all():
+            known_counts = counts[np.ix_(*([known] * counts.ndim))]
+            if known_counts.sum() != counts.sum():
+                unknown = [state for state, is_known in zip(shard_states, known) if not is_known]
+                raise ValueError(f"States {unknown} not in the state space.")
+            counts = known_counts
+        merged[np.ix_(*([target[known]] * counts.ndim))] += counts
+
+    def finalize(self, merged: Any):
+        """
+        Normalize merged counts into a fitted model.
+
+        Parameters:
+        -----------
+        merged : tuple(state_space, counts, start_counts) or numpy.ndarray
+            The result of merge, or a bare count array over the trainer's state space.
+            Without start counts the model cannot use start_mode='empirical'.
+
+        Returns:
+        --------
+        model : model_class
+            The fitted model.
+        """
+        state_space, counts, start_counts = self._unpack_shard(merged)
+        if list(state_space) != self.state_space:
+            raise ValueError("Merged counts must be over the trainer's state space, see merge.")
+        model = self.model_class(self.state_space)
+        model.set_count_array(counts)
+        if start_counts is not None:
+            model.start_counts = np.array(start_counts, dtype=np.int64)
+        return model
+
+    def fit(self, sequences: List[List[Any]], n_workers: Optional[int] = None):
+        """
+        Split sequences into one shard per worker, count the shards in parallel, merge and finalize.
+
+        Parameters:
+        -----------
+        sequences : list of lists
+            List of sequences, where each sequence is a list of states.
+        n_workers : int or None
+            Number of worker processes. Defaults to the number of CPUs.
+
+        Returns:
+        --------
+        model : model_class
+            The fitted model.
+        """
+        n_workers = n_workers or os.cpu_count() or 1
+        shards = self.split_shards(sequences, n_workers)
+        if not shards:
+            raise ValueError("No sequences to train on.")
+        return self.finalize(self.merge(self.count_shards(shards, n_workers)))
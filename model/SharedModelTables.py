@@ -0,0 +1,132 @@
+import json
+import os
+import tempfile
+import numpy as np
+from typing import Any
+
+from model.VanillaFirstOrderMarkovChain import VanillaFirstOrderMarkovChain
+from model.VanillaSecondOrderMarkovChain import VanillaSecondOrderMarkovChain
+from model.ChordConditionedMarkovChain import ChordConditionedMarkovChain
+
+# Arrays of each model class that are published; everything else is rebuilt per process on demand
+_TABLES = {
+    VanillaFirstOrderMarkovChain: ("count_matrix", "_transition_matrix", "cdf_matrix", "_max_successor",
+                                   "start_counts"),
+    VanillaSecondOrderMarkovChain: ("count_tensor", "_transition_tensor", "cdf_tensor", "_max_successor",
+                                    "start_counts"),
+    ChordConditionedMarkovChain: ("count_tensor", "_cdf_tensor"),
+}
+_METADATA_FILE = "model.json"
+
+def default_shared_directory() -> str:
+    """
+    Directory for published tables: RAM-backed /dev/shm where available, else the temp directory.
+    """
+    return "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+
+class SharedModelTables:
+    """
+    Publish a fitted model's arrays once as memory-mapped .npy files and attach read-only views
+    from any number of worker processes.
+
+    Attached models map the same pages, so host memory stays flat as workers are added. Per-process
+    caches such as the log-probability tables used for decoding and scoring are still built lazily
+    in each process that needs them. Attached models cannot be updated or refit.
+    """
+
+    def __init__(self, directory: str):
+        """
+        Parameters:
+        -----------
+        directory : str
+            Directory holding the tables of one model.
+        """
+        self.directory = directory
+
+    def publish(self, model: Any) -> None:
+        """
+        Write the model's tables and the metadata needed to attach to them.
+
+        Parameters:
+        -----------
+        model : VanillaFirstOrderMarkovChain, VanillaSecondOrderMarkovChain or ChordConditionedMarkovChain
+            A fitted model.
+        """
+        model_class = type(model)
+        if model_class not in _TABLES:
+            raise ValueError(f"Cannot publish tables of {model_class.__name__}.")
+        if not model.is_fitted:
+            raise ValueError("Model not fitted. Call calculate_transition_matrix first.")
+        state_values = np.asarray(model.state_array.tolist())
+        if state_values.dtype == object or state_values.shape != (model.n_states,):
+            raise ValueError("Only state spaces of numbers or strings can be published.")
+
+        os.makedirs(self.directory, exist_ok=True)
+        tables = []
+        for name in _TABLES[model_class]:
+            table = getattr(model, name)
+            if table is None:
+                continue
+            np.save(os.path.join(self.directory, f"{name}.npy"), np.ascontiguousarray(table))
+            tables.append(name)
+
+        metadata = {
+            "class": model_class.__name__,
+            "state_space": state_values.tolist(),
+            "tables": tables,
+        }
+        if isinstance(model, ChordConditionedMarkovChain):
+            metadata["chord_space"] = list(model.chord_space)
+        else:
+            metadata["options"] = {
+                "count_dtype": model.count_dtype.str,
+                "prob_dtype": model.prob_dtype.str,
+                "cdf_dtype": None if model.cdf_dtype is None else model.cdf_dtype.str,
+                "cdf_tolerance": model.cdf_tolerance,
+            }
+            metadata["cdf_error"] = model.cdf_error
+        # Write the metadata last and atomically, so attaching never sees a partial publish
+        temporary_path = os.path.join(self.directory, f".{_METADATA_FILE}.{os.getpid()}")
+        with open(temporary_path, "w") as f:
+            json.dump(metadata, f)
+        os.replace(temporary_path, os.path.join(self.directory, _METADATA_FILE))
+
+    def attach(self) -> Any:
+        """
+        Create a model whose tables are read-only memory-mapped views of the published arrays.
+
+        Returns:
+        --------
+        model : VanillaFirstOrderMarkovChain, VanillaSecondOrderMarkovChain or ChordConditionedMarkovChain
+            The fitted model.
+        """
+        metadata_path = os.path.join(self.directory, _METADATA_FILE)
+        if not os.path.exists(metadata_path):
+            raise ValueError(f"No published model in '{self.directory}'.")
+        with open(metadata_path) as f:
+            metadata = json.load(f)
+
+        classes = {model_class.__name__: model_class for model_class in _TABLES}
+        model_class = classes[metadata["class"]]
+        if model_class is ChordConditionedMarkovChain:
+            model = model_class(metadata["state_space"], metadata["chord_space"])
+        else:
+            model = model_class(metadata["state_space"], **metadata["options"])
+            model.cdf_error = metadata["cdf_error"]
+
+        for name in metadata["tables"]:
+            setattr(model, name, np.load(os.path.join(self.directory, f"{name}.npy"), mmap_mode="r"))
+        model.is_fitted = True
+        return model
+
+    def remove(self) -> None:
+        """
+        Delete the published files. Processes that already attached keep their mappings.
+        """
+        for name in os.listdir(self.directory):
+            if name == _METADATA_FILE or name.endswith(".npy"):
+                os.remove(os.path.join(self.directory, name))
+        try:
+            os.rmdir(self.directory)
+        except OSError:
+            pass
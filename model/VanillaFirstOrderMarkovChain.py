@@ -1,93 +1,228 @@
 import numpy as np
 import random
-from typing import List, Optional, Any
+from collections import OrderedDict
+from itertools import islice
+from typing import Iterable, Iterator, List, Optional, Any, Tuple
 import matplotlib.pyplot as plt
 import seaborn as sns
 
-class VanillaFirstOrderMarkovChain:
+from model.MarkovChainMixins import CountModelMixin
+
+class VanillaFirstOrderMarkovChain(CountModelMixin):
     """
     A first-order Markov chain model that can learn transition probabilities
     from sequences and generate new sequences based on the learned model.
     """
     
-    def __init__(self, state_space: List[Any]):
+    def __init__(self, state_space: List[Any], count_dtype=np.float64, prob_dtype=np.float64,
+                 cdf_dtype=None, cdf_tolerance: float = 1e-4):
         """
         Initialize the Markov chain model.
         
         Parameters:
         -----------
         state_space : list
-            List of possible states. Must be provided.
+            List of possible states. Must be provided. Sets are sorted so state indices are deterministic.
+        count_dtype : numpy dtype
+            Storage type of the counts, e.g. np.uint32 for integer counts.
+        prob_dtype : numpy dtype
+            Storage type of the transition probabilities, np.float64 or np.float32.
+        cdf_dtype : numpy dtype or None
+            If np.float32 or np.uint16 (quantized to 1/65535), inference_prob samples from a
+            precomputed CDF table of this type instead of the transition matrix, and only the
+            counts and the CDF table are kept; transition_matrix is derived from the counts on access.
+        cdf_tolerance : float
+            Largest allowed absolute difference between any sampling probability implied by the
+            CDF table and the exact probability from the counts. Fitting raises a ValueError above it.
         """
-        if state_space is None or len(state_space) == 0:
-            raise ValueError("state_space must be provided and non-empty")
-            
-        self.state_space = state_space
-        self.state_to_idx = {state: idx for idx, state in enumerate(state_space)}
-        self.idx_to_state = {idx: state for idx, state in enumerate(state_space)}
-        self.n_states = len(state_space)
+        self._init_state_space(state_space)
+        self._init_storage_options(count_dtype, prob_dtype, cdf_dtype, cdf_tolerance)
         
         # Initialize count matrix and transition matrix
-        self.count_matrix = np.zeros((self.n_states, self.n_states))
-        self.transition_matrix = np.zeros((self.n_states, self.n_states))
+        self.count_matrix = np.zeros((self.n_states, self.n_states), dtype=self.count_dtype)
+        # Stored probabilities, None with a CDF table (see the transition_matrix property)
+        self._transition_matrix = (np.zeros((self.n_states, self.n_states), dtype=self.prob_dtype)
+                                   if self.cdf_dtype is None else None)
+        self.cdf_matrix = None # sampling CDF per row when cdf_dtype is set
+        self.cdf_error = 0.0 # largest sampling probability error of cdf_matrix
+        self._log_prob_cache = {} # smoothing -> log transition matrix, reset whenever probabilities change
+        self._cdf_cache = OrderedDict() # sampling options -> reweighted CDF table, least recently used first
+        self.cdf_cache_size = 16 # maximum number of cached reweighted CDF tables
+        self._max_successor = np.full(self.n_states, -1, dtype=np.int64)
+        self._max_paths = {} # start idx -> (path, cycle start) of the argmax walk
+        self._fingerprint = None # hash of the counts and options, reset whenever probabilities change
+        self.start_counts = None # first state counts of the training sequences, for start_mode='empirical'
+        self._valid_start_indices = None # states with outgoing transitions, built once per fit
+        self._stationary = {} # (max_iterations, tolerance) -> stationary distribution, built once per fit
             
         self.is_fitted = False
     
-    def calculate_transition_matrix(self, sequences: List[List[Any]], isPitch = True) -> None:
+    @property
+    def transition_matrix(self) -> np.ndarray:
+        """
+        The (n_states, n_states) transition probabilities. Stored when cdf_dtype is None; with a
+        CDF table they are normalized from the counts on every access, so only the counts and
+        the CDF table stay resident.
+        """
+        if self._transition_matrix is not None:
+            return self._transition_matrix
+        return self._probabilities().astype(self.prob_dtype, copy=False)
+    
+    def calculate_transition_matrix(self, sequences: List[List[Any]], isPitch = True,
+                                    offsets: Optional[np.ndarray] = None) -> None:
         """
         Calculate the transition matrix from sequences of states.
         
+        Transitions are weighted 2 within an octave (pitch) or within 100 ticks (duration),
+        1 otherwise.
+        
         Parameters:
         -----------
-        sequences : list of lists
-            List of sequences, where each sequence is a list of states.
+        sequences : list of lists or array
+            List of sequences, where each sequence is a list of states. With offsets, one flat
+            array of the states of all sequences.
+        isPitch : bool
+            Whether the states are pitches, selecting the transition weights.
+        offsets : numpy.ndarray or None
+            Sequence boundaries in the flat array: sequence k spans sequences[offsets[k]:offsets[k + 1]].
+            No transitions are counted across boundaries.
         """
-        # Initialize count matrix
-        self.count_matrix = np.zeros((self.n_states, self.n_states))
-        
-        # Count transitions
-        for sequence in sequences:
-            for i in range(len(sequence) - 1):
-                current_state = sequence[i]
-                next_state = sequence[i + 1]
-                
-                if current_state not in self.state_to_idx:
-                    raise ValueError(f"State '{current_state}' not in the state space.")
-                if next_state not in self.state_to_idx:
-                    raise ValueError(f"State '{next_state}' not in the state space.")
-                
-                current_idx = self.state_to_idx[current_state]
-                next_idx = self.state_to_idx[next_state]
-
-                if isPitch:
-                    # Add weight for transition to be within octave
-                    weight = (12-abs(current_state - next_state))/12
-                    if weight >= 0:
-                        self.count_matrix[current_idx, next_idx] += 2
-                    else:
-                        self.count_matrix[current_idx, next_idx] += 1
-                else:
-                    if abs(current_state - next_state) > 100: # Add weight for similar duration +- 100
-                        self.count_matrix[current_idx, next_idx] += 1
-                    else:
-                        self.count_matrix[current_idx, next_idx] += 2
-        
-        # Calculate probabilities from counts
-        self._calculate_probabilities()
-        self.is_fitted = True
+        flat_indices, offsets = self._flatten_sequences(sequences, offsets)
+        self.set_count_array(self._count_flat(flat_indices, offsets, isPitch))
+        self.start_counts = self._count_starts(flat_indices, offsets)
     
-    def _calculate_probabilities(self) -> None:
+    def _probabilities(self) -> np.ndarray:
         """
-        Calculate transition probabilities from count matrix.
+        Normalize the count matrix to float64 transition probabilities.
         """
         # Make a copy to avoid modifying the counts
-        self.transition_matrix = self.count_matrix.copy()
+        transition_matrix = self.count_matrix.astype(float)
         
         # Normalize to get probabilities
-        row_sums = self.transition_matrix.sum(axis=1, keepdims=True)
+        row_sums = transition_matrix.sum(axis=1, keepdims=True)
         # Avoid division by zero
         row_sums[row_sums == 0] = 1.0
-        self.transition_matrix = self.transition_matrix / row_sums
+        return transition_matrix / row_sums
+    
+    def _calculate_probabilities(self) -> None:
+        """
+        Calculate transition probabilities from count matrix.
+        """
+        probs = self._probabilities()
+        self._build_cdf(probs)
+        transition_matrix = probs.astype(self.prob_dtype, copy=False)
+        self._transition_matrix = transition_matrix if self.cdf_dtype is None else None
+        self._log_prob_cache = {}
+        self._cdf_cache = OrderedDict()
+        
+        # Argmax successor of every state, -1 where the state has no outgoing transitions
+        self._max_successor = np.where(transition_matrix.sum(axis=1) > 0,
+                                       np.argmax(transition_matrix, axis=1), -1)
+        self._max_paths = {}
+        self._fingerprint = None
+        self._valid_start_indices = None
+        self._stationary = {}
+    
+    def _build_cdf(self, probs: np.ndarray) -> None:
+        """
+        Build the reduced-precision sampling CDFs from exact float64 probabilities and check
+        that the sampling distribution stays within cdf_tolerance.
+        """
+        self.cdf_matrix = None
+        self.cdf_error = 0.0
+        if self.cdf_dtype is None:
+            return
+        
+        cdf = np.cumsum(probs, axis=-1)
+        if self.cdf_dtype == np.uint16:
+            cdf_matrix = np.rint(cdf * np.iinfo(np.uint16).max).astype(np.uint16)
+        else:
+            cdf_matrix = cdf.astype(np.float32)
+        
+        # Sampling scales the uniform draw by the last CDF value, so compare against the renormalized table
+        sampled_cdf = cdf_matrix.astype(float)
+        totals = sampled_cdf[..., -1:]
+        np.divide(sampled_cdf, totals, out=sampled_cdf, where=totals > 0)
+        self.cdf_error = float(np.abs(np.diff(sampled_cdf, axis=-1, prepend=0.0) - probs).max())
+        if self.cdf_error > self.cdf_tolerance:
+            raise ValueError(f"{self.cdf_dtype} sampling probabilities deviate by up to {self.cdf_error:.3g}, "
+                             f"above cdf_tolerance {self.cdf_tolerance:.3g}.")
+        self.cdf_matrix = cdf_matrix
+    
+    def _sample_next(self, cdf_table: np.ndarray, current_idx: int, rng: Optional[np.random.Generator] = None) -> int:
+        """
+        Sample the next state index from a CDF table. Draws one uniform number like
+        np.random.choice, so seeded runs follow the same random stream. Returns -1 if the
+        state has no outgoing transitions.
+        """
+        cdf = cdf_table[current_idx]
+        if cdf[-1] == 0:
+            return -1
+        draw = np.random.random_sample() if rng is None else rng.random()
+        return int(np.searchsorted(cdf, draw * cdf[-1], side='right'))
+    
+    def _sampling_table(self, harmony_temperature: Optional[float] = None, pitch_classes: Optional[Iterable] = None,
+                        temperature: Optional[float] = None, top_k: Optional[int] = None,
+                        top_p: Optional[float] = None) -> Optional[np.ndarray]:
+        """
+        Get the CDF table to sample from: cdf_matrix (None to sample from transition_matrix)
+        without options, else a reweighted table built once per setting and kept in a
+        least-recently-used cache of cdf_cache_size tables until the probabilities change,
+        so sampling from it costs the same as plain sampling.
+        """
+        if not self.is_fitted:
+            raise ValueError("Model not fitted. Call calculate_transition_matrix first.")
+        if harmony_temperature is None and pitch_classes is None and temperature is None and top_k is None and top_p is None:
+            return self.cdf_matrix
+        if harmony_temperature is not None and harmony_temperature <= 0:
+            raise ValueError(f"harmony_temperature must be positive, got {harmony_temperature}")
+        if temperature is not None and temperature <= 0:
+            raise ValueError(f"temperature must be positive, got {temperature}")
+        if top_k is not None and (int(top_k) != top_k or top_k < 1):
+            raise ValueError(f"top_k must be a positive integer, got {top_k}")
+        if top_p is not None and not 0 < top_p <= 1:
+            raise ValueError(f"top_p must be in (0, 1], got {top_p}")
+        
+        pitch_class_key = None if pitch_classes is None else self._pitch_class_key(pitch_classes)
+        key = (None if harmony_temperature is None else float(harmony_temperature), pitch_class_key,
+               None if temperature is None else float(temperature), None if top_k is None else int(top_k),
+               None if top_p is None else float(top_p))
+        cdf_table = self._cdf_cache.get(key)
+        if cdf_table is not None:
+            self._cdf_cache.move_to_end(key)
+            return cdf_table
+        
+        weights = self.transition_matrix.astype(float)
+        if harmony_temperature is not None:
+            weights *= np.exp(self._harmony_scores() / harmony_temperature)
+        if pitch_class_key is not None:
+            # Renormalize every row over the next states in the allowed pitch classes
+            weights *= self._pitch_class_states(pitch_class_key)[None, :]
+        cdf_table = self._weights_to_cdf(self._truncate_weights(weights, temperature, top_k, top_p))
+        self._cdf_cache[key] = cdf_table
+        while len(self._cdf_cache) > self.cdf_cache_size:
+            self._cdf_cache.popitem(last=False)
+        return cdf_table
+    
+    def _valid_start_states(self, cdf_table: np.ndarray, pitch_classes: Iterable) -> np.ndarray:
+        """
+        Boolean mask of the states in the allowed pitch classes that can continue.
+        """
+        return self._pitch_class_states(self._pitch_class_key(pitch_classes)) & (cdf_table[:, -1] > 0)
+    
+    def nbytes(self) -> int:
+        """
+        Get the memory held by the model's count, probability and sampling tables.
+        
+        Returns:
+        --------
+        nbytes : int
+            Total size of the arrays in bytes.
+        """
+        tables = [self.count_matrix, self._transition_matrix, self.cdf_matrix]
+        tables.extend(self._log_prob_cache.values())
+        tables.extend(self._cdf_cache.values())
+        return sum(table.nbytes for table in tables if table is not None)
     
     def update_transition_matrix(self, new_sequences: List[List[Any]]) -> None:
         """
@@ -101,26 +236,73 @@ class VanillaFirstOrderMarkovChain:
         if not self.is_fitted:
             self.calculate_transition_matrix(new_sequences)
             return
+        if not self.count_matrix.flags.writeable:
+            raise ValueError("Counts are read-only, e.g. attached from SharedModelTables, and cannot be updated.")
         
         # Count new transitions and add to existing count matrix
         for sequence in new_sequences:
-            for i in range(len(sequence) - 1):
-                current_state = sequence[i]
-                next_state = sequence[i + 1]
-                
-                if current_state not in self.state_to_idx:
-                    raise ValueError(f"State '{current_state}' not in the state space.")
-                if next_state not in self.state_to_idx:
-                    raise ValueError(f"State '{next_state}' not in the state space.")
-                
-                current_idx = self.state_to_idx[current_state]
-                next_idx = self.state_to_idx[next_state]
-                self.count_matrix[current_idx, next_idx] += 1
+            if len(sequence) == 0:
+                continue
+            indices = self._to_indices(sequence)
+            if self.start_counts is not None:
+                self.start_counts[indices[0]] += 1
+            np.add.at(self.count_matrix, (indices[:-1], indices[1:]), 1)
         
         # Recalculate probabilities from updated count matrix
         self._calculate_probabilities()
     
-    def _get_initial_state(self, start_state: Optional[Any] = None, random_seed: Optional[int] = None) -> Any:
+    def count_transitions(self, sequences: List[List[Any]], isPitch = True,
+                          offsets: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Count the weighted transitions in sequences without modifying the model.
+        Counts from different shards of a corpus can be summed and passed to set_count_array.
+        
+        Parameters:
+        -----------
+        sequences : list of lists
+            List of sequences, where each sequence is a list of states.
+        isPitch : bool
+            Whether the states are pitches, selecting the same weights as calculate_transition_matrix.
+        offsets : numpy.ndarray or None
+            Sequence boundaries when sequences is one flat array, see calculate_transition_matrix.
+            
+        Returns:
+        --------
+        counts : numpy.ndarray
+            Integer (n_states, n_states) array of transition counts.
+        """
+        flat_indices, offsets = self._flatten_sequences(sequences, offsets)
+        return self._count_flat(flat_indices, offsets, isPitch)
+    
+    def _count_flat(self, flat_indices: np.ndarray, offsets: np.ndarray, isPitch: bool) -> np.ndarray:
+        """
+        count_transitions on sequences already flattened by _flatten_sequences.
+        """
+        n = self.n_states
+        if len(flat_indices) < 2:
+            return np.zeros((n, n), dtype=np.int64)
+        
+        within_sequence = np.ones(len(flat_indices) - 1, dtype=bool)
+        boundaries = offsets[1:-1] - 1
+        within_sequence[boundaries[(boundaries >= 0) & (boundaries < len(within_sequence))]] = False
+        current_indices = flat_indices[:-1][within_sequence]
+        next_indices = flat_indices[1:][within_sequence]
+        
+        state_values = np.asarray(self.state_array.tolist(), dtype=float)
+        weights = self._transition_weights(state_values[current_indices], state_values[next_indices], isPitch)
+        counts = np.bincount(current_indices * n + next_indices, weights=weights, minlength=n * n)
+        return counts.astype(np.int64).reshape(n, n)
+    
+    def _count_starts(self, flat_indices: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+        """
+        Count the first state of every non-empty sequence, for start_mode='empirical'.
+        """
+        starts = offsets[:-1][offsets[1:] > offsets[:-1]]
+        return np.bincount(flat_indices[starts], minlength=self.n_states).astype(np.int64)
+    
+    def _get_initial_state(self, start_state: Optional[Any] = None, random_seed: Optional[int] = None,
+                           valid_starts: Optional[np.ndarray] = None, start_mode: str = "uniform",
+                           rng: Optional[np.random.Generator] = None) -> Any:
         """
         Helper function to handle the common pre-check logic for inference methods.
         
@@ -130,6 +312,13 @@ class VanillaFirstOrderMarkovChain:
             The starting state. If None, will be chosen randomly.
         random_seed : int or None
             Random seed for reproducibility.
+        valid_starts : numpy.ndarray or None
+            Boolean mask of the states a random start is chosen from. Defaults to the states
+            with outgoing transitions.
+        start_mode : str
+            Distribution of a random start over the valid states, see inference_prob.
+        rng : numpy.random.Generator or None
+            Generator to draw from instead of the seeded global random state, see stream.
             
         Returns:
         --------
@@ -139,16 +328,24 @@ class VanillaFirstOrderMarkovChain:
         if not self.is_fitted:
             raise ValueError("Model not fitted. Call calculate_transition_matrix first.")
         
-        if random_seed is not None:
+        if rng is None and random_seed is not None:
             np.random.seed(random_seed)
             random.seed(random_seed)
         
         if start_state is None:
             # Choose a random start state based on states that have outgoing transitions
-            valid_start_indices = np.where(self.transition_matrix.sum(axis=1) > 0)[0]
+            if valid_starts is None:
+                valid_start_indices = self._get_valid_start_indices()
+            else:
+                valid_start_indices = np.where(valid_starts)[0]
             if len(valid_start_indices) == 0:
                 raise ValueError("No valid start states found in the transition matrix.")
-            start_idx = np.random.choice(valid_start_indices)
+            chooser = np.random if rng is None else rng
+            if start_mode == "uniform":
+                start_idx = chooser.choice(valid_start_indices)
+            else:
+                start_probs = self._start_probabilities(start_mode, valid_start_indices)
+                start_idx = valid_start_indices[chooser.choice(len(valid_start_indices), p=start_probs)]
             current_state = self.idx_to_state[start_idx]
         else:
             if start_state not in self.state_to_idx:
@@ -158,7 +355,10 @@ class VanillaFirstOrderMarkovChain:
         return current_state
     
     def inference_prob(self, start_state: Optional[Any] = None, length: int = 10, 
-                  random_seed: Optional[int] = None) -> List[Any]:
+                  random_seed: Optional[int] = None, harmony_temperature: Optional[float] = None,
+                  pitch_classes: Optional[Iterable] = None, temperature: Optional[float] = None,
+                  top_k: Optional[int] = None, top_p: Optional[float] = None,
+                  start_mode: str = "uniform") -> List[Any]:
         """
         Generate a new sequence based on the learned transition probabilities,
         using weighted random selection according to transition probabilities.
@@ -171,35 +371,276 @@ class VanillaFirstOrderMarkovChain:
             The length of the sequence to generate.
         random_seed : int or None
             Random seed for reproducibility.
+        harmony_temperature : float or None
+            If set, multiply every transition probability by exp(score / harmony_temperature),
+            where score is the examiner's interval weight between the two pitches, and renormalize.
+            Lower temperatures favour consonant intervals more strongly. Only transitions seen in
+            training remain possible.
+        pitch_classes : iterable or None
+            Keep the melody in a scale: pitch classes (0 = C ... 11 = B), e.g. [5, 7, 9, 10, 0, 2, 4]
+            for F major, or a mask of 12 booleans. Every transition row is renormalized over the
+            allowed states and a random start is chosen among them. The sequence ends early at a
+            state with no allowed successor.
+        temperature : float or None
+            Raise every probability to the power 1 / temperature and renormalize. Below 1 sharpens
+            the distribution towards inference_max, above 1 flattens it.
+        top_k : int or None
+            Only sample from the top_k most likely next states.
+        top_p : float or None
+            Nucleus sampling: only sample from the smallest set of most likely next states whose
+            probability adds up to at least top_p.
+        start_mode : str
+            Distribution of a random start state: 'uniform' over the states with outgoing
+            transitions, 'empirical' as often as each state starts a training sequence, or
+            'stationary' following the chain's stationary distribution.
             
         Returns:
         --------
         sequence : list
             The generated sequence with probabilistic transitions.
         """
-        current_state = self._get_initial_state(start_state, random_seed)
-        sequence = [current_state]
+        states = self.stream(start_state, random_seed, harmony_temperature, pitch_classes, temperature,
+                             top_k, top_p, start_mode)
+        return list(islice(states, max(length, 1)))
+    
+    def stream(self, start_state: Optional[Any] = None, random_seed: Optional[int] = None,
+               harmony_temperature: Optional[float] = None, pitch_classes: Optional[Iterable] = None,
+               temperature: Optional[float] = None, top_k: Optional[int] = None, top_p: Optional[float] = None,
+               start_mode: str = "uniform", rng: Optional[np.random.Generator] = None) -> Iterator[Any]:
+        """
+        Generate states one at a time, for live output. The sampling table, seed and start state
+        are set up when stream is called; after that every step costs one row lookup, however
+        long the stream runs. The stream only ends at a state with no outgoing transitions.
+        
+        With the same arguments, the first length states are the sequence inference_prob returns,
+        as long as nothing else draws from numpy's global random state in between.
+        
+        Parameters:
+        -----------
+        start_state, random_seed, harmony_temperature, pitch_classes, temperature, top_k, top_p, start_mode
+            See inference_prob.
+        rng : numpy.random.Generator or None
+            If given, every draw comes from this generator and random_seed is ignored, so several
+            streams can run side by side without sharing numpy's global random state.
+            
+        Returns:
+        --------
+        states : iterator
+            The generated states, starting with the start state.
+        """
+        cdf_table = self._sampling_table(harmony_temperature, pitch_classes, temperature, top_k, top_p)
+        valid_starts = None if pitch_classes is None else self._valid_start_states(cdf_table, pitch_classes)
+        current_state = self._get_initial_state(start_state, random_seed, valid_starts, start_mode, rng)
+        return self._walk(current_state, cdf_table, rng)
+    
+    def _walk(self, current_state: Any, cdf_table: Optional[np.ndarray],
+              rng: Optional[np.random.Generator] = None) -> Iterator[Any]:
+        """
+        Random walk from current_state, yielding it and then every sampled state.
+        """
+        yield current_state
+        current_idx = self.state_to_idx[current_state]
+        chooser = np.random if rng is None else rng
+        while True:
+            if cdf_table is not None:
+                next_idx = self._sample_next(cdf_table, current_idx, rng)
+                if next_idx < 0:
+                    return
+            else:
+                probs = self.transition_matrix[current_idx]
+                
+                # If there are no transitions from current state, stop
+                if np.sum(probs) == 0:
+                    return
+                
+                next_idx = chooser.choice(self.n_states, p=probs)
+            current_idx = next_idx
+            yield self.idx_to_state[next_idx]
+    
+    def sample_indices(self, n_sequences: int, length: int = 10, start_state: Optional[Any] = None,
+                       random_seed: Optional[int] = None, harmony_temperature: Optional[float] = None,
+                       pitch_classes: Optional[Iterable] = None, temperature: Optional[float] = None,
+                       top_k: Optional[int] = None, top_p: Optional[float] = None,
+                       start_mode: str = "uniform") -> np.ndarray:
+        """
+        Generate many sequences at once, like inference_prob but vectorized across sequences:
+        each step draws one uniform number per sequence and looks it up in the sampled rows'
+        CDFs. The random stream differs from inference_prob.
         
-        for _ in range(length - 1):
-            current_idx = self.state_to_idx[current_state]
-            probs = self.transition_matrix[current_idx]
+        Parameters:
+        -----------
+        n_sequences : int
+            Number of sequences to generate.
+        length : int
+            The length of each sequence.
+        start_state : state or None
+            The starting state of every sequence. If None, chosen randomly per sequence.
+        random_seed : int or None
+            Random seed for reproducibility.
+        harmony_temperature : float or None
+            Bias towards consonant intervals, see inference_prob.
+        pitch_classes : iterable or None
+            Scale to keep the sequences in, see inference_prob.
+        temperature, top_k, top_p : float, int, float or None
+            Reshape every transition row before sampling, see inference_prob.
+        start_mode : str
+            Distribution of random start states, see inference_prob.
             
-            # If there are no transitions from current state, break
-            if np.sum(probs) == 0:
+        Returns:
+        --------
+        indices : numpy.ndarray
+            State indices of shape (n_sequences, length), -1 after a sequence reaches a state
+            with no outgoing transitions. Map them to states with state_array.
+        """
+        cdf_table = self._sampling_table(harmony_temperature, pitch_classes, temperature, top_k, top_p)
+        if random_seed is not None:
+            np.random.seed(random_seed)
+            random.seed(random_seed)
+        
+        indices = np.full((n_sequences, length), -1, dtype=np.int64)
+        if start_state is None:
+            if pitch_classes is None:
+                valid_start_indices = self._get_valid_start_indices()
+            else:
+                valid_start_indices = np.flatnonzero(self._valid_start_states(cdf_table, pitch_classes))
+            if len(valid_start_indices) == 0:
+                raise ValueError("No valid start states found in the transition matrix.")
+            if start_mode == "uniform":
+                starts = np.random.randint(len(valid_start_indices), size=n_sequences)
+            else:
+                start_probs = self._start_probabilities(start_mode, valid_start_indices)
+                starts = np.random.choice(len(valid_start_indices), size=n_sequences, p=start_probs)
+            indices[:, 0] = valid_start_indices[starts]
+        else:
+            if start_state not in self.state_to_idx:
+                raise ValueError(f"Start state '{start_state}' not in the state space.")
+            indices[:, 0] = self.state_to_idx[start_state]
+        
+        active = np.arange(n_sequences)
+        for step in range(1, length):
+            current = indices[active, step - 1]
+            if cdf_table is not None:
+                cdf = cdf_table[current]
+            else:
+                cdf = np.cumsum(self.transition_matrix[current], axis=1, dtype=float)
+            totals = cdf[:, -1]
+            draws = np.random.random_sample(len(active)) * totals
+            # Same as searchsorted(side='right') on every row
+            next_indices = (cdf <= draws[:, None]).sum(axis=1)
+            alive = totals > 0
+            active = active[alive]
+            if len(active) == 0:
                 break
+            indices[active, step] = next_indices[alive]
+        
+        return indices
+    
+    def _get_valid_start_indices(self) -> np.ndarray:
+        """
+        Indices of the states with outgoing transitions, built once per fit.
+        """
+        if self._valid_start_indices is None:
+            self._valid_start_indices = np.flatnonzero(self._max_successor >= 0)
+        return self._valid_start_indices
+    
+    def _start_probabilities(self, start_mode: str, valid_start_indices: np.ndarray) -> np.ndarray:
+        """
+        Probabilities of the valid start states under start_mode 'empirical' or 'stationary'.
+        """
+        if start_mode == "empirical":
+            if self.start_counts is None:
+                raise ValueError("No start counts. Fit with calculate_transition_matrix to use start_mode='empirical'.")
+            weights = np.asarray(self.start_counts, dtype=float)[valid_start_indices]
+        elif start_mode == "stationary":
+            weights = self.stationary_distribution()[valid_start_indices]
+        else:
+            raise ValueError(f"start_mode must be 'uniform', 'empirical' or 'stationary', got {start_mode!r}")
+        total = weights.sum()
+        if total == 0:
+            raise ValueError(f"No valid start state has {start_mode} start probability.")
+        return weights / total
+    
+    def stationary_distribution(self, max_iterations: int = 1000, tolerance: float = 1e-10) -> np.ndarray:
+        """
+        Get the stationary distribution of the chain by power iteration, cached per fit and
+        per (max_iterations, tolerance).
+        
+        The lazy chain (P + I) / 2 is iterated, which has the same stationary distribution but
+        also converges for periodic chains. Mass flowing into states without outgoing
+        transitions is dropped and the rest renormalized, giving the quasi-stationary
+        distribution of chains with dead ends.
+        
+        Parameters:
+        -----------
+        max_iterations : int
+            Maximum number of power iterations.
+        tolerance : float
+            Stop once the L1 change of an iteration falls below this.
             
-            next_idx = np.random.choice(self.n_states, p=probs)
-            next_state = self.idx_to_state[next_idx]
-            sequence.append(next_state)
-            current_state = next_state
+        Returns:
+        --------
+        distribution : numpy.ndarray
+            Probability of every state, shape (n_states,).
+        """
+        if not self.is_fitted:
+            raise ValueError("Model not fitted. Call calculate_transition_matrix first.")
+        key = (max_iterations, tolerance)
+        if key not in self._stationary:
+            transition_matrix = self.transition_matrix.astype(float)
+            valid = self._get_valid_start_indices()
+            distribution = np.zeros(self.n_states)
+            distribution[valid] = 1.0 / max(len(valid), 1)
+            for _ in range(max_iterations):
+                updated = 0.5 * (distribution + distribution @ transition_matrix)
+                total = updated.sum()
+                if total == 0:
+                    break
+                updated /= total
+                change = np.abs(updated - distribution).sum()
+                distribution = updated
+                if change < tolerance:
+                    break
+            self._stationary[key] = distribution
+        return self._stationary[key]
+    
+    def _get_max_path(self, start_idx: int) -> Tuple[np.ndarray, int]:
+        """
+        Follow the argmax successors from a start state until a state repeats or has no successor.
+        The result is cached per start state until the probabilities change.
+        
+        Returns:
+        --------
+        path : numpy.ndarray
+            State indices visited before the walk repeats or stops.
+        cycle_start : int
+            Position in path where the repeating cycle begins, or -1 if the walk reaches a dead end.
+        """
+        cached = self._max_paths.get(start_idx)
+        if cached is not None:
+            return cached
         
-        return sequence
+        successor = self._max_successor
+        position = {}
+        path = []
+        idx = start_idx
+        while idx >= 0 and idx not in position:
+            position[idx] = len(path)
+            path.append(idx)
+            idx = int(successor[idx])
+        cycle_start = position[idx] if idx >= 0 else -1
+        
+        cached = (np.array(path, dtype=np.int64), cycle_start)
+        self._max_paths[start_idx] = cached
+        return cached
     
     def inference_max(self, start_state: Optional[Any] = None, length: int = 10) -> List[Any]:
         """
         Generate a new sequence based on the learned transition probabilities,
         always selecting the next state with the highest transition probability.
         
+        Since every step is deterministic, the sequence is a prefix followed by a repeating cycle.
+        The walk is computed once per start state and long sequences are built by tiling the cycle.
+        
         Parameters:
         -----------
         start_state : state or None
@@ -214,23 +655,241 @@ class VanillaFirstOrderMarkovChain:
         """
         # Use None as random_seed since inference_max doesn't use randomness for state selection
         current_state = self._get_initial_state(start_state)
-        sequence = [current_state]
+        path, cycle_start = self._get_max_path(self.state_to_idx[current_state])
+        length = max(length, 1)
         
-        for _ in range(length - 1):
-            current_idx = self.state_to_idx[current_state]
-            probs = self.transition_matrix[current_idx]
+        if length <= len(path) or cycle_start < 0:
+            # Short sequence, or the walk stops at a state with no transitions
+            indices = path[:length]
+        else:
+            cycle = path[cycle_start:]
+            repeats = -(-(length - cycle_start) // len(cycle))
+            indices = np.concatenate((path[:cycle_start], np.tile(cycle, repeats)))[:length]
+        
+        return self.state_array[indices].tolist()
+    
+    def _decode_constraints(self, start_state: Optional[Any], end_state: Optional[Any], length: int) -> Tuple[Optional[int], Optional[int]]:
+        """
+        Helper function to validate the arguments shared by the decoding methods.
+        
+        Returns:
+        --------
+        start_idx, end_idx : int or None
+            Indices of the start and end constraints.
+        """
+        if not self.is_fitted:
+            raise ValueError("Model not fitted. Call calculate_transition_matrix first.")
+        if length < 1:
+            raise ValueError("length must be at least 1")
+        
+        start_idx = None
+        end_idx = None
+        if start_state is not None:
+            if start_state not in self.state_to_idx:
+                raise ValueError(f"Start state '{start_state}' not in the state space.")
+            start_idx = self.state_to_idx[start_state]
+        if end_state is not None:
+            if end_state not in self.state_to_idx:
+                raise ValueError(f"End state '{end_state}' not in the state space.")
+            end_idx = self.state_to_idx[end_state]
+        return start_idx, end_idx
+    
+    def inference_viterbi(self, start_state: Optional[Any] = None, length: int = 10,
+                          end_state: Optional[Any] = None, smoothing: float = 0.0) -> List[Any]:
+        """
+        Generate the most likely sequence of the given length using log-space Viterbi decoding.
+        Unlike inference_max, the whole sequence is optimized rather than each step greedily.
+        
+        Parameters:
+        -----------
+        start_state : state or None
+            The first state of the sequence. If None, any state may start the sequence.
+        length : int
+            The length of the sequence to generate.
+        end_state : state or None
+            If provided, the last state of the sequence.
+        smoothing : float
+            Additive smoothing applied to the transition counts, see log_likelihood.
             
-            # If there are no transitions from current state, break
-            if np.sum(probs) == 0:
-                break
+        Returns:
+        --------
+        sequence : list
+            The maximum-likelihood sequence.
+        """
+        start_idx, end_idx = self._decode_constraints(start_state, end_state, length)
+        log_probs = self._log_transition_matrix(smoothing)
+        n = self.n_states
+        
+        scores = np.zeros(n)
+        if start_idx is not None:
+            scores = np.full(n, -np.inf)
+            scores[start_idx] = 0.0
+        
+        # backpointers[t, j] is the best previous state for state j at position t + 1
+        backpointers = np.empty((length - 1, n), dtype=np.int16 if n <= np.iinfo(np.int16).max else np.int32)
+        columns = np.arange(n)
+        for t in range(length - 1):
+            candidates = scores[:, None] + log_probs
+            backpointers[t] = np.argmax(candidates, axis=0)
+            scores = candidates[backpointers[t], columns]
+        
+        last_idx = end_idx if end_idx is not None else int(np.argmax(scores))
+        if scores[last_idx] == -np.inf:
+            raise ValueError("No sequence with non-zero probability satisfies the constraints.")
+        
+        path = np.empty(length, dtype=np.int64)
+        path[-1] = last_idx
+        for t in range(length - 2, -1, -1):
+            path[t] = backpointers[t, path[t + 1]]
+        return [self.idx_to_state[idx] for idx in path.tolist()]
+    
+    def inference_beam(self, start_state: Optional[Any] = None, length: int = 10, beam_width: int = 8,
+                       end_state: Optional[Any] = None, smoothing: float = 0.0) -> List[Any]:
+        """
+        Generate a high-likelihood sequence using log-space beam search. Every step expands all
+        beams at once and keeps the beam_width best partial sequences.
+        
+        Parameters:
+        -----------
+        start_state : state or None
+            The first state of the sequence. If None, any state may start the sequence.
+        length : int
+            The length of the sequence to generate.
+        beam_width : int
+            Number of partial sequences kept after each step.
+        end_state : state or None
+            If provided, the last state of the sequence.
+        smoothing : float
+            Additive smoothing applied to the transition counts, see log_likelihood.
+            
+        Returns:
+        --------
+        sequence : list
+            The best sequence found.
+        """
+        start_idx, end_idx = self._decode_constraints(start_state, end_state, length)
+        if beam_width < 1:
+            raise ValueError("beam_width must be at least 1")
+        log_probs = self._log_transition_matrix(smoothing)
+        n = self.n_states
+        
+        if start_idx is not None:
+            beam_states = np.array([start_idx])
+        elif length == 1 and end_idx is not None:
+            beam_states = np.array([end_idx])
+        else:
+            beam_states = np.arange(n)
+        initial_states = beam_states
+        beam_scores = np.zeros(len(beam_states))
+        
+        history = [] # (parent beam, state) arrays per step
+        for t in range(length - 1):
+            candidates = beam_scores[:, None] + log_probs[beam_states]
+            if end_idx is not None and t == length - 2:
+                end_scores = candidates[:, end_idx].copy()
+                candidates.fill(-np.inf)
+                candidates[:, end_idx] = end_scores
+            flat_scores = candidates.ravel()
+            k = min(beam_width, len(flat_scores))
+            top = np.argpartition(-flat_scores, k - 1)[:k]
+            top = top[np.argsort(-flat_scores[top], kind='stable')]
+            top = top[flat_scores[top] > -np.inf]
+            if len(top) == 0:
+                raise ValueError("No sequence with non-zero probability satisfies the constraints.")
+            history.append((top // n, top % n))
+            beam_states = top % n
+            beam_scores = flat_scores[top]
+        
+        if length == 1:
+            if start_idx is not None and end_idx is not None and start_idx != end_idx:
+                raise ValueError("No sequence with non-zero probability satisfies the constraints.")
+            return [self.idx_to_state[int(beam_states[0])]]
+        
+        # Scores are sorted, so beam 0 is the best; walk its parents back to the start
+        path = np.empty(length, dtype=np.int64)
+        beam = 0
+        for t in range(length - 2, -1, -1):
+            parents, states = history[t]
+            path[t + 1] = states[beam]
+            beam = parents[beam]
+        path[0] = initial_states[beam]
+        return [self.idx_to_state[idx] for idx in path.tolist()]
+    
+    def _log_transition_matrix(self, smoothing: float = 0.0) -> np.ndarray:
+        """
+        Log transition probabilities with additive smoothing, cached per smoothing value.
+        """
+        if smoothing < 0:
+            raise ValueError("smoothing must be non-negative")
+        log_probs = self._log_prob_cache.get(smoothing)
+        if log_probs is None:
+            if smoothing > 0:
+                row_sums = self.count_matrix.sum(axis=1, keepdims=True)
+                probs = (self.count_matrix + smoothing) / (row_sums + smoothing * self.n_states)
+            else:
+                probs = self.transition_matrix
+            with np.errstate(divide='ignore'):
+                log_probs = np.log(probs)
+            self._log_prob_cache[smoothing] = log_probs
+        return log_probs
+    
+    def log_likelihood(self, sequences: List[List[Any]], smoothing: float = 0.0) -> np.ndarray:
+        """
+        Compute the log-likelihood of each sequence under the model, conditioned on its first state.
+        
+        Parameters:
+        -----------
+        sequences : list of lists
+            Sequences to score, where each sequence is a list of states.
+        smoothing : float
+            Additive (Laplace) smoothing applied to the transition counts. With 0, unseen
+            transitions have probability 0 and the sequence scores -inf.
             
-            # Choose the next state with the highest probability
-            next_idx = np.argmax(probs)
-            next_state = self.idx_to_state[next_idx]
-            sequence.append(next_state)
-            current_state = next_state
+        Returns:
+        --------
+        log_likelihoods : numpy.ndarray
+            Natural-log likelihood of each sequence. Sequences with fewer than 2 states score 0.
+        """
+        if not self.is_fitted:
+            raise ValueError("Model not fitted. Call calculate_transition_matrix first.")
+        
+        log_probs = self._log_transition_matrix(smoothing)
+        flat_indices, offsets = self._flatten_sequences(sequences)
+        n_sequences = len(offsets) - 1
+        if len(flat_indices) < 2:
+            return np.zeros(n_sequences)
+        
+        # Log-probability of every adjacent pair, then drop the pairs spanning two sequences
+        step_log_probs = log_probs[flat_indices[:-1], flat_indices[1:]]
+        sequence_ids = np.repeat(np.arange(n_sequences), np.diff(offsets))[:-1]
+        within_sequence = np.ones(len(step_log_probs), dtype=bool)
+        boundaries = offsets[1:-1] - 1
+        within_sequence[boundaries[(boundaries >= 0) & (boundaries < len(step_log_probs))]] = False
         
-        return sequence
+        return np.bincount(sequence_ids[within_sequence], weights=step_log_probs[within_sequence],
+                           minlength=n_sequences)
+    
+    def perplexity(self, sequences: List[List[Any]], smoothing: float = 0.0) -> np.ndarray:
+        """
+        Compute the per-transition perplexity of each sequence under the model.
+        
+        Parameters:
+        -----------
+        sequences : list of lists
+            Sequences to score, where each sequence is a list of states.
+        smoothing : float
+            Additive (Laplace) smoothing applied to the transition counts.
+            
+        Returns:
+        --------
+        perplexities : numpy.ndarray
+            exp(-log_likelihood / number of transitions) per sequence. NaN for sequences with
+            fewer than 2 states, inf for sequences containing an unseen transition.
+        """
+        log_likelihoods = self.log_likelihood(sequences, smoothing)
+        n_transitions = np.array([max(len(sequence) - 1, 0) for sequence in sequences], dtype=float)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.exp(-log_likelihoods / n_transitions)
     
     def get_transition_matrix(self) -> np.ndarray:
         """
@@ -254,16 +913,35 @@ class VanillaFirstOrderMarkovChain:
         """
         return self.count_matrix
     
-    def get_state_space(self) -> List[Any]:
+    def get_count_array(self) -> np.ndarray:
         """
-        Get the state space.
+        Get the counts as a dense array indexed by state index, as used by set_count_array.
         
         Returns:
         --------
-        state_space : list
-            The list of states.
+        counts : numpy.ndarray
+            The (n_states, n_states) count matrix.
+        """
+        return self.count_matrix
+    
+    def set_count_array(self, counts: np.ndarray) -> None:
         """
-        return self.state_space
+        Replace the counts, e.g. with merged shard counts, and recalculate the probabilities.
+        
+        Parameters:
+        -----------
+        counts : numpy.ndarray
+            (n_states, n_states) array of transition counts indexed by state index.
+        """
+        counts = np.asarray(counts)
+        if counts.shape != (self.n_states, self.n_states):
+            raise ValueError(f"Expected counts of shape {(self.n_states, self.n_states)}, got {counts.shape}.")
+        if np.issubdtype(self.count_dtype, np.integer) and counts.size and (
+                counts.min() < 0 or counts.max() > np.iinfo(self.count_dtype).max):
+            raise ValueError(f"Counts do not fit in {self.count_dtype}.")
+        self.count_matrix = counts.astype(self.count_dtype)
+        self._calculate_probabilities()
+        self.is_fitted = True
     
     def visualize_transition_matrix(self, save_path=None):
         """
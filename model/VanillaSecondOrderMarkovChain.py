@@ -1,125 +1,260 @@
 import numpy as np
 import random
-from typing import List, Optional, Any, Dict, Tuple
+from collections import OrderedDict
+from itertools import islice
+from typing import Iterable, Iterator, List, Optional, Any, Dict, Tuple
 import matplotlib.pyplot as plt
 import seaborn as sns
 import pandas as pd
 
-class VanillaSecondOrderMarkovChain:
+from model.MarkovChainMixins import CountModelMixin
+
+class VanillaSecondOrderMarkovChain(CountModelMixin):
     """
     A second-order Markov chain model that can learn transition probabilities
     from sequences and generate new sequences based on the learned model.
     """
     
-    def __init__(self, state_space: List[Any]):
+    def __init__(self, state_space: List[Any], count_dtype=np.float64, prob_dtype=np.float64,
+                 cdf_dtype=None, cdf_tolerance: float = 1e-4):
         """
         Initialize the Markov chain model.
         
         Parameters:
         -----------
         state_space : list
-            List of possible states. Must be provided.
+            List of possible states. Must be provided. Sets are sorted so state indices are deterministic.
+        count_dtype : numpy dtype
+            Storage type of the counts, e.g. np.uint32 for integer counts.
+        prob_dtype : numpy dtype
+            Storage type of the transition probabilities, np.float64 or np.float32.
+        cdf_dtype : numpy dtype or None
+            If np.float32 or np.uint16 (quantized to 1/65535), inference_prob samples from a
+            precomputed CDF table of this type instead of the transition tensor, and only the
+            counts and the CDF table are kept; transition_tensor is derived from the counts on access.
+        cdf_tolerance : float
+            Largest allowed absolute difference between any sampling probability implied by the
+            CDF table and the exact probability from the counts. Fitting raises a ValueError above it.
         """
-        if state_space is None or len(state_space) == 0:
-            raise ValueError("state_space must be provided and non-empty")
-            
-        self.state_space = state_space
-        self.state_to_idx = {state: idx for idx, state in enumerate(state_space)}
-        self.idx_to_state = {idx: state for idx, state in enumerate(state_space)}
-        self.n_states = len(state_space)
-        
-        # For second-order Markov chains, we need to track transitions from pairs of states
-        # Using a dictionary of dictionaries for sparse representation
-        self.count_matrix = {}
-        self.transition_matrix = {}
-        
-        # Initialize transition matrices for all possible state pairs
-        for i in range(self.n_states):
-            for j in range(self.n_states):
-                state_pair = (self.idx_to_state[i], self.idx_to_state[j])
-                self.count_matrix[state_pair] = {state: 0 for state in state_space}
-                self.transition_matrix[state_pair] = {state: 0.0 for state in state_space}
+        self._init_state_space(state_space)
+        self._init_storage_options(count_dtype, prob_dtype, cdf_dtype, cdf_tolerance)
+        
+        # For second-order Markov chains, we need to track transitions from pairs of states.
+        # Dense arrays indexed by (first, second, next) state index; the nested dictionaries
+        # count_matrix and transition_matrix are built from them on access.
+        self.count_tensor = np.zeros((self.n_states, self.n_states, self.n_states), dtype=self.count_dtype)
+        # Stored probabilities, None with a CDF table (see the transition_tensor property)
+        self._transition_tensor = (np.zeros((self.n_states, self.n_states, self.n_states), dtype=self.prob_dtype)
+                                   if self.cdf_dtype is None else None)
+        self.cdf_tensor = None # sampling CDF per state pair when cdf_dtype is set
+        self.cdf_error = 0.0 # largest sampling probability error of cdf_tensor
+        self._log_prob_cache = {} # smoothing -> log transition tensor
+        self._cdf_cache = OrderedDict() # sampling options -> reweighted CDF table, least recently used first
+        self.cdf_cache_size = 16 # maximum number of cached reweighted CDF tables
+        self._max_successor = np.full(self.n_states * self.n_states, -1, dtype=np.int64)
+        self._max_paths = {} # start pair id -> (path, cycle start) of the argmax walk
+        self._fingerprint = None # hash of the counts and options, reset whenever probabilities change
+        self.start_counts = None # (first, second) start pair counts of the training sequences, for start_mode='empirical'
+        self._valid_pair_ids = None # pair ids with outgoing transitions, built once per fit
+        self._valid_state_pairs = None # the same pairs as state tuples, for random.choice
+        self._stationary = {} # (max_iterations, tolerance) -> stationary distribution over pairs, built once per fit
             
         self.is_fitted = False
     
-    def calculate_transition_matrix(self, sequences: List[List[Any]], isPitch = True) -> None:
+    def _nested_dict(self, tensor: np.ndarray) -> Dict[Tuple[Any, Any], Dict[Any, Any]]:
+        """
+        Convert a (first, second, next) tensor to {(state1, state2): {next_state: value}}.
+        """
+        states = self.state_array.tolist()
+        rows = iter(tensor.reshape(self.n_states * self.n_states, self.n_states).tolist())
+        return {(first, second): dict(zip(states, next(rows))) for first in states for second in states}
+    
+    @property
+    def count_matrix(self) -> Dict[Tuple[Any, Any], Dict[Any, Any]]:
+        """
+        The counts as a nested dictionary {(state1, state2): {next_state: count}}, built from
+        count_tensor on every access. Changes to it are not written back.
+        """
+        return self._nested_dict(self.count_tensor)
+    
+    @property
+    def transition_tensor(self) -> np.ndarray:
+        """
+        The (n_states, n_states, n_states) transition probabilities. Stored when cdf_dtype is
+        None; with a CDF table they are normalized from the counts on every access, so only the
+        counts and the CDF table stay resident.
+        """
+        if self._transition_tensor is not None:
+            return self._transition_tensor
+        return self._probabilities().astype(self.prob_dtype, copy=False)
+    
+    @property
+    def transition_matrix(self) -> Dict[Tuple[Any, Any], Dict[Any, float]]:
+        """
+        The probabilities as a nested dictionary {(state1, state2): {next_state: probability}},
+        built from transition_tensor on every access. Changes to it are not written back.
+        """
+        return self._nested_dict(self.transition_tensor)
+    
+    def calculate_transition_matrix(self, sequences: List[List[Any]], isPitch = True,
+                                    offsets: Optional[np.ndarray] = None) -> None:
         """
         Calculate the transition matrix from sequences of states.
         
+        Each transition (first, second) -> next is weighted by the sum of the weights of
+        first -> next and second -> next: 2 within an octave (pitch) or within 100 ticks
+        (duration), 1 otherwise.
+        
         Parameters:
         -----------
-        sequences : list of lists
-            List of sequences, where each sequence is a list of states.
+        sequences : list of lists or array
+            List of sequences, where each sequence is a list of states. With offsets, one flat
+            array of the states of all sequences.
+        isPitch : bool
+            Whether the states are pitches, selecting the transition weights.
+        offsets : numpy.ndarray or None
+            Sequence boundaries in the flat array: sequence k spans sequences[offsets[k]:offsets[k + 1]].
+            No transitions are counted across boundaries.
         """
-        # Initialize count matrix
-        for state_pair in self.count_matrix:
-            for state in self.state_space:
-                self.count_matrix[state_pair][state] = 0
-        
-        # Count transitions
-        for sequence in sequences:
-            for i in range(len(sequence) - 2):  # Need at least 3 states for 2nd order
-                first_state = sequence[i]
-                second_state = sequence[i + 1]
-                next_state = sequence[i + 2]
-                
-                if first_state not in self.state_to_idx:
-                    raise ValueError(f"State '{first_state}' not in the state space.")
-                if second_state not in self.state_to_idx:
-                    raise ValueError(f"State '{second_state}' not in the state space.")
-                if next_state not in self.state_to_idx:
-                    raise ValueError(f"State '{next_state}' not in the state space.")
-                
-                state_pair = (first_state, second_state)
-
-                if isPitch:
-                    # Add weight transition to be within octave
-                    # First state
-                    weight = (12-abs(first_state - next_state))/12
-                    if weight >= 0:
-                        self.count_matrix[state_pair][next_state] += 2
-                    else:
-                        self.count_matrix[state_pair][next_state] += 1
-                    # Second state
-                    weight = (12-abs(second_state - next_state))/12
-                    if weight >= 0:
-                        self.count_matrix[state_pair][next_state] += 2
-                    else:
-                        self.count_matrix[state_pair][next_state] += 1
-                else:
-                    # First state
-                    if abs(first_state - next_state) > 100: # Add weight for similar duration +- 100
-                        self.count_matrix[state_pair][next_state] += 1
-                    else:
-                        self.count_matrix[state_pair][next_state] += 2
-                    # Second state
-                    if abs(second_state - next_state) > 100: # Add weight for similar duration +- 100
-                        self.count_matrix[state_pair][next_state] += 1
-                    else:
-                        self.count_matrix[state_pair][next_state] += 2
-                
-                # self.count_matrix[state_pair][next_state] += 1
-                
-        
-        # Calculate probabilities from counts
-        self._calculate_probabilities()
-        self.is_fitted = True
+        flat_indices, offsets = self._flatten_sequences(sequences, offsets)
+        self.set_count_array(self._count_flat(flat_indices, offsets, isPitch))
+        self.start_counts = self._count_starts(flat_indices, offsets)
+    
+    def _probabilities(self) -> np.ndarray:
+        """
+        Normalize the count tensor to float64 transition probabilities.
+        State pairs without observed transitions get a uniform distribution.
+        """
+        n = self.n_states
+        totals = self.count_tensor.sum(axis=2, keepdims=True, dtype=float)
+        return np.divide(self.count_tensor, totals, out=np.full((n, n, n), 1.0 / n), where=totals > 0)
     
     def _calculate_probabilities(self) -> None:
         """
         Calculate transition probabilities from count matrix.
         """
-        for state_pair in self.count_matrix:
-            # Get total counts for this state pair
-            total_count = sum(self.count_matrix[state_pair].values())
-            
-            # Calculate probabilities
-            for next_state in self.state_space:
-                if total_count > 0:
-                    self.transition_matrix[state_pair][next_state] = self.count_matrix[state_pair][next_state] / total_count
-                else:
-                    # Uniform distribution if no transitions observed
-                    self.transition_matrix[state_pair][next_state] = 1.0 / self.n_states
+        n = self.n_states
+        transition_tensor = self._probabilities()
+        self._build_cdf(transition_tensor)
+        self._transition_tensor = (transition_tensor.astype(self.prob_dtype, copy=False)
+                                   if self.cdf_dtype is None else None)
+        self._log_prob_cache = {}
+        self._cdf_cache = OrderedDict()
+        
+        # Argmax next state of every pair (a, b), stored as the id b * n + next of the following pair.
+        # -1 where the pair has no outgoing transitions.
+        pair_ids = np.arange(n * n).reshape(n, n)
+        next_pairs = (pair_ids % n) * n + np.argmax(transition_tensor, axis=2)
+        self._max_successor = np.where(transition_tensor.sum(axis=2) > 0, next_pairs, -1).ravel()
+        self._max_paths = {}
+        self._fingerprint = None
+        self._valid_pair_ids = None
+        self._valid_state_pairs = None
+        self._stationary = {}
+    
+    def _build_cdf(self, probs: np.ndarray) -> None:
+        """
+        Build the reduced-precision sampling CDFs from exact float64 probabilities and check
+        that the sampling distribution stays within cdf_tolerance.
+        """
+        self.cdf_tensor = None
+        self.cdf_error = 0.0
+        if self.cdf_dtype is None:
+            return
+        
+        cdf = np.cumsum(probs, axis=-1)
+        if self.cdf_dtype == np.uint16:
+            cdf_tensor = np.rint(cdf * np.iinfo(np.uint16).max).astype(np.uint16)
+        else:
+            cdf_tensor = cdf.astype(np.float32)
+        
+        # Sampling scales the uniform draw by the last CDF value, so compare against the renormalized table
+        sampled_cdf = cdf_tensor.astype(float)
+        totals = sampled_cdf[..., -1:]
+        np.divide(sampled_cdf, totals, out=sampled_cdf, where=totals > 0)
+        self.cdf_error = float(np.abs(np.diff(sampled_cdf, axis=-1, prepend=0.0) - probs).max())
+        if self.cdf_error > self.cdf_tolerance:
+            raise ValueError(f"{self.cdf_dtype} sampling probabilities deviate by up to {self.cdf_error:.3g}, "
+                             f"above cdf_tolerance {self.cdf_tolerance:.3g}.")
+        self.cdf_tensor = cdf_tensor
+    
+    def _sample_next(self, cdf_table: np.ndarray, first_idx: int, second_idx: int,
+                     rng: Optional[np.random.Generator] = None) -> int:
+        """
+        Sample the next state index from a CDF table. Draws one uniform number like
+        np.random.choice, so seeded runs follow the same random stream. Returns -1 if the
+        pair has no outgoing transitions.
+        """
+        cdf = cdf_table[first_idx, second_idx]
+        if cdf[-1] == 0:
+            return -1
+        draw = np.random.random_sample() if rng is None else rng.random()
+        return int(np.searchsorted(cdf, draw * cdf[-1], side='right'))
+    
+    def _sampling_table(self, harmony_temperature: Optional[float] = None, pitch_classes: Optional[Iterable] = None,
+                        temperature: Optional[float] = None, top_k: Optional[int] = None,
+                        top_p: Optional[float] = None) -> Optional[np.ndarray]:
+        """
+        Get the CDF table to sample from: cdf_tensor (None to sample from transition_tensor)
+        without options, else a reweighted table built once per setting and kept in a
+        least-recently-used cache of cdf_cache_size tables until the probabilities change,
+        so sampling from it costs the same as plain sampling.
+        """
+        if not self.is_fitted:
+            raise ValueError("Model not fitted. Call calculate_transition_matrix first.")
+        if harmony_temperature is None and pitch_classes is None and temperature is None and top_k is None and top_p is None:
+            return self.cdf_tensor
+        if harmony_temperature is not None and harmony_temperature <= 0:
+            raise ValueError(f"harmony_temperature must be positive, got {harmony_temperature}")
+        if temperature is not None and temperature <= 0:
+            raise ValueError(f"temperature must be positive, got {temperature}")
+        if top_k is not None and (int(top_k) != top_k or top_k < 1):
+            raise ValueError(f"top_k must be a positive integer, got {top_k}")
+        if top_p is not None and not 0 < top_p <= 1:
+            raise ValueError(f"top_p must be in (0, 1], got {top_p}")
+        
+        pitch_class_key = None if pitch_classes is None else self._pitch_class_key(pitch_classes)
+        key = (None if harmony_temperature is None else float(harmony_temperature), pitch_class_key,
+               None if temperature is None else float(temperature), None if top_k is None else int(top_k),
+               None if top_p is None else float(top_p))
+        cdf_table = self._cdf_cache.get(key)
+        if cdf_table is not None:
+            self._cdf_cache.move_to_end(key)
+            return cdf_table
+        
+        weights = self.transition_tensor.astype(float)
+        if harmony_temperature is not None:
+            # The bias applies to the interval from the second state of the pair to the next state
+            weights *= np.exp(self._harmony_scores() / harmony_temperature)[None, :, :]
+        if pitch_class_key is not None:
+            # Renormalize every row over the next states in the allowed pitch classes
+            weights *= self._pitch_class_states(pitch_class_key)[None, None, :]
+        cdf_table = self._weights_to_cdf(self._truncate_weights(weights, temperature, top_k, top_p))
+        self._cdf_cache[key] = cdf_table
+        while len(self._cdf_cache) > self.cdf_cache_size:
+            self._cdf_cache.popitem(last=False)
+        return cdf_table
+    
+    def _valid_start_pairs(self, cdf_table: np.ndarray, pitch_classes: Iterable) -> np.ndarray:
+        """
+        Boolean mask over pair ids of the pairs in the allowed pitch classes that can continue.
+        """
+        allowed = self._pitch_class_states(self._pitch_class_key(pitch_classes))
+        return (allowed[:, None] & allowed[None, :] & (cdf_table[:, :, -1] > 0)).ravel()
+    
+    def nbytes(self) -> int:
+        """
+        Get the memory held by the model's count, probability and sampling tables.
+        
+        Returns:
+        --------
+        nbytes : int
+            Total size of the arrays in bytes.
+        """
+        tables = [self.count_tensor, self._transition_tensor, self.cdf_tensor]
+        tables.extend(self._log_prob_cache.values())
+        tables.extend(self._cdf_cache.values())
+        return sum(table.nbytes for table in tables if table is not None)
     
     def update_transition_matrix(self, new_sequences: List[List[Any]]) -> None:
         """
@@ -133,29 +268,83 @@ class VanillaSecondOrderMarkovChain:
         if not self.is_fitted:
             self.calculate_transition_matrix(new_sequences)
             return
+        if not self.count_tensor.flags.writeable:
+            raise ValueError("Counts are read-only, e.g. attached from SharedModelTables, and cannot be updated.")
         
         # Count new transitions and add to existing count matrix
         for sequence in new_sequences:
-            for i in range(len(sequence) - 2):
-                first_state = sequence[i]
-                second_state = sequence[i + 1]
-                next_state = sequence[i + 2]
-                
-                if first_state not in self.state_to_idx:
-                    raise ValueError(f"State '{first_state}' not in the state space.")
-                if second_state not in self.state_to_idx:
-                    raise ValueError(f"State '{second_state}' not in the state space.")
-                if next_state not in self.state_to_idx:
-                    raise ValueError(f"State '{next_state}' not in the state space.")
-                
-                state_pair = (first_state, second_state)
-                self.count_matrix[state_pair][next_state] += 1
+            if len(sequence) < 2:
+                continue
+            indices = self._to_indices(sequence)
+            if self.start_counts is not None:
+                self.start_counts[indices[0], indices[1]] += 1
+            np.add.at(self.count_tensor, (indices[:-2], indices[1:-1], indices[2:]), 1)
         
         # Recalculate probabilities from updated count matrix
         self._calculate_probabilities()
     
+    def count_transitions(self, sequences: List[List[Any]], isPitch = True,
+                          offsets: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Count the weighted transitions in sequences without modifying the model.
+        Counts from different shards of a corpus can be summed and passed to set_count_array.
+        
+        Parameters:
+        -----------
+        sequences : list of lists
+            List of sequences, where each sequence is a list of states.
+        isPitch : bool
+            Whether the states are pitches, selecting the same weights as calculate_transition_matrix.
+        offsets : numpy.ndarray or None
+            Sequence boundaries when sequences is one flat array, see calculate_transition_matrix.
+            
+        Returns:
+        --------
+        counts : numpy.ndarray
+            Integer (n_states, n_states, n_states) array of transition counts, indexed by
+            (first state, second state, next state).
+        """
+        flat_indices, offsets = self._flatten_sequences(sequences, offsets)
+        return self._count_flat(flat_indices, offsets, isPitch)
+    
+    def _count_flat(self, flat_indices: np.ndarray, offsets: np.ndarray, isPitch: bool) -> np.ndarray:
+        """
+        Count the weighted transitions of flattened state indices, see count_transitions.
+        """
+        n = self.n_states
+        if len(flat_indices) < 3:
+            return np.zeros((n, n, n), dtype=np.int64)
+        
+        within_sequence = np.ones(len(flat_indices) - 2, dtype=bool)
+        for shift in (1, 2):
+            boundaries = offsets[1:-1] - shift
+            within_sequence[boundaries[(boundaries >= 0) & (boundaries < len(within_sequence))]] = False
+        first_indices = flat_indices[:-2][within_sequence]
+        second_indices = flat_indices[1:-1][within_sequence]
+        next_indices = flat_indices[2:][within_sequence]
+        
+        state_values = np.asarray(self.state_array.tolist(), dtype=float)
+        next_values = state_values[next_indices]
+        weights = (self._transition_weights(state_values[first_indices], next_values, isPitch)
+                   + self._transition_weights(state_values[second_indices], next_values, isPitch))
+        counts = np.bincount((first_indices * n + second_indices) * n + next_indices, weights=weights,
+                             minlength=n ** 3)
+        return counts.astype(np.int64).reshape(n, n, n)
+    
+    def _count_starts(self, flat_indices: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+        """
+        Count the first pair of every sequence with at least two states, for start_mode='empirical'.
+        """
+        n = self.n_states
+        starts = offsets[:-1][offsets[1:] - offsets[:-1] >= 2]
+        pair_ids = flat_indices[starts] * n + flat_indices[starts + 1]
+        return np.bincount(pair_ids, minlength=n * n).astype(np.int64).reshape(n, n)
+    
     def _get_initial_state_pair(self, start_state: Optional[Tuple[Any, Any]] = None, 
-                               random_seed: Optional[int] = None) -> Tuple[Any, Any]:
+                               random_seed: Optional[int] = None,
+                               valid_pairs: Optional[np.ndarray] = None,
+                               start_mode: str = "uniform",
+                               rng: Optional[np.random.Generator] = None) -> Tuple[Any, Any]:
         """
         Helper function to handle the common pre-check logic for inference methods.
         
@@ -165,6 +354,13 @@ class VanillaSecondOrderMarkovChain:
             The starting state pair. If None, will be chosen randomly.
         random_seed : int or None
             Random seed for reproducibility.
+        valid_pairs : numpy.ndarray or None
+            Boolean mask over pair ids (first_idx * n_states + second_idx) of the pairs a random
+            start is chosen from. Defaults to the pairs with outgoing transitions.
+        start_mode : str
+            Distribution of a random start over the valid pairs, see inference_prob.
+        rng : numpy.random.Generator or None
+            Generator to draw from instead of the seeded global random states, see stream.
             
         Returns:
         --------
@@ -174,22 +370,37 @@ class VanillaSecondOrderMarkovChain:
         if not self.is_fitted:
             raise ValueError("Model not fitted. Call calculate_transition_matrix first.")
         
-        if random_seed is not None:
+        if rng is None and random_seed is not None:
             np.random.seed(random_seed)
             random.seed(random_seed)
         
         if start_state is None:
             # Find state pairs that have outgoing transitions
-            valid_state_pairs = []
-            for state_pair in self.transition_matrix:
-                if any(prob > 0 for prob in self.transition_matrix[state_pair].values()):
-                    valid_state_pairs.append(state_pair)
+            n = self.n_states
+            if valid_pairs is None:
+                valid_pair_ids = self._get_valid_pair_ids()
+                valid_state_pairs = self._valid_state_pairs
+            else:
+                valid_pair_ids = np.flatnonzero(valid_pairs)
+                valid_state_pairs = None
             
-            if not valid_state_pairs:
+            if len(valid_pair_ids) == 0:
                 raise ValueError("No valid state pairs found with outgoing transitions.")
             
             # Choose a random state pair
-            current_state_pair = random.choice(valid_state_pairs)
+            if start_mode == "uniform":
+                if valid_state_pairs is None:
+                    valid_state_pairs = [(self.idx_to_state[pair_id // n], self.idx_to_state[pair_id % n])
+                                         for pair_id in valid_pair_ids.tolist()]
+                if rng is None:
+                    current_state_pair = random.choice(valid_state_pairs)
+                else:
+                    current_state_pair = valid_state_pairs[rng.integers(len(valid_state_pairs))]
+            else:
+                start_probs = self._start_probabilities(start_mode, valid_pair_ids)
+                chooser = np.random if rng is None else rng
+                pair_id = int(valid_pair_ids[chooser.choice(len(valid_pair_ids), p=start_probs)])
+                current_state_pair = (self.idx_to_state[pair_id // n], self.idx_to_state[pair_id % n])
         else:
             first_state, second_state = start_state
             if first_state not in self.state_to_idx:
@@ -200,8 +411,83 @@ class VanillaSecondOrderMarkovChain:
             
         return current_state_pair
     
+    def _get_valid_pair_ids(self) -> np.ndarray:
+        """
+        Ids (first_idx * n_states + second_idx) of the pairs with outgoing transitions, and the
+        matching state pairs in _valid_state_pairs, built once per fit.
+        """
+        if self._valid_pair_ids is None:
+            n = self.n_states
+            valid_pair_ids = np.flatnonzero(self._max_successor >= 0)
+            self._valid_state_pairs = [(self.idx_to_state[pair_id // n], self.idx_to_state[pair_id % n])
+                                       for pair_id in valid_pair_ids.tolist()]
+            self._valid_pair_ids = valid_pair_ids
+        return self._valid_pair_ids
+    
+    def _start_probabilities(self, start_mode: str, valid_pair_ids: np.ndarray) -> np.ndarray:
+        """
+        Probabilities of the valid start pairs under start_mode 'empirical' or 'stationary'.
+        """
+        if start_mode == "empirical":
+            if self.start_counts is None:
+                raise ValueError("No start counts. Fit with calculate_transition_matrix to use start_mode='empirical'.")
+            weights = np.asarray(self.start_counts, dtype=float).ravel()[valid_pair_ids]
+        elif start_mode == "stationary":
+            weights = self.stationary_distribution().ravel()[valid_pair_ids]
+        else:
+            raise ValueError(f"start_mode must be 'uniform', 'empirical' or 'stationary', got {start_mode!r}")
+        total = weights.sum()
+        if total == 0:
+            raise ValueError(f"No valid start pair has {start_mode} start probability.")
+        return weights / total
+    
+    def stationary_distribution(self, max_iterations: int = 1000, tolerance: float = 1e-10) -> np.ndarray:
+        """
+        Get the stationary distribution of the chain over state pairs by power iteration of the lazy
+        chain (P + I) / 2, which also converges for periodic chains. Cached per fit and per
+        (max_iterations, tolerance).
+        
+        Parameters:
+        -----------
+        max_iterations : int
+            Maximum number of power iterations.
+        tolerance : float
+            Stop once the L1 change of an iteration falls below this.
+            
+        Returns:
+        --------
+        distribution : numpy.ndarray
+            Probability of every pair, shape (n_states, n_states) indexed by (first, second).
+        """
+        if not self.is_fitted:
+            raise ValueError("Model not fitted. Call calculate_transition_matrix first.")
+        key = (max_iterations, tolerance)
+        if key not in self._stationary:
+            n = self.n_states
+            transition_tensor = self.transition_tensor.astype(float)
+            valid_pair_ids = self._get_valid_pair_ids()
+            distribution = np.zeros(n * n)
+            distribution[valid_pair_ids] = 1.0 / max(len(valid_pair_ids), 1)
+            distribution = distribution.reshape(n, n)
+            for _ in range(max_iterations):
+                # Mass on (a, b) moves to (b, c) with probability P(c | a, b)
+                updated = 0.5 * (distribution + np.einsum("ab,abc->bc", distribution, transition_tensor))
+                total = updated.sum()
+                if total == 0:
+                    break
+                updated /= total
+                change = np.abs(updated - distribution).sum()
+                distribution = updated
+                if change < tolerance:
+                    break
+            self._stationary[key] = distribution
+        return self._stationary[key]
+    
     def inference_prob(self, start_state: Optional[Tuple[Any, Any]] = None, length: int = 10, 
-                      random_seed: Optional[int] = None) -> List[Any]:
+                      random_seed: Optional[int] = None, harmony_temperature: Optional[float] = None,
+                      pitch_classes: Optional[Iterable] = None, temperature: Optional[float] = None,
+                      top_k: Optional[int] = None, top_p: Optional[float] = None,
+                      start_mode: str = "uniform") -> List[Any]:
         """
         Generate a new sequence based on the learned transition probabilities,
         using weighted random selection according to transition probabilities.
@@ -214,45 +500,223 @@ class VanillaSecondOrderMarkovChain:
             The length of the sequence to generate.
         random_seed : int or None
             Random seed for reproducibility.
+        harmony_temperature : float or None
+            If set, multiply every transition probability by exp(score / harmony_temperature),
+            where score is the examiner's interval weight from the current pitch to the next,
+            and renormalize. Lower temperatures favour consonant intervals more strongly.
+        pitch_classes : iterable or None
+            Keep the melody in a scale: pitch classes (0 = C ... 11 = B), e.g. [5, 7, 9, 10, 0, 2, 4]
+            for F major, or a mask of 12 booleans. Every transition row is renormalized over the
+            allowed states and a random start pair is chosen among them. The sequence ends early
+            at a pair with no allowed successor.
+        temperature : float or None
+            Raise every probability to the power 1 / temperature and renormalize. Below 1 sharpens
+            the distribution towards inference_max, above 1 flattens it.
+        top_k : int or None
+            Only sample from the top_k most likely next states.
+        top_p : float or None
+            Nucleus sampling: only sample from the smallest set of most likely next states whose
+            probability adds up to at least top_p.
+        start_mode : str
+            Distribution of a random start pair: 'uniform' over the pairs with outgoing
+            transitions, 'empirical' as often as each pair starts a training sequence, or
+            'stationary' following the chain's stationary distribution over pairs.
             
         Returns:
         --------
         sequence : list
             The generated sequence with probabilistic transitions.
         """
-        current_state_pair = self._get_initial_state_pair(start_state, random_seed)
-        # Start with the initial pair of states
-        sequence = list(current_state_pair)
+        states = self.stream(start_state, random_seed, harmony_temperature, pitch_classes, temperature,
+                             top_k, top_p, start_mode)
+        # The starting pair is always returned, even for lengths below 2
+        return list(islice(states, max(length, 2)))
+    
+    def stream(self, start_state: Optional[Tuple[Any, Any]] = None, random_seed: Optional[int] = None,
+               harmony_temperature: Optional[float] = None, pitch_classes: Optional[Iterable] = None,
+               temperature: Optional[float] = None, top_k: Optional[int] = None, top_p: Optional[float] = None,
+               start_mode: str = "uniform", rng: Optional[np.random.Generator] = None) -> Iterator[Any]:
+        """
+        Generate states one at a time, for live output. The sampling table, seed and start pair
+        are set up when stream is called; after that every step costs one row lookup, however
+        long the stream runs. The stream only ends at a pair with no outgoing transitions.
         
-        for _ in range(length - 2):  # -2 because we already have the first two states
-            # Get transition probabilities from the current state pair
-            probs = self.transition_matrix[current_state_pair]
-            
-            # Convert to list for np.random.choice
-            states = list(probs.keys())
-            probabilities = [probs[state] for state in states]
+        With the same arguments, the first length states are the sequence inference_prob returns,
+        as long as nothing else draws from numpy's global random state in between.
+        
+        Parameters:
+        -----------
+        start_state, random_seed, harmony_temperature, pitch_classes, temperature, top_k, top_p, start_mode
+            See inference_prob.
+        rng : numpy.random.Generator or None
+            If given, every draw comes from this generator and random_seed is ignored, so several
+            streams can run side by side without sharing the global random states.
             
-            # Normalize probabilities (ensure they sum to 1)
-            prob_sum = sum(probabilities)
-            if prob_sum == 0:
-                break  # No transitions available
+        Returns:
+        --------
+        states : iterator
+            The generated states, starting with the two states of the start pair.
+        """
+        cdf_table = self._sampling_table(harmony_temperature, pitch_classes, temperature, top_k, top_p)
+        valid_pairs = None if pitch_classes is None else self._valid_start_pairs(cdf_table, pitch_classes)
+        current_state_pair = self._get_initial_state_pair(start_state, random_seed, valid_pairs, start_mode, rng)
+        return self._walk(current_state_pair, cdf_table, rng)
+    
+    def _walk(self, current_state_pair: Tuple[Any, Any], cdf_table: Optional[np.ndarray],
+              rng: Optional[np.random.Generator] = None) -> Iterator[Any]:
+        """
+        Random walk from current_state_pair, yielding its two states and then every sampled state.
+        """
+        yield from current_state_pair
+        first_idx = self.state_to_idx[current_state_pair[0]]
+        second_idx = self.state_to_idx[current_state_pair[1]]
+        chooser = np.random if rng is None else rng
+        while True:
+            if cdf_table is not None:
+                next_idx = self._sample_next(cdf_table, first_idx, second_idx, rng)
+                if next_idx < 0:
+                    return  # No transitions available
+            else:
+                # Get transition probabilities from the current state pair
+                probs = self.transition_tensor[first_idx, second_idx].astype(float)
                 
-            normalized_probs = [p/prob_sum for p in probabilities]
-            
-            # Choose next state based on probabilities
-            next_state = np.random.choice(states, p=normalized_probs)
-            sequence.append(next_state)
+                # Normalize probabilities (ensure they sum to 1)
+                prob_sum = probs.sum()
+                if prob_sum == 0:
+                    return  # No transitions available
+                
+                # Choose next state based on probabilities
+                next_idx = chooser.choice(self.n_states, p=probs / prob_sum)
             
             # Update current state pair for next iteration
-            current_state_pair = (current_state_pair[1], next_state)
+            first_idx, second_idx = second_idx, next_idx
+            yield self.idx_to_state[next_idx]
+    
+    def sample_indices(self, n_sequences: int, length: int = 10, start_state: Optional[Tuple[Any, Any]] = None,
+                       random_seed: Optional[int] = None, harmony_temperature: Optional[float] = None,
+                       pitch_classes: Optional[Iterable] = None, temperature: Optional[float] = None,
+                       top_k: Optional[int] = None, top_p: Optional[float] = None,
+                       start_mode: str = "uniform") -> np.ndarray:
+        """
+        Generate many sequences at once, like inference_prob but vectorized across sequences:
+        each step draws one uniform number per sequence and looks it up in the sampled rows'
+        CDFs. The random stream differs from inference_prob.
         
-        return sequence
+        Parameters:
+        -----------
+        n_sequences : int
+            Number of sequences to generate.
+        length : int
+            The length of each sequence, including the starting pair.
+        start_state : tuple(state, state) or None
+            The starting state pair of every sequence. If None, chosen randomly per sequence.
+        random_seed : int or None
+            Random seed for reproducibility.
+        harmony_temperature : float or None
+            Bias towards consonant intervals, see inference_prob.
+        pitch_classes : iterable or None
+            Scale to keep the sequences in, see inference_prob.
+        temperature, top_k, top_p : float, int, float or None
+            Reshape every transition row before sampling, see inference_prob.
+        start_mode : str
+            Distribution of random start pairs, see inference_prob.
+            
+        Returns:
+        --------
+        indices : numpy.ndarray
+            State indices of shape (n_sequences, length), -1 after a sequence reaches a pair
+            with no outgoing transitions. Map them to states with state_array.
+        """
+        if length < 2:
+            raise ValueError("length must be at least 2 for a second-order model")
+        cdf_table = self._sampling_table(harmony_temperature, pitch_classes, temperature, top_k, top_p)
+        if random_seed is not None:
+            np.random.seed(random_seed)
+            random.seed(random_seed)
+        
+        n = self.n_states
+        indices = np.full((n_sequences, length), -1, dtype=np.int64)
+        if start_state is None:
+            if pitch_classes is None:
+                valid_pair_ids = self._get_valid_pair_ids()
+            else:
+                valid_pair_ids = np.flatnonzero(self._valid_start_pairs(cdf_table, pitch_classes))
+            if len(valid_pair_ids) == 0:
+                raise ValueError("No valid state pairs found with outgoing transitions.")
+            if start_mode == "uniform":
+                starts = np.random.randint(len(valid_pair_ids), size=n_sequences)
+            else:
+                start_probs = self._start_probabilities(start_mode, valid_pair_ids)
+                starts = np.random.choice(len(valid_pair_ids), size=n_sequences, p=start_probs)
+            pair_ids = valid_pair_ids[starts]
+            indices[:, 0], indices[:, 1] = pair_ids // n, pair_ids % n
+        else:
+            first_state, second_state = start_state
+            if first_state not in self.state_to_idx:
+                raise ValueError(f"First state '{first_state}' not in the state space.")
+            if second_state not in self.state_to_idx:
+                raise ValueError(f"Second state '{second_state}' not in the state space.")
+            indices[:, 0], indices[:, 1] = self.state_to_idx[first_state], self.state_to_idx[second_state]
+        
+        active = np.arange(n_sequences)
+        for step in range(2, length):
+            first, second = indices[active, step - 2], indices[active, step - 1]
+            if cdf_table is not None:
+                cdf = cdf_table[first, second]
+            else:
+                cdf = np.cumsum(self.transition_tensor[first, second], axis=1, dtype=float)
+            totals = cdf[:, -1]
+            draws = np.random.random_sample(len(active)) * totals
+            # Same as searchsorted(side='right') on every row
+            next_indices = (cdf <= draws[:, None]).sum(axis=1)
+            alive = totals > 0
+            active = active[alive]
+            if len(active) == 0:
+                break
+            indices[active, step] = next_indices[alive]
+        
+        return indices
+    
+    def _get_max_path(self, start_pair_id: int) -> Tuple[np.ndarray, int]:
+        """
+        Follow the argmax successors from a start pair until a pair repeats or has no successor.
+        Pairs are identified by first_idx * n + second_idx. The result is cached per start pair
+        until the probabilities change.
+        
+        Returns:
+        --------
+        path : numpy.ndarray
+            Pair ids visited before the walk repeats or stops.
+        cycle_start : int
+            Position in path where the repeating cycle begins, or -1 if the walk reaches a dead end.
+        """
+        cached = self._max_paths.get(start_pair_id)
+        if cached is not None:
+            return cached
+        
+        successor = self._max_successor
+        position = {}
+        path = []
+        pair_id = start_pair_id
+        while pair_id >= 0 and pair_id not in position:
+            position[pair_id] = len(path)
+            path.append(pair_id)
+            pair_id = int(successor[pair_id])
+        cycle_start = position[pair_id] if pair_id >= 0 else -1
+        
+        cached = (np.array(path, dtype=np.int64), cycle_start)
+        self._max_paths[start_pair_id] = cached
+        return cached
     
     def inference_max(self, start_state: Optional[Tuple[Any, Any]] = None, length: int = 10) -> List[Any]:
         """
         Generate a new sequence based on the learned transition probabilities,
         always selecting the next state with the highest transition probability.
         
+        Since every step is deterministic, the sequence of state pairs is a prefix followed by a
+        repeating cycle. The walk is computed once per start pair and long sequences are built by
+        tiling the cycle.
+        
         Parameters:
         -----------
         start_state : tuple(state, state) or None
@@ -265,25 +729,330 @@ class VanillaSecondOrderMarkovChain:
         sequence : list
             The generated sequence with maximum probability transitions.
         """
-        current_state_pair = self._get_initial_state_pair(start_state)
-        # Start with the initial pair of states
-        sequence = list(current_state_pair)
+        first_state, second_state = self._get_initial_state_pair(start_state)
+        n = self.n_states
+        path, cycle_start = self._get_max_path(self.state_to_idx[first_state] * n + self.state_to_idx[second_state])
+        n_pairs = max(length - 1, 1) # consecutive pairs overlap, so n_pairs pairs cover n_pairs + 1 states
+        
+        if n_pairs <= len(path) or cycle_start < 0:
+            # Short sequence, or the walk stops at a pair with no transitions
+            pair_ids = path[:n_pairs]
+        else:
+            cycle = path[cycle_start:]
+            repeats = -(-(n_pairs - cycle_start) // len(cycle))
+            pair_ids = np.concatenate((path[:cycle_start], np.tile(cycle, repeats)))[:n_pairs]
+        
+        indices = np.empty(len(pair_ids) + 1, dtype=np.int64)
+        indices[0] = pair_ids[0] // n
+        indices[1:] = pair_ids % n
+        return self.state_array[indices].tolist()
+    
+    def _decode_constraints(self, start_state: Optional[Tuple[Any, Any]], end_state: Optional[Any],
+                            length: int) -> Tuple[Optional[Tuple[int, int]], Optional[int]]:
+        """
+        Helper function to validate the arguments shared by the decoding methods.
+        
+        Returns:
+        --------
+        start_idx, end_idx : tuple(int, int) or None, int or None
+            Indices of the start pair and end constraints.
+        """
+        if not self.is_fitted:
+            raise ValueError("Model not fitted. Call calculate_transition_matrix first.")
+        if length < 2:
+            raise ValueError("length must be at least 2")
+        
+        start_idx = None
+        end_idx = None
+        if start_state is not None:
+            first_state, second_state = start_state
+            if first_state not in self.state_to_idx:
+                raise ValueError(f"First state '{first_state}' not in the state space.")
+            if second_state not in self.state_to_idx:
+                raise ValueError(f"Second state '{second_state}' not in the state space.")
+            start_idx = (self.state_to_idx[first_state], self.state_to_idx[second_state])
+        if end_state is not None:
+            if end_state not in self.state_to_idx:
+                raise ValueError(f"End state '{end_state}' not in the state space.")
+            end_idx = self.state_to_idx[end_state]
+        return start_idx, end_idx
+    
+    def inference_viterbi(self, start_state: Optional[Tuple[Any, Any]] = None, length: int = 10,
+                          end_state: Optional[Any] = None, smoothing: float = 0.0) -> List[Any]:
+        """
+        Generate the most likely sequence of the given length using log-space Viterbi decoding
+        over state pairs.
         
-        for _ in range(length - 2):  # -2 because we already have the first two states
-            # Get transition probabilities from the current state pair
-            probs = self.transition_matrix[current_state_pair]
+        Every row of the log transition tensor is a constant (log 1/n for unobserved pairs, -inf
+        or the smoothed zero-count value otherwise) except at the observed transitions, which are
+        few. Each step therefore takes the best predecessor of every pair from the constant part
+        in O(n^2) and from the sparse observed transitions in O(nnz), instead of scanning all
+        n^3 transitions.
+        
+        Parameters:
+        -----------
+        start_state : tuple(state, state) or None
+            The first two states of the sequence. If None, any pair may start the sequence.
+        length : int
+            The length of the sequence to generate, including the start pair.
+        end_state : state or None
+            If provided, the last state of the sequence.
+        smoothing : float
+            Additive smoothing applied to the transition counts, see log_likelihood.
             
-            # Find the state with the highest probability
-            if all(p == 0 for p in probs.values()):
-                break  # No transitions available
-                
-            next_state = max(probs.items(), key=lambda x: x[1])[0]
-            sequence.append(next_state)
+        Returns:
+        --------
+        sequence : list
+            The maximum-likelihood sequence.
+        """
+        start_idx, end_idx = self._decode_constraints(start_state, end_state, length)
+        log_probs = self._log_transition_tensor(smoothing)
+        n = self.n_states
+        
+        # scores[a, b] is the best log-probability of a sequence ending with the pair (a, b)
+        scores = np.zeros((n, n))
+        if start_idx is not None:
+            scores = np.full((n, n), -np.inf)
+            scores[start_idx] = 0.0
+        
+        base, target_ids, groups = self._viterbi_entries(log_probs)
+        target_second = target_ids // n
+        values = np.empty(len(target_ids))
+        best_predecessors = np.empty(len(target_ids), dtype=np.int64)
+        
+        # backpointers[t, b, c] is the best state before the pair (b, c) ending at position t + 2
+        backpointers = np.empty((length - 2, n, n), dtype=np.int16 if n <= np.iinfo(np.int16).max else np.int32)
+        columns = np.arange(n)
+        for t in range(length - 2):
+            # Best predecessor through the row constants, the same for every next state c
+            base_scores = scores + base
+            base_best = np.argmax(base_scores, axis=0)
+            base_values = base_scores[base_best, columns]
             
-            # Update current state pair for next iteration
-            current_state_pair = (current_state_pair[1], next_state)
+            # Best predecessor of every target pair through the entries above the row constants
+            flat_scores = scores.ravel()
+            for pair_ids, entry_log_probs, predecessors, row_starts, out in groups:
+                candidates = flat_scores[pair_ids]
+                candidates += entry_log_probs
+                best = np.argmax(candidates, axis=1)
+                best += row_starts
+                np.take(candidates, best, out=values[out])
+                np.take(predecessors, best, out=best_predecessors[out])
+            
+            current = base_values[target_second]
+            better = (values > current) | ((values == current) & (best_predecessors < base_best[target_second]))
+            scores = np.repeat(base_values[:, None], n, axis=1)
+            backpointers[t] = base_best[:, None]
+            scores.ravel()[target_ids[better]] = values[better]
+            backpointers[t].reshape(-1)[target_ids[better]] = best_predecessors[better]
+        
+        if end_idx is not None:
+            last_pair = (int(np.argmax(scores[:, end_idx])), end_idx)
+        else:
+            last_pair = np.unravel_index(int(np.argmax(scores)), scores.shape)
+        if scores[last_pair] == -np.inf:
+            raise ValueError("No sequence with non-zero probability satisfies the constraints.")
+        
+        path = np.empty(length, dtype=np.int64)
+        path[-2], path[-1] = last_pair
+        for t in range(length - 3, -1, -1):
+            path[t] = backpointers[t, path[t + 1], path[t + 2]]
+        return [self.idx_to_state[idx] for idx in path.tolist()]
+    
+    def _viterbi_entries(self, log_probs: np.ndarray) -> Tuple[np.ndarray, np.ndarray, List[Tuple[Any, ...]]]:
+        """
+        Split log_probs[a, b, c] into the row minimum base[a, b] and the few entries above it,
+        grouped by the pair (b, c) they lead to for inference_viterbi.
+        
+        Returns:
+        --------
+        base, target_ids, groups : numpy.ndarray, numpy.ndarray, list of tuple
+            base has shape (n_states, n_states). target_ids are the ids b * n_states + c of the
+            pairs with entries. Every group covers the slice out of target_ids and holds, per
+            target, its entries padded with -inf to the group's width: pair ids a * n_states + b,
+            log-probabilities and predecessors a, plus the flat offset of every row. Entries are
+            sorted by a, so np.argmax resolves ties to the smallest predecessor like the dense maximum.
+        """
+        n = self.n_states
+        base = log_probs.min(axis=2)
+        first, second, following = np.nonzero(log_probs > base[:, :, None])
+        entry_log_probs = log_probs[first, second, following]
+        target = second * n + following
+        order = np.lexsort((first, target))
+        first, pair_ids, entry_log_probs = first[order], (first * n + second)[order], entry_log_probs[order]
+        target_ids, starts, counts = np.unique(target[order], return_index=True, return_counts=True)
+        
+        # Targets with up to 4 entries share one group, larger ones are padded to the next power of two
+        groups = []
+        group_targets = []
+        filled = 0
+        lower, width = 0, 4
+        while len(counts) and lower < counts.max():
+            members = np.flatnonzero((counts > lower) & (counts <= width))
+            if len(members):
+                offsets = np.arange(width)[None, :]
+                valid = offsets < counts[members][:, None]
+                entries = np.where(valid, starts[members][:, None] + offsets, 0)
+                groups.append((np.where(valid, pair_ids[entries], 0), np.where(valid, entry_log_probs[entries], -np.inf),
+                               first[entries].ravel(), np.arange(len(members)) * width,
+                               slice(filled, filled + len(members))))
+                group_targets.append(target_ids[members])
+                filled += len(members)
+            lower, width = width, width * 2
+        target_ids = np.concatenate(group_targets) if group_targets else np.empty(0, dtype=np.int64)
+        return base, target_ids, groups
+    
+    def inference_beam(self, start_state: Optional[Tuple[Any, Any]] = None, length: int = 10, beam_width: int = 8,
+                       end_state: Optional[Any] = None, smoothing: float = 0.0) -> List[Any]:
+        """
+        Generate a high-likelihood sequence using log-space beam search. Every step expands all
+        beams at once and keeps the beam_width best partial sequences.
+        
+        Parameters:
+        -----------
+        start_state : tuple(state, state) or None
+            The first two states of the sequence. If None, any pair may start the sequence.
+        length : int
+            The length of the sequence to generate, including the start pair.
+        beam_width : int
+            Number of partial sequences kept after each step.
+        end_state : state or None
+            If provided, the last state of the sequence.
+        smoothing : float
+            Additive smoothing applied to the transition counts, see log_likelihood.
+            
+        Returns:
+        --------
+        sequence : list
+            The best sequence found.
+        """
+        start_idx, end_idx = self._decode_constraints(start_state, end_state, length)
+        if beam_width < 1:
+            raise ValueError("beam_width must be at least 1")
+        log_probs = self._log_transition_tensor(smoothing)
+        n = self.n_states
+        
+        if start_idx is not None:
+            beam_first = np.array([start_idx[0]])
+            beam_second = np.array([start_idx[1]])
+        else:
+            beam_first, beam_second = np.divmod(np.arange(n * n), n)
+        if length == 2:
+            valid = np.ones(len(beam_second), dtype=bool) if end_idx is None else beam_second == end_idx
+            if not valid.any():
+                raise ValueError("No sequence with non-zero probability satisfies the constraints.")
+            best = int(np.argmax(valid))
+            return [self.idx_to_state[int(beam_first[best])], self.idx_to_state[int(beam_second[best])]]
+        initial_first, initial_second = beam_first, beam_second
+        beam_scores = np.zeros(len(beam_first))
+        
+        history = [] # (parent beam, state) arrays per step
+        for t in range(length - 2):
+            candidates = beam_scores[:, None] + log_probs[beam_first, beam_second]
+            if end_idx is not None and t == length - 3:
+                end_scores = candidates[:, end_idx].copy()
+                candidates.fill(-np.inf)
+                candidates[:, end_idx] = end_scores
+            flat_scores = candidates.ravel()
+            k = min(beam_width, len(flat_scores))
+            top = np.argpartition(-flat_scores, k - 1)[:k]
+            top = top[np.argsort(-flat_scores[top], kind='stable')]
+            top = top[flat_scores[top] > -np.inf]
+            if len(top) == 0:
+                raise ValueError("No sequence with non-zero probability satisfies the constraints.")
+            parents, next_states = np.divmod(top, n)
+            history.append((parents, next_states))
+            beam_first, beam_second = beam_second[parents], next_states
+            beam_scores = flat_scores[top]
+        
+        # Scores are sorted, so beam 0 is the best; walk its parents back to the start pair
+        path = np.empty(length, dtype=np.int64)
+        beam = 0
+        for t in range(length - 3, -1, -1):
+            parents, next_states = history[t]
+            path[t + 2] = next_states[beam]
+            beam = parents[beam]
+        path[0] = initial_first[beam]
+        path[1] = initial_second[beam]
+        return [self.idx_to_state[idx] for idx in path.tolist()]
+    
+    def _log_transition_tensor(self, smoothing: float = 0.0) -> np.ndarray:
+        """
+        Log transition probabilities with additive smoothing, cached per smoothing value.
+        """
+        if smoothing < 0:
+            raise ValueError("smoothing must be non-negative")
+        log_probs = self._log_prob_cache.get(smoothing)
+        if log_probs is None:
+            if smoothing > 0:
+                totals = self.count_tensor.sum(axis=2, keepdims=True)
+                probs = (self.count_tensor + smoothing) / (totals + smoothing * self.n_states)
+            else:
+                probs = self.transition_tensor
+            with np.errstate(divide='ignore'):
+                log_probs = np.log(probs)
+            self._log_prob_cache[smoothing] = log_probs
+        return log_probs
+    
+    def log_likelihood(self, sequences: List[List[Any]], smoothing: float = 0.0) -> np.ndarray:
+        """
+        Compute the log-likelihood of each sequence under the model, conditioned on its first two states.
+        
+        Parameters:
+        -----------
+        sequences : list of lists
+            Sequences to score, where each sequence is a list of states.
+        smoothing : float
+            Additive (Laplace) smoothing applied to the transition counts. With 0, unseen
+            transitions from an observed state pair have probability 0 and the sequence scores -inf.
+            Unobserved state pairs are uniform, as in inference.
+            
+        Returns:
+        --------
+        log_likelihoods : numpy.ndarray
+            Natural-log likelihood of each sequence. Sequences with fewer than 3 states score 0.
+        """
+        if not self.is_fitted:
+            raise ValueError("Model not fitted. Call calculate_transition_matrix first.")
+        
+        log_probs = self._log_transition_tensor(smoothing)
+        flat_indices, offsets = self._flatten_sequences(sequences)
+        n_sequences = len(offsets) - 1
+        if len(flat_indices) < 3:
+            return np.zeros(n_sequences)
+        
+        # Log-probability of every triple, then drop the triples spanning two sequences
+        step_log_probs = log_probs[flat_indices[:-2], flat_indices[1:-1], flat_indices[2:]]
+        sequence_ids = np.repeat(np.arange(n_sequences), np.diff(offsets))[:-2]
+        within_sequence = np.ones(len(step_log_probs), dtype=bool)
+        for shift in (1, 2):
+            boundaries = offsets[1:-1] - shift
+            within_sequence[boundaries[(boundaries >= 0) & (boundaries < len(step_log_probs))]] = False
         
-        return sequence
+        return np.bincount(sequence_ids[within_sequence], weights=step_log_probs[within_sequence],
+                           minlength=n_sequences)
+    
+    def perplexity(self, sequences: List[List[Any]], smoothing: float = 0.0) -> np.ndarray:
+        """
+        Compute the per-transition perplexity of each sequence under the model.
+        
+        Parameters:
+        -----------
+        sequences : list of lists
+            Sequences to score, where each sequence is a list of states.
+        smoothing : float
+            Additive (Laplace) smoothing applied to the transition counts.
+            
+        Returns:
+        --------
+        perplexities : numpy.ndarray
+            exp(-log_likelihood / number of transitions) per sequence. NaN for sequences with
+            fewer than 3 states, inf for sequences containing an unseen transition.
+        """
+        log_likelihoods = self.log_likelihood(sequences, smoothing)
+        n_transitions = np.array([max(len(sequence) - 2, 0) for sequence in sequences], dtype=float)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.exp(-log_likelihoods / n_transitions)
     
     def get_transition_matrix(self) -> Dict[Tuple[Any, Any], Dict[Any, float]]:
         """
@@ -309,16 +1078,37 @@ class VanillaSecondOrderMarkovChain:
         """
         return self.count_matrix
     
-    def get_state_space(self) -> List[Any]:
+    def get_count_array(self) -> np.ndarray:
         """
-        Get the state space.
+        Get the counts as a dense array indexed by state index, as used by set_count_array.
         
         Returns:
         --------
-        state_space : list
-            The list of states.
+        counts : numpy.ndarray
+            The (n_states, n_states, n_states) count tensor.
         """
-        return self.state_space
+        return self.count_tensor
+    
+    def set_count_array(self, counts: np.ndarray) -> None:
+        """
+        Replace the counts, e.g. with merged shard counts, and recalculate the probabilities.
+        
+        Parameters:
+        -----------
+        counts : numpy.ndarray
+            (n_states, n_states, n_states) array of transition counts indexed by
+            (first state, second state, next state) index.
+        """
+        counts = np.asarray(counts)
+        n = self.n_states
+        if counts.shape != (n, n, n):
+            raise ValueError(f"Expected counts of shape {(n, n, n)}, got {counts.shape}.")
+        if np.issubdtype(self.count_dtype, np.integer) and counts.size and (
+                counts.min() < 0 or counts.max() > np.iinfo(self.count_dtype).max):
+            raise ValueError(f"Counts do not fit in {self.count_dtype}.")
+        self.count_tensor = counts.astype(self.count_dtype)
+        self._calculate_probabilities()
+        self.is_fitted = True
     
     def visualize_transition_matrix(self, save_path=None):
         """
@@ -338,33 +1128,22 @@ class VanillaSecondOrderMarkovChain:
         if not self.is_fitted:
             raise ValueError("Model not fitted. Call calculate_transition_matrix first.")
         
-        # Get top state pairs by transition count
-        pair_counts = {}
-        for state_pair, counts in self.count_matrix.items():
-            pair_counts[state_pair] = sum(counts.values())
-            
+        n = self.n_states
+        pair_counts = self.count_tensor.reshape(n * n, n).astype(float)
+        
         # Sort pairs by count and take top 15 (or fewer if there are less than 15)
-        num_pairs = min(15, len(pair_counts))
-        top_pairs = sorted(pair_counts.items(), key=lambda x: x[1], reverse=True)[:num_pairs]
-        top_pair_states = [pair[0] for pair in top_pairs]
+        num_pairs = min(15, n * n)
+        top_pair_ids = np.argsort(-pair_counts.sum(axis=1), kind='stable')[:num_pairs]
+        top_pair_states = [(self.idx_to_state[pair_id // n], self.idx_to_state[pair_id % n])
+                           for pair_id in top_pair_ids.tolist()]
         
         # Get top next states
-        next_state_counts = {}
-        for state in self.state_space:
-            count = 0
-            for state_pair in top_pair_states:
-                count += self.count_matrix[state_pair][state]
-            next_state_counts[state] = count
-            
-        top_next_states = sorted(next_state_counts.items(), key=lambda x: x[1], reverse=True)[:num_pairs]
-        top_next = [state[0] for state in top_next_states]
+        next_state_counts = pair_counts[top_pair_ids].sum(axis=0)
+        top_next_ids = np.argsort(-next_state_counts, kind='stable')[:num_pairs]
+        top_next = [self.idx_to_state[idx] for idx in top_next_ids.tolist()]
         
         # Create a matrix of transition probabilities for the top pairs and next states
-        matrix_data = np.zeros((len(top_pair_states), len(top_next)))
-        
-        for i, state_pair in enumerate(top_pair_states):
-            for j, next_state in enumerate(top_next):
-                matrix_data[i, j] = self.transition_matrix[state_pair][next_state]
+        matrix_data = self.transition_tensor.reshape(n * n, n)[top_pair_ids][:, top_next_ids].astype(float)
         
         # Create a DataFrame for better visualization
         pair_labels = [f"({s1},{s2})" for s1, s2 in top_pair_states]
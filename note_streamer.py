@@ -0,0 +1,328 @@
+import argparse
+import asyncio
+import time
+from itertools import islice
+from typing import Any, AsyncIterator, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import mido
+import numpy as np
+
+from create_midi import MidiFileWriter
+from generation_service import Generator
+
+class LocalSink:
+    """
+    Stand-in for a MIDI output port that records every message with the time it was sent.
+    """
+
+    def __init__(self, clock=time.perf_counter):
+        """
+        Parameters:
+        -----------
+        clock : callable
+            Monotonic clock in seconds.
+        """
+        self.clock = clock
+        self.messages = [] # (send time, mido.Message)
+
+    def send(self, message):
+        self.messages.append((self.clock(), message))
+
+    def close(self):
+        pass
+
+class NoteStreamer:
+    """
+    Play an endless melody from a pitch and a duration model on a live MIDI output.
+
+    Notes come from the models' stream iterators, one (pitch, duration) at a time, so memory
+    and the cost per note stay constant however long the performance runs. Every note is
+    generated while the previous one sounds and released at an absolute deadline computed from
+    the tempo and ticks_per_beat, so timing errors do not accumulate. play and aplay report how
+    late each note was released (jitter) and how long each note took to generate.
+    """
+
+    def __init__(self, pitch_model, duration_model, ticks_per_beat=480, tempo=500000, duration_scale=1.0,
+                 velocity=110, clock=time.perf_counter, spin_seconds=0.001):
+        """
+        Parameters:
+        -----------
+        pitch_model : VanillaFirstOrderMarkovChain or VanillaSecondOrderMarkovChain
+            Fitted model of MIDI pitches.
+        duration_model : VanillaFirstOrderMarkovChain or VanillaSecondOrderMarkovChain
+            Fitted model of durations.
+        ticks_per_beat : int
+            Resolution of the durations, as written to the MIDI files by run_model.py.
+        tempo : int
+            Tempo in microseconds per beat.
+        duration_scale : float
+            Factor converting duration states to ticks, e.g. for quantized durations.
+        velocity : int
+            Velocity of every note.
+        clock : callable
+            Monotonic clock in seconds.
+        spin_seconds : float
+            play sleeps until this long before a deadline and busy-waits the rest, trading CPU
+            for lower jitter than the operating system's sleep resolution. 0 only sleeps.
+        """
+        self.pitch_model = pitch_model
+        self.duration_model = duration_model
+        self.ticks_per_beat = ticks_per_beat
+        self.tempo = tempo
+        self.duration_scale = duration_scale
+        self.velocity = velocity
+        self.clock = clock
+        self.spin_seconds = spin_seconds
+
+    @classmethod
+    def from_model_dir(cls, model_dir, order=1, cdf_dtype=np.float32, **kwargs) -> "NoteStreamer":
+        """
+        Load the models and output settings saved for the generation service.
+
+        Parameters:
+        -----------
+        model_dir : str
+            Directory written by generation_service.save_generation_models.
+        order : int
+            Markov chain order, 1 or 2.
+        cdf_dtype : numpy dtype or None
+            Sampling table type of the loaded models. With a table, every step is one binary search.
+        **kwargs
+            Other constructor arguments, e.g. velocity.
+
+        Returns:
+        --------
+        streamer : NoteStreamer
+        """
+        generator = Generator(model_dir, cdf_dtype=cdf_dtype)
+        pitch_model, duration_model = generator.models[order]
+        kwargs.setdefault("ticks_per_beat", generator.ticks_per_beat)
+        kwargs.setdefault("tempo", generator.tempo)
+        kwargs.setdefault("duration_scale", generator.duration_scale)
+        return cls(pitch_model, duration_model, **kwargs)
+
+    @property
+    def seconds_per_tick(self) -> float:
+        return self.tempo / 1e6 / self.ticks_per_beat
+
+    def notes(self, start_state=None, random_seed: Optional[int] = None, max_notes: Optional[int] = None,
+              **sampling_options) -> Iterator[Tuple[Any, int]]:
+        """
+        Generate (pitch, duration) pairs one at a time.
+
+        Parameters:
+        -----------
+        start_state : state, tuple(state, state) or None
+            Starting pitch (pair), see the models' stream.
+        random_seed : int or None
+            Random seed. The pitch and duration streams each draw from their own generator,
+            spawned from this seed, so seeded streams repeat whatever else uses numpy's random
+            state, but differ from the files generated with the same seed.
+        max_notes : int or None
+            Stop after this many notes. None streams until a model reaches a dead end.
+        **sampling_options
+            Passed to the pitch model's stream, e.g. pitch_classes or temperature.
+
+        Returns:
+        --------
+        notes : iterator of tuple(pitch, duration)
+            Durations in ticks.
+        """
+        pitch_seed, duration_seed = np.random.SeedSequence(random_seed).spawn(2)
+        pitches = self.pitch_model.stream(start_state, rng=np.random.default_rng(pitch_seed), **sampling_options)
+        durations = self.duration_model.stream(None, rng=np.random.default_rng(duration_seed))
+        notes = zip(pitches, durations)
+        if max_notes is not None:
+            notes = islice(notes, max_notes)
+        for pitch, duration in notes:
+            if self.duration_scale != 1.0:
+                duration = max(int(round(duration * self.duration_scale)), 1)
+            yield pitch, duration
+
+    def recorded(self, notes: Iterable[Tuple[Any, int]], writer: MidiFileWriter) -> Iterator[Tuple[Any, int]]:
+        """
+        Pass notes through while appending each one to a MIDI file as it is generated.
+
+        Parameters:
+        -----------
+        notes : iterable of tuple(pitch, duration)
+            Notes to record. Durations in ticks.
+        writer : MidiFileWriter
+            Open writer, with the streamer's ticks_per_beat and tempo.
+
+        Returns:
+        --------
+        notes : iterator of tuple(pitch, duration)
+            The same notes.
+        """
+        for pitch, duration in notes:
+            writer.add_note(pitch, duration, self.velocity)
+            yield pitch, duration
+
+    def play(self, notes: Iterable[Tuple[Any, int]], output) -> Dict[str, Any]:
+        """
+        Send notes to a MIDI output as they are due, blocking until the last one ends.
+
+        Parameters:
+        -----------
+        notes : iterable of tuple(pitch, duration)
+            Notes to play, e.g. from notes. Durations in ticks.
+        output : mido output port or LocalSink
+            Anything with a send(message) method.
+
+        Returns:
+        --------
+        stats : dict
+            Jitter statistics, see jitter_stats.
+        """
+        lateness = []
+        step_seconds = []
+        notes = iter(notes)
+        start = self.clock()
+        due = start
+        sounding = None
+        try:
+            while True:
+                # Generate the next note while the previous one sounds
+                step_start = self.clock()
+                note = next(notes, None)
+                step_seconds.append(self.clock() - step_start)
+                if note is None:
+                    break
+                self._wait_until(due)
+                if sounding is not None:
+                    output.send(mido.Message('note_off', note=sounding, velocity=0))
+                pitch, duration = note
+                output.send(mido.Message('note_on', note=pitch, velocity=self.velocity))
+                lateness.append(self.clock() - due)
+                sounding = pitch
+                due += duration * self.seconds_per_tick
+            self._wait_until(due)
+        finally:
+            # Never leave a note hanging, also when interrupted
+            if sounding is not None:
+                output.send(mido.Message('note_off', note=sounding, velocity=0))
+        return self.jitter_stats(lateness, step_seconds[:-1])
+
+    async def paced(self, notes: Iterable[Tuple[Any, int]]) -> AsyncIterator[Tuple[Any, int, float]]:
+        """
+        Async generator releasing notes as they are due, without blocking the event loop.
+
+        Parameters:
+        -----------
+        notes : iterable of tuple(pitch, duration)
+            Notes to release. Durations in ticks.
+
+        Yields:
+        -------
+        note : tuple(pitch, duration, lateness)
+            The note and how many seconds after its deadline it was released.
+        """
+        due = self.clock()
+        for pitch, duration in notes:
+            delay = due - self.clock()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            yield pitch, duration, self.clock() - due
+            due += duration * self.seconds_per_tick
+        delay = due - self.clock()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def aplay(self, notes: Iterable[Tuple[Any, int]], output) -> Dict[str, Any]:
+        """
+        Like play, but paced with asyncio so it can share an event loop, e.g. with a server.
+
+        Parameters:
+        -----------
+        notes : iterable of tuple(pitch, duration)
+            Notes to play. Durations in ticks.
+        output : mido output port or LocalSink
+            Anything with a send(message) method.
+
+        Returns:
+        --------
+        stats : dict
+            Jitter statistics, see jitter_stats.
+        """
+        lateness = []
+        sounding = None
+        try:
+            async for pitch, duration, late in self.paced(notes):
+                if sounding is not None:
+                    output.send(mido.Message('note_off', note=sounding, velocity=0))
+                output.send(mido.Message('note_on', note=pitch, velocity=self.velocity))
+                lateness.append(late)
+                sounding = pitch
+        finally:
+            if sounding is not None:
+                output.send(mido.Message('note_off', note=sounding, velocity=0))
+        return self.jitter_stats(lateness)
+
+    @staticmethod
+    def jitter_stats(lateness: List[float], step_seconds: Optional[List[float]] = None) -> Dict[str, Any]:
+        """
+        Summarize per-note timing.
+
+        Parameters:
+        -----------
+        lateness : list of float
+            Seconds each note was released after its deadline.
+        step_seconds : list of float or None
+            Seconds each note took to generate.
+
+        Returns:
+        --------
+        stats : dict
+            Number of notes, and p50, p99 and max of the lateness (and generation time) in ms.
+        """
+        stats = {"notes": len(lateness)}
+        for name, values in (("lateness", lateness), ("step", step_seconds)):
+            if values:
+                milliseconds = np.asarray(values) * 1000
+                p50, p99 = np.percentile(milliseconds, [50, 99])
+                stats[name] = {"p50_ms": float(p50), "p99_ms": float(p99), "max_ms": float(milliseconds.max())}
+        return stats
+
+    def _wait_until(self, deadline: float) -> None:
+        remaining = deadline - self.clock()
+        if remaining > self.spin_seconds:
+            time.sleep(remaining - self.spin_seconds)
+        while self.clock() < deadline:
+            pass
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Play an endless melody from saved models on a MIDI output")
+    parser.add_argument("-m", "--model_dir", default="models", help="Directory written by save_generation_models")
+    parser.add_argument("--order", type=int, default=1, help="Markov chain order, 1 or 2")
+    parser.add_argument("--seed", type=int, default=None, help="Random seed")
+    parser.add_argument("--notes", type=int, default=None, help="Stop after this many notes")
+    parser.add_argument("--port", default=None,
+                        help="Name of the MIDI output port; by default notes go to a local sink that only measures timing")
+    parser.add_argument("--virtual", action="store_true", help="Create the port as a virtual port")
+    parser.add_argument("--tempo", type=int, default=None, help="Tempo in microseconds per beat")
+    parser.add_argument("--midi_file", default=None, help="Also write the notes to this MIDI file as they are generated")
+    parser.add_argument("--use_asyncio", action="store_true", help="Pace the notes with asyncio instead of sleeping")
+    args = parser.parse_args()
+
+    streamer = NoteStreamer.from_model_dir(args.model_dir, args.order)
+    if args.tempo:
+        streamer.tempo = args.tempo
+    output = LocalSink() if args.port is None else mido.open_output(args.port, virtual=args.virtual)
+    notes = streamer.notes(random_seed=args.seed, max_notes=args.notes)
+    writer = None
+    if args.midi_file:
+        writer = MidiFileWriter(args.midi_file, streamer.ticks_per_beat, streamer.tempo)
+        notes = streamer.recorded(notes, writer)
+    try:
+        if args.use_asyncio:
+            stats = asyncio.run(streamer.aplay(notes, output))
+        else:
+            stats = streamer.play(notes, output)
+        print(stats)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        output.close()
+        if writer is not None:
+            writer.close()
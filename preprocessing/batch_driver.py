@@ -0,0 +1,315 @@
+import hashlib
+import json
+import multiprocessing
+import os
+import time
+from collections import deque
+from multiprocessing.connection import wait
+from pathlib import Path
+
+DONE = "done"
+FAILED = "failed"
+
+
+def output_stem(input_filename):
+    """
+    Returns the prefix of the output file names of an input: a hash of its absolute path.
+
+    Outputs are named <stem>_<suffix>, so processing an input again overwrites its previous
+    outputs, and the outputs left behind by a killed worker can be found and removed.
+
+    Args:
+        input_filename: Path of the input file.
+
+    Returns:
+        16 hex digit string.
+    """
+    return hashlib.sha1(os.path.abspath(input_filename).encode()).hexdigest()[:16]
+
+
+def _process_one(process_file, input_filename, output_dir):
+    """
+    Runs process_file on one input inside a worker and reports the outcome instead of raising.
+    """
+    start = time.perf_counter()
+    try:
+        outputs = process_file(input_filename, output_dir) or []
+        outputs = [os.path.relpath(output, output_dir) for output in outputs]
+        return DONE, None, outputs, time.perf_counter() - start
+    except Exception as e:
+        return FAILED, f"{type(e).__name__}: {e}", [], time.perf_counter() - start
+
+
+def _worker_loop(process_file, output_dir, connection):
+    """
+    Processes the inputs sent over connection one at a time until it receives None.
+    """
+    while True:
+        input_filename = connection.recv()
+        if input_filename is None:
+            return
+        connection.send(_process_one(process_file, input_filename, output_dir))
+
+
+class _Worker:
+    """
+    One worker process with the input it is running and when that input times out.
+    """
+
+    def __init__(self, process_file, output_dir):
+        self.connection, child_connection = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(
+            target=_worker_loop,
+            args=(process_file, output_dir, child_connection),
+            daemon=True,
+        )
+        self.process.start()
+        child_connection.close()
+        self.input_filename = None
+        self.started = None
+        self.deadline = None
+
+    def submit(self, input_filename, timeout):
+        self.connection.send(input_filename)
+        self.input_filename = input_filename
+        self.started = time.monotonic()
+        self.deadline = None if timeout is None else self.started + timeout
+
+    def finish(self):
+        self.input_filename = self.started = self.deadline = None
+
+    def kill(self):
+        self.process.kill()
+        self.process.join()
+        self.connection.close()
+
+    def stop(self):
+        try:
+            self.connection.send(None)
+        except OSError:
+            pass
+        self.process.join(timeout=5)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.connection.close()
+
+
+def _input_signature(input_filename):
+    stat = os.stat(input_filename)
+    return {"mtime": stat.st_mtime, "size": stat.st_size}
+
+
+def _outputs_up_to_date(record, signature, output_dir):
+    """
+    Whether every output recorded for an input exists and is not older than the input.
+    """
+    if "outputs" not in record:
+        # Recorded before outputs were tracked, so they cannot be checked
+        return False
+    for output in record["outputs"]:
+        try:
+            if os.stat(os.path.join(output_dir, output)).st_mtime < signature["mtime"]:
+                return False
+        except OSError:
+            return False
+    return True
+
+
+def _remove_outputs(output_dir, stems):
+    """
+    Deletes every file under output_dir named with one of the given output stems.
+    """
+    for directory, _, filenames in os.walk(output_dir):
+        for filename in filenames:
+            if filename.partition("_")[0] in stems:
+                os.remove(os.path.join(directory, filename))
+
+
+def read_manifest(manifest_path):
+    """
+    Reads a manifest written by run_batch.
+
+    Args:
+        manifest_path: Path to the JSON lines manifest.
+
+    Returns:
+        Dict of input path to its latest manifest record.
+    """
+    records = {}
+    if not os.path.exists(manifest_path):
+        return records
+    with open(manifest_path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # Last line of an interrupted run may be partially written
+                continue
+            records[record["input"]] = record
+    return records
+
+
+def run_batch(
+    process_file,
+    input_filenames,
+    output_dir,
+    manifest_path=None,
+    workers=None,
+    timeout=None,
+    retry_failed=False,
+):
+    """
+    Runs process_file(input_filename, output_dir) over many inputs in worker processes.
+
+    process_file names its outputs <output_stem(input_filename)>_<suffix> and returns their
+    paths. Every outcome is appended to a JSON lines manifest with the input's signature and
+    its outputs, so an interrupted run resumes where it stopped. An input recorded as done is
+    skipped while the input file is unchanged and all its outputs exist and are not older than
+    it. Inputs recorded as failed are skipped unless retry_failed is set. The stale outputs of
+    an input, including partial ones of a killed worker, are removed before it is processed
+    again and when it times out or crashes, so no orphans or duplicates are left behind.
+
+    The timeout is enforced by this process, so a file hanging inside native code cannot stall
+    the run: its worker is killed and replaced. A worker that crashes (e.g. a segfault or the
+    OOM killer) only fails the input it was running; the others continue on a new worker.
+
+    Args:
+        process_file: Picklable function processing one input file and returning the paths
+            of the outputs it wrote.
+        input_filenames: Paths of the input files.
+        output_dir: Output directory passed to process_file.
+        manifest_path: Path to the manifest. Defaults to manifest.jsonl in output_dir.
+        workers: Number of worker processes. Defaults to the number of CPUs.
+        timeout: Per-file timeout in seconds. None disables it.
+        retry_failed: Whether to process inputs recorded as failed again.
+
+    Returns:
+        Dict with the number of done, failed and skipped inputs.
+    """
+    if manifest_path is None:
+        manifest_path = Path(output_dir) / "manifest.jsonl"
+    previous = read_manifest(manifest_path)
+
+    pending = []
+    skipped = 0
+    for input_filename in input_filenames:
+        input_filename = os.path.abspath(input_filename)
+        record = previous.get(input_filename)
+        if record is not None:
+            try:
+                signature = _input_signature(input_filename)
+            except OSError:
+                signature = None # missing inputs are processed and fail there
+            if signature is not None and record.get("signature") == signature:
+                if record["status"] == DONE and _outputs_up_to_date(record, signature, output_dir):
+                    skipped += 1
+                    continue
+                if record["status"] == FAILED and not retry_failed:
+                    skipped += 1
+                    continue
+        pending.append(input_filename)
+
+    print(f"{len(pending)} files to process, {skipped} skipped from {manifest_path}")
+    summary = {DONE: 0, FAILED: 0, "skipped": skipped}
+    if not pending:
+        return summary
+    _remove_outputs(output_dir, {output_stem(input_filename) for input_filename in pending})
+
+    queue = deque(pending)
+    n_workers = min(workers or os.cpu_count() or 1, len(pending))
+    pool = []
+    completed = 0
+    with open(manifest_path, "a") as manifest:
+
+        def record_outcome(input_filename, status, error, seconds, outputs=()):
+            nonlocal completed
+            try:
+                signature = _input_signature(input_filename)
+            except OSError as e:
+                # The input was deleted or became unreadable during the run
+                signature = None
+                status, error = FAILED, f"{type(e).__name__}: {e}"
+            if status == FAILED:
+                _remove_outputs(output_dir, {output_stem(input_filename)})
+                outputs = ()
+            record = {
+                "input": input_filename,
+                "status": status,
+                "signature": signature,
+                "outputs": list(outputs),
+                "seconds": seconds,
+            }
+            if error:
+                record["error"] = error
+            manifest.write(json.dumps(record) + "\n")
+            manifest.flush()
+            summary[status] += 1
+            completed += 1
+
+            message = f"[{completed}/{len(pending)}] {status}: {input_filename}"
+            if error:
+                message += f" ({error})"
+            print(message)
+
+        try:
+            pool = [_Worker(process_file, output_dir) for _ in range(n_workers)]
+            while True:
+                for worker in pool:
+                    if worker.input_filename is None and queue:
+                        worker.submit(queue.popleft(), timeout)
+                busy = [worker for worker in pool if worker.input_filename is not None]
+                if not busy:
+                    break
+
+                deadlines = [worker.deadline for worker in busy if worker.deadline is not None]
+                wait_seconds = (
+                    max(min(deadlines) - time.monotonic(), 0) if deadlines else None
+                )
+                ready = wait(
+                    [worker.connection for worker in busy]
+                    + [worker.process.sentinel for worker in busy],
+                    wait_seconds,
+                )
+
+                for worker in busy:
+                    input_filename = worker.input_filename
+                    seconds = time.monotonic() - worker.started
+                    if worker.connection in ready or worker.process.sentinel in ready:
+                        try:
+                            status, error, outputs, seconds = worker.connection.recv()
+                        except (EOFError, OSError):
+                            # Only the input this worker was running failed, the queue is intact
+                            worker.process.join()
+                            exitcode = worker.process.exitcode
+                            record_outcome(
+                                input_filename,
+                                FAILED,
+                                f"Worker crashed with exit code {exitcode}",
+                                seconds,
+                            )
+                            worker.kill()
+                            pool[pool.index(worker)] = _Worker(process_file, output_dir)
+                            continue
+                        worker.finish()
+                        record_outcome(input_filename, status, error, seconds, outputs)
+                    elif worker.deadline is not None and time.monotonic() >= worker.deadline:
+                        worker.kill()
+                        pool[pool.index(worker)] = _Worker(process_file, output_dir)
+                        record_outcome(
+                            input_filename, FAILED, f"Timed out after {timeout} s", seconds
+                        )
+        finally:
+            for worker in pool:
+                if worker.input_filename is None:
+                    worker.stop()
+                else:
+                    worker.kill()
+
+    print(
+        f"Completed batch: {summary[DONE]} done, {summary[FAILED]} failed, {skipped} skipped"
+    )
+    return summary
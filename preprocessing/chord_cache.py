@@ -0,0 +1,127 @@
+import hashlib
+import sqlite3
+import time
+
+import note_seq
+from note_seq import chord_inference
+
+CHORD_SYMBOL = note_seq.NoteSequence.TextAnnotation.CHORD_SYMBOL
+
+# Bump when the inference parameters change so old entries are no longer matched
+CACHE_VERSION = "1"
+
+
+def measure_key(quantized_seq):
+    """
+    Canonical hash of everything chord inference reads from a quantized measure: time
+    signatures, tempo, quantization and the notes' steps and pitches.
+
+    Args:
+        quantized_seq: Quantized NoteSequence.
+
+    Returns:
+        Hex digest identifying the measure.
+    """
+    notes = sorted(
+        (note.quantized_start_step, note.quantized_end_step, note.pitch, note.is_drum)
+        for note in quantized_seq.notes
+    )
+    key = (
+        CACHE_VERSION,
+        quantized_seq.quantization_info.steps_per_quarter,
+        quantized_seq.total_quantized_steps,
+        tuple((ts.time, ts.numerator, ts.denominator) for ts in quantized_seq.time_signatures),
+        tuple((tempo.time, tempo.qpm) for tempo in quantized_seq.tempos),
+        tuple(notes),
+    )
+    return hashlib.sha256(repr(key).encode()).hexdigest()
+
+
+class ChordInferenceCache:
+    """
+    Content-addressed on-disk cache of note_seq chord inference per measure.
+
+    Repeated measures (repeats, or the same piece in different editions) return the stored chord
+    annotations without running inference. Entries are kept in sqlite and the least recently
+    used ones are evicted once the cache holds more than max_entries.
+    """
+
+    def __init__(self, path, max_entries=200000):
+        """
+        Args:
+            path: Path to the sqlite database, created if missing.
+            max_entries: Maximum number of cached measures.
+        """
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._inserts_since_eviction = 0
+        self._connection = sqlite3.connect(path, timeout=60)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS chords "
+            "(key TEXT PRIMARY KEY, annotations BLOB NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS chords_last_used ON chords (last_used)"
+        )
+        self._connection.commit()
+
+    def infer_chords_for_sequence(self, quantized_seq):
+        """
+        Drop-in replacement for chord_inference.infer_chords_for_sequence with default arguments.
+        Adds the inferred chord annotations to quantized_seq and raises the same errors.
+        """
+        if any(ta.annotation_type == CHORD_SYMBOL for ta in quantized_seq.text_annotations):
+            # Let note_seq raise SequenceAlreadyHasChordsError
+            return chord_inference.infer_chords_for_sequence(quantized_seq)
+
+        key = measure_key(quantized_seq)
+        row = self._connection.execute(
+            "SELECT annotations FROM chords WHERE key = ?", (key,)
+        ).fetchone()
+        if row is not None:
+            self.hits += 1
+            cached = note_seq.NoteSequence.FromString(row[0])
+            quantized_seq.text_annotations.extend(cached.text_annotations)
+            quantized_seq.key_signatures.extend(cached.key_signatures)
+            self._connection.execute(
+                "UPDATE chords SET last_used = ? WHERE key = ?", (time.time(), key)
+            )
+            self._connection.commit()
+            return
+
+        self.misses += 1
+        n_annotations = len(quantized_seq.text_annotations)
+        n_key_signatures = len(quantized_seq.key_signatures)
+        chord_inference.infer_chords_for_sequence(quantized_seq)
+
+        # Store only what inference added
+        added = note_seq.NoteSequence()
+        added.text_annotations.extend(quantized_seq.text_annotations[n_annotations:])
+        added.key_signatures.extend(quantized_seq.key_signatures[n_key_signatures:])
+        self._connection.execute(
+            "INSERT OR REPLACE INTO chords (key, annotations, last_used) VALUES (?, ?, ?)",
+            (key, added.SerializeToString(), time.time()),
+        )
+        # Counting rows scans the table, so only check the size every 100 inserts
+        self._inserts_since_eviction += 1
+        if self._inserts_since_eviction >= 100:
+            self._evict()
+        self._connection.commit()
+
+    def _evict(self):
+        self._inserts_since_eviction = 0
+        (count,) = self._connection.execute("SELECT COUNT(*) FROM chords").fetchone()
+        if count > self.max_entries:
+            self._connection.execute(
+                "DELETE FROM chords WHERE key IN "
+                "(SELECT key FROM chords ORDER BY last_used LIMIT ?)",
+                (count - self.max_entries,),
+            )
+
+    def close(self):
+        self._evict()
+        self._connection.commit()
+        print(f"Chord cache: {self.hits} hits, {self.misses} misses")
+        self._connection.close()
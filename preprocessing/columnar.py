@@ -0,0 +1,95 @@
+import numpy as np
+
+
+def segments_to_columns(segments):
+    """
+    Converts m21 output segments into flat columnar arrays.
+
+    Args:
+        segments: List of {"CHORD_SYMBOL", "notes", "beat_starts", "beat_ends"} dicts.
+
+    Returns:
+        Dict of arrays. Segment i spans notes[segment_offsets[i]:segment_offsets[i + 1]]
+        (likewise beat_starts and beat_ends) and has chord chord_symbols[chord_ids[i]].
+    """
+    chord_symbols = sorted({seg["CHORD_SYMBOL"] for seg in segments})
+    chord_to_id = {chord: i for i, chord in enumerate(chord_symbols)}
+
+    lengths = [len(seg["notes"]) for seg in segments]
+    segment_offsets = np.zeros(len(segments) + 1, dtype=np.int64)
+    segment_offsets[1:] = np.cumsum(lengths)
+    n_notes = int(segment_offsets[-1])
+
+    def column(name, dtype):
+        return np.fromiter(
+            (value for seg in segments for value in seg[name]), dtype=dtype, count=n_notes
+        )
+
+    return {
+        "notes": column("notes", np.uint8),
+        "beat_starts": column("beat_starts", np.float64),
+        "beat_ends": column("beat_ends", np.float64),
+        "segment_offsets": segment_offsets,
+        "chord_ids": np.array(
+            [chord_to_id[seg["CHORD_SYMBOL"]] for seg in segments], dtype=np.int32
+        ),
+        "chord_symbols": np.array(chord_symbols, dtype=np.str_),
+    }
+
+
+def save_columnar(output_path, segments):
+    """
+    Writes m21 output segments as an .npz file of flat arrays.
+
+    Args:
+        output_path: Path to the .npz file.
+        segments: List of segments as returned by process_musicxml_and_infer_chords.
+    """
+    np.savez(output_path, **segments_to_columns(segments))
+
+
+def load_columnar(input_path):
+    """
+    Loads an .npz file written by save_columnar without creating per-element Python objects.
+
+    Args:
+        input_path: Path to the .npz file.
+
+    Returns:
+        Dict of arrays, see segments_to_columns.
+    """
+    with np.load(input_path, allow_pickle=False) as data:
+        return {name: data[name] for name in data.files}
+
+
+def concatenate_columns(columns_list):
+    """
+    Concatenates the columns of several pieces into one, merging their chord vocabularies.
+
+    Args:
+        columns_list: List of dicts as returned by load_columnar.
+
+    Returns:
+        Dict of arrays, see segments_to_columns.
+    """
+    chord_symbols = np.unique(
+        np.concatenate([columns["chord_symbols"] for columns in columns_list])
+    )
+    note_offset = 0
+    segment_offsets = [np.zeros(1, dtype=np.int64)]
+    chord_ids = []
+    for columns in columns_list:
+        segment_offsets.append(columns["segment_offsets"][1:] + note_offset)
+        note_offset += int(columns["segment_offsets"][-1])
+        # Remap the piece's chord ids onto the merged vocabulary
+        remap = np.searchsorted(chord_symbols, columns["chord_symbols"]).astype(np.int32)
+        chord_ids.append(remap[columns["chord_ids"]])
+
+    return {
+        "notes": np.concatenate([columns["notes"] for columns in columns_list]),
+        "beat_starts": np.concatenate([columns["beat_starts"] for columns in columns_list]),
+        "beat_ends": np.concatenate([columns["beat_ends"] for columns in columns_list]),
+        "segment_offsets": np.concatenate(segment_offsets),
+        "chord_ids": np.concatenate(chord_ids),
+        "chord_symbols": chord_symbols,
+    }
@@ -16,15 +16,19 @@ import argparse
 from pathlib import Path
 from uuid import uuid4
 
+from chord_cache import ChordInferenceCache
+from columnar import save_columnar
+
 CHORD_SYMBOL = note_seq.NoteSequence.TextAnnotation.CHORD_SYMBOL
 
 
-def process_musicxml_and_infer_chords(input_filename, output_dir=None):
+def process_musicxml_and_infer_chords(input_filename, output_dir=None, chord_cache=None):
     """
     Processes a MusicXML file, splits it by measure, quantizes, and infers chords.
 
     Args:
         input_filename: Path to the input MusicXML file.
+        chord_cache: Optional ChordInferenceCache reused across measures and files.
     """
 
     # infer via filename
@@ -84,9 +88,14 @@ def process_musicxml_and_infer_chords(input_filename, output_dir=None):
 
     ## Chord inference for all sequences
     ## Ignore 0 chord inference, loss incurred
+    infer_chords_for_sequence = (
+        chord_cache.infer_chords_for_sequence
+        if chord_cache is not None
+        else chord_inference.infer_chords_for_sequence
+    )
     for quantized_seq in quantized_sequences:
         try:
-            chord_inference.infer_chords_for_sequence(quantized_seq)
+            infer_chords_for_sequence(quantized_seq)
         except chord_inference.EmptySequenceError as e:
             print(f"EmptySequence error: {e}")
             continue
@@ -193,6 +202,18 @@ if __name__ == "__main__":
     )
     parser.add_argument("-i", "--input_file", required=True, help="Input filename")
     parser.add_argument("-o", "--output", required=False, help="Output directory")
+    parser.add_argument(
+        "--chord_cache",
+        required=False,
+        help="Path to a sqlite cache of inferred chords per measure",
+    )
+    parser.add_argument(
+        "-f",
+        "--format",
+        choices=["json", "npz"],
+        default="json",
+        help="Output format: JSON list of segments, or columnar NPZ arrays",
+    )
     args = parser.parse_args()
 
     # Validate input file
@@ -211,8 +232,16 @@ if __name__ == "__main__":
     path.mkdir(exist_ok=True)
 
     ## Process
-    output = process_musicxml_and_infer_chords(args.input_file, path.absolute())
-    output_json = path / "output.json"
-    open(output_json, "w").write(json.dumps(output))
+    chord_cache = ChordInferenceCache(args.chord_cache) if args.chord_cache else None
+    output = process_musicxml_and_infer_chords(
+        args.input_file, path.absolute(), chord_cache
+    )
+    if chord_cache is not None:
+        chord_cache.close()
+    if args.format == "npz":
+        save_columnar(path / "output.npz", output)
+    else:
+        output_json = path / "output.json"
+        open(output_json, "w").write(json.dumps(output))
     print(f"Completed processing of {args.input_file}")
     print(f"Split midi files created at {path.absolute()}")
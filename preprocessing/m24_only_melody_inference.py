@@ -11,7 +11,8 @@ import note_seq
 import argparse
 import glob
 from pathlib import Path
-from uuid import uuid4
+
+from batch_driver import output_stem, run_batch
 
 CHORD_SYMBOL = note_seq.NoteSequence.TextAnnotation.CHORD_SYMBOL
 
@@ -22,6 +23,10 @@ def process_musicxml_and_infer_chords(input_filename, output_dir: str):
 
     Args:
         input_filename: Path to the input MusicXML file.
+        output_dir: Directory the MIDI files are written to, named with the input's output stem.
+
+    Returns:
+        Paths of the written MIDI files.
     """
 
     # infer via filename
@@ -74,9 +79,9 @@ def process_musicxml_and_infer_chords(input_filename, output_dir: str):
             path = Path(output_dir)
             fp = path
             fp.mkdir(exist_ok=True)
-            note_sequence_to_midi_file(
-                chorded_seq, output_file=(fp / (uuid4().hex + ".mid"))
-            )
+            output_file = fp / f"{output_stem(input_filename)}_{i}.mid"
+            note_sequence_to_midi_file(chorded_seq, output_file=output_file)
+            output.append(str(output_file))
         except IndexError:
             print(f"No Inference at sequence: {i}")
             continue
@@ -98,16 +103,36 @@ if __name__ == "__main__":
         description="Process input file and save to output directory"
     )
     parser.add_argument("-o", "--output", required=False, help="Output directory")
+    parser.add_argument(
+        "-w", "--workers", type=int, default=None, help="Number of worker processes"
+    )
+    parser.add_argument(
+        "--timeout", type=float, default=300, help="Per-file timeout in seconds"
+    )
+    parser.add_argument(
+        "--manifest",
+        required=False,
+        help="Manifest of completed and failed inputs, defaults to <output>/manifest.jsonl",
+    )
+    parser.add_argument(
+        "--retry_failed",
+        action="store_true",
+        help="Process inputs recorded as failed in the manifest again",
+    )
     args = parser.parse_args()
 
     path = Path(args.output)
 
     path.mkdir(exist_ok=True)
     ## Process
-    mid_files = glob.glob("../../../Downloads/archive/giantmidi-piano-unzipped-midi-v1.21-clean/*.mid")
-
-    for p in mid_files:
-        try:
-            output = process_musicxml_and_infer_chords(p, path.absolute().as_posix())
-        except:
-            print(p)
+    input_files = glob.glob("../../../Downloads/archive/giantmidi-piano-unzipped-midi-v1.21-clean/*.mid")
+
+    run_batch(
+        process_musicxml_and_infer_chords,
+        input_files,
+        path.absolute().as_posix(),
+        manifest_path=args.manifest,
+        workers=args.workers,
+        timeout=args.timeout,
+        retry_failed=args.retry_failed,
+    )
@@ -1,73 +1,108 @@
 import os
+import argparse
 import numpy as np
 import pretty_midi
+from concurrent.futures import ProcessPoolExecutor
 
-def get_midi_duration(midi_path):
-    """Returns duration of a MIDI file in seconds."""
+# Columns of the per-instrument note arrays
+START, END, PITCH, VELOCITY = range(4)
+
+def load_midi(midi_path):
+    """
+    Parses a MIDI file once and moves each instrument's notes into a (n, 4) array.
+    The parsed PrettyMIDI is kept without its notes, so its tempo map, signatures, lyrics,
+    text events, control changes and pitch bends are reused when the trimmed file is written.
+    Returns None if the file cannot be read.
+    """
     try:
         midi_data = pretty_midi.PrettyMIDI(midi_path)
-        return midi_data.get_end_time()
     except Exception as e:
         print(f"Error reading {midi_path}: {e}")
         return None
 
-def compute_median_duration(directory):
-    """Computes median duration of all MIDI files in a directory."""
-    durations = []
-    for filename in os.listdir(directory):
-        if filename.lower().endswith(('.mid', '.midi')):
-            filepath = os.path.join(directory, filename)
-            duration = get_midi_duration(filepath)
-            if duration is not None:
-                durations.append(duration)
+    duration = midi_data.get_end_time()
+    notes = []
+    for instrument in midi_data.instruments:
+        notes.append(np.array([[note.start, note.end, note.pitch, note.velocity] for note in instrument.notes],
+                              dtype=float).reshape(-1, 4))
+        instrument.notes = []
+    return {
+        "duration": duration,
+        "midi_data": midi_data,
+        "notes": notes,
+    }
+
+def compute_median_duration(midis):
+    """Computes median duration of the loaded MIDI files."""
+    durations = [midi["duration"] for midi in midis if midi is not None]
     return np.median(durations) if durations else None
 
-def cut_midi_to_duration(input_path, output_path, target_duration):
-    """Cuts a MIDI file to the specified duration (or loops if shorter)."""
-    midi_data = pretty_midi.PrettyMIDI(input_path)
-    original_duration = midi_data.get_end_time()
-    
-    if original_duration >= target_duration:
-        # Trim the MIDI (remove events after target_duration)
-        for instrument in midi_data.instruments:
-            instrument.notes = [note for note in instrument.notes if note.start < target_duration]
-    else:
-        # Loop the MIDI (repeat notes until target_duration is reached)
+def cut_notes_to_duration(notes, original_duration, target_duration):
+    """
+    Trims a (n, 4) note array to the target duration, or tiles it until the target duration
+    is reached if it is shorter. Only notes starting before the target duration are kept.
+    """
+    if original_duration < target_duration and original_duration > 0:
         loop_times = int(np.ceil(target_duration / original_duration))
-        for instrument in midi_data.instruments:
-            new_notes = []
-            for loop in range(loop_times):
-                for note in instrument.notes:
-                    new_note = pretty_midi.Note(
-                        velocity=note.velocity,
-                        pitch=note.pitch,
-                        start=note.start + loop * original_duration,
-                        end=note.end + loop * original_duration
-                    )
-                    if new_note.start < target_duration:
-                        new_notes.append(new_note)
-            instrument.notes = new_notes
-    
+        offsets = np.repeat(np.arange(loop_times) * original_duration, len(notes))
+        notes = np.tile(notes, (loop_times, 1))
+        notes[:, START] += offsets
+        notes[:, END] += offsets
+    return notes[notes[:, START] < target_duration]
+
+def cut_midi_to_duration(midi, output_path, target_duration):
+    """Cuts a loaded MIDI file to the specified duration (or loops if shorter) and writes it."""
+    midi_data = midi["midi_data"]
+    for instrument, notes in zip(midi_data.instruments, midi["notes"]):
+        notes = cut_notes_to_duration(notes, midi["duration"], target_duration)
+        instrument.notes = [
+            pretty_midi.Note(velocity=int(velocity), pitch=int(pitch), start=start, end=end)
+            for start, end, pitch, velocity in notes.tolist()
+        ]
+
     midi_data.write(output_path)
 
-def process_all_midis(input_dir, output_dir):
-    """Processes all MIDI files to the median duration."""
-    median_duration = compute_median_duration(input_dir)
-    if median_duration is None:
-        print("No valid MIDI files found.")
-        return
-    
-    print(f"Median duration: {median_duration:.2f} seconds")
-    os.makedirs(output_dir, exist_ok=True)
-    
-    for filename in os.listdir(input_dir):
-        if filename.lower().endswith(('.mid', '.midi')):
-            input_path = os.path.join(input_dir, filename)
-            output_path = os.path.join(output_dir, filename)
-            cut_midi_to_duration(input_path, output_path, median_duration)
+def _cut_midi_task(args):
+    cut_midi_to_duration(*args)
+    return os.path.basename(args[1])
+
+def process_all_midis(input_dir, output_dir, workers=None):
+    """
+    Processes all MIDI files to the median duration.
+
+    Each file is parsed once, in parallel, and the parsed notes are reused for the median and the
+    trimming pass. Times are kept in seconds; the output keeps the file's resolution, tempo changes,
+    time and key signatures, lyrics and text events.
+    """
+    filenames = [filename for filename in os.listdir(input_dir) if filename.lower().endswith(('.mid', '.midi'))]
+    input_paths = [os.path.join(input_dir, filename) for filename in filenames]
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        midis = list(executor.map(load_midi, input_paths, chunksize=16))
+
+        median_duration = compute_median_duration(midis)
+        if median_duration is None:
+            print("No valid MIDI files found.")
+            return
+
+        print(f"Median duration: {median_duration:.2f} seconds")
+        os.makedirs(output_dir, exist_ok=True)
+
+        tasks = [
+            (midi, os.path.join(output_dir, filename), median_duration)
+            for filename, midi in zip(filenames, midis)
+            if midi is not None
+        ]
+        for filename in executor.map(_cut_midi_task, tasks, chunksize=16):
             print(f"Processed: {filename}")
 
-# Example usage:
-input_directory = "./input_directory"
-output_directory = "./output_directory"
-process_all_midis(input_directory, output_directory)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Trim or loop all MIDI files in a directory to their median duration"
+    )
+    parser.add_argument("-i", "--input", default="./input_directory", help="Input directory")
+    parser.add_argument("-o", "--output", default="./output_directory", help="Output directory")
+    parser.add_argument("-w", "--workers", type=int, default=None, help="Number of worker processes")
+    args = parser.parse_args()
+
+    process_all_midis(args.input, args.output, args.workers)
@@ -1,8 +1,33 @@
 import os
+import numpy as np
 from process_midi_file import process_midi
 from create_midi import CreateMidi
 from model.VanillaFirstOrderMarkovChain import VanillaFirstOrderMarkovChain
 from model.VanillaSecondOrderMarkovChain import VanillaSecondOrderMarkovChain
+from stage_profiler import StageProfiler
+from duration_quantizer import DurationQuantizer
+from candidate_ranker import CandidateRanker
+
+# Per-stage timing report. Set profile_memory to also record tracemalloc peaks (slower).
+profile_enabled = True
+profile_memory = False
+profiler = StageProfiler(enabled=profile_enabled, trace_memory=profile_memory)
+
+# Snap durations to a sixteenth-note and eighth-triplet grid, measured in beats of each file.
+# Set quantize_durations to False to keep every raw tick duration as its own state.
+quantize_durations = True
+quantizer_options = dict(subdivisions=4, tuplets=(3,), max_beats=2.0)
+duration_quantizer = None # created at the resolution of the first parsed file
+
+# Also learn from the training data transposed into all 12 keys, by shifting the pitch counts.
+augment_transpositions = False
+
+# Set to a directory to save the fitted models for generation_service.py
+model_output_dir = None
+
+# Best-of-N: sample this many candidates per model in one batch and keep the one with the highest
+# harmonic score. 0 keeps the single seeded sample from inference_prob.
+n_candidates = 0
 
 print(".: PROCESSING FILES :.")
 
@@ -15,8 +40,10 @@ output_dir = "sample_outputs"
 # Ensure files are located in input_folder and labelled in ascending order from 1 - X files e.g 1.mid, 2.mid,...
 avg_ticks_per_beat = 0
 avg_tempo = 0
-pitch_sequence_list = []
-duration_sequence_list = []
+# Per-file arrays, concatenated once after parsing. The offsets keep the file boundaries
+# so no transitions are counted from the end of one file into the next.
+pitch_sequence_arrays = []
+duration_sequence_arrays = []
 processed_file_counter = 0
 
 processed_file_limit = 999
@@ -26,57 +53,101 @@ while os.path.exists(os.path.join(input_folder, input_fn)):
 
     print("Processing File: " + input_fn)
     input_path = os.path.join(input_folder, input_fn)
-    ticks_per_beat, tempo, total_notes, output_notes, output_notes_highest, pitch_sequence, duration_sequence = process_midi(input_path)
+    with profiler.stage("parse"):
+        ticks_per_beat, tempo, total_notes, output_notes, output_notes_highest, pitch_sequence, duration_sequence = process_midi(input_path)
     avg_ticks_per_beat += ticks_per_beat
     avg_tempo += tempo
-    pitch_sequence_list += pitch_sequence
-    duration_sequence_list += duration_sequence
+    # Clip duration to be within range of 50 - 300
+    with profiler.stage("filter"):
+        duration_sequence = [duration for duration in duration_sequence if duration >= 50 and duration <= 300]
+        if quantize_durations:
+            if duration_quantizer is None:
+                # States in the corpus' own ticks, so the 100-tick duration weights mean the same as unquantized
+                duration_quantizer = DurationQuantizer(resolution=ticks_per_beat, **quantizer_options)
+            duration_sequence = duration_quantizer.quantize(duration_sequence, ticks_per_beat).tolist()
+    pitch_sequence_arrays.append(np.asarray(pitch_sequence, dtype=np.int64))
+    duration_sequence_arrays.append(np.asarray(duration_sequence, dtype=np.int64))
 
     input_file += 1
     input_fn = '1 ('+ str(input_file) + ')' + ".mid"
     processed_file_counter += 1
 
 avg_tempo = int(avg_tempo/processed_file_counter)
+avg_ticks_per_beat = int(avg_ticks_per_beat/processed_file_counter)
+
+pitch_sequences = np.concatenate(pitch_sequence_arrays)
+pitch_offsets = np.cumsum([0] + [len(array) for array in pitch_sequence_arrays])
+duration_sequences = np.concatenate(duration_sequence_arrays)
+duration_offsets = np.cumsum([0] + [len(array) for array in duration_sequence_arrays])
 
 # Scale bpm of resulting song according to tempo
 target_bpm = 70
 avg_tempo_seconds = avg_tempo/pow(10, 6)
 ticks_per_beat = int(target_bpm/60 * (60/avg_tempo_seconds))
 
-# get states
-pitch_set = set(pitch_sequence_list)
+# get states, sorted so state indices are the same on every run
+with profiler.stage("state_space"):
+    pitch_set = np.unique(pitch_sequences).tolist()
+    duration_set = np.unique(duration_sequences).tolist()
 print("Pitches: " + str(pitch_set)) # Pitches
-
-# Clip duration to be within range of 50 - 300
-duration_sequence_list = list(filter(lambda x: x >= 50 and x <= 300, duration_sequence_list))
-duration_set = set(duration_sequence_list)
 print("Duration Set: " + str(duration_set))
 
 print(".: PROCESSING MODEL :.")
 
 # first order
-pitch_model_fmc = VanillaFirstOrderMarkovChain(pitch_set)
-pitch_model_fmc.calculate_transition_matrix([pitch_sequence_list], True)
-pitch_pred_seq_fmc = pitch_model_fmc.inference_prob(start_state=None, length=100, random_seed=42)
-pitch_model_fmc.visualize_transition_matrix(os.path.join(output_dir, "pitch_transition_matrix_fmc.png"))
-
-duration_model_fmc = VanillaFirstOrderMarkovChain(duration_set)
-duration_model_fmc.calculate_transition_matrix([duration_sequence_list], False)
-duration_pred_seq_fmc = duration_model_fmc.inference_prob(start_state=None, length=100, random_seed=42)
-duration_model_fmc.visualize_transition_matrix(os.path.join(output_dir, "duration_transition_matrix_fmc.png"))
+with profiler.stage("train"):
+    pitch_model_fmc = VanillaFirstOrderMarkovChain(pitch_set)
+    pitch_model_fmc.calculate_transition_matrix(pitch_sequences, True, offsets=pitch_offsets)
+    if augment_transpositions:
+        pitch_model_fmc.augment_transpositions()
+with profiler.stage("sample"):
+    pitch_pred_seq_fmc = pitch_model_fmc.inference_prob(start_state=None, length=100, random_seed=42)
+with profiler.stage("visualize"):
+    pitch_model_fmc.visualize_transition_matrix(os.path.join(output_dir, "pitch_transition_matrix_fmc.png"))
+
+with profiler.stage("train"):
+    duration_model_fmc = VanillaFirstOrderMarkovChain(duration_set)
+    duration_model_fmc.calculate_transition_matrix(duration_sequences, False, offsets=duration_offsets)
+with profiler.stage("sample"):
+    duration_pred_seq_fmc = duration_model_fmc.inference_prob(start_state=None, length=100, random_seed=42)
+with profiler.stage("visualize"):
+    duration_model_fmc.visualize_transition_matrix(os.path.join(output_dir, "duration_transition_matrix_fmc.png"))
 
 # second order
-pitch_model_smc = VanillaSecondOrderMarkovChain(pitch_set)
-pitch_model_smc.calculate_transition_matrix([pitch_sequence_list], True)
-pitch_pred_seq_smc = pitch_model_smc.inference_prob(start_state=None, length=100, random_seed=42)
-pitch_model_smc.visualize_transition_matrix(os.path.join(output_dir, "pitch_transition_matrix_smc.png"))
-
-duration_model_smc = VanillaSecondOrderMarkovChain(duration_set)
-duration_model_smc.calculate_transition_matrix([duration_sequence_list], False)
-duration_pred_seq_smc = duration_model_smc.inference_prob(start_state=None, length=100, random_seed=42)
-duration_model_smc.visualize_transition_matrix(os.path.join(output_dir, "duration_transition_matrix_smc.png"))
+with profiler.stage("train"):
+    pitch_model_smc = VanillaSecondOrderMarkovChain(pitch_set)
+    pitch_model_smc.calculate_transition_matrix(pitch_sequences, True, offsets=pitch_offsets)
+    if augment_transpositions:
+        pitch_model_smc.augment_transpositions()
+with profiler.stage("sample"):
+    pitch_pred_seq_smc = pitch_model_smc.inference_prob(start_state=None, length=100, random_seed=42)
+with profiler.stage("visualize"):
+    pitch_model_smc.visualize_transition_matrix(os.path.join(output_dir, "pitch_transition_matrix_smc.png"))
+
+with profiler.stage("train"):
+    duration_model_smc = VanillaSecondOrderMarkovChain(duration_set)
+    duration_model_smc.calculate_transition_matrix(duration_sequences, False, offsets=duration_offsets)
+with profiler.stage("sample"):
+    duration_pred_seq_smc = duration_model_smc.inference_prob(start_state=None, length=100, random_seed=42)
+with profiler.stage("visualize"):
+    duration_model_smc.visualize_transition_matrix(os.path.join(output_dir, "duration_transition_matrix_smc.png"))
 
 print("Model Processed.")
+
+if n_candidates:
+    with profiler.stage("rank"):
+        best_fmc = CandidateRanker(pitch_model_fmc, duration_model_fmc).generate(n_candidates, length=100, random_seed=42)[0]
+        best_smc = CandidateRanker(pitch_model_smc, duration_model_smc).generate(n_candidates, length=100, random_seed=42)[0]
+    pitch_pred_seq_fmc, duration_pred_seq_fmc = best_fmc["pitches"], best_fmc["durations"]
+    pitch_pred_seq_smc, duration_pred_seq_smc = best_smc["pitches"], best_smc["durations"]
+    print(f"Best of {n_candidates} harmonic scores: first order {best_fmc['harmonic_score']:.4f}, "
+          f"second order {best_smc['harmonic_score']:.4f}")
+
+if quantize_durations:
+    # Map the duration states back to ticks at the average input resolution, the scale raw durations use
+    duration_pred_seq_fmc = duration_quantizer.to_ticks(duration_pred_seq_fmc, avg_ticks_per_beat)
+    duration_pred_seq_smc = duration_quantizer.to_ticks(duration_pred_seq_smc, avg_ticks_per_beat)
+
 print(".: CREATING MIDI :.")
 print("Ticks per beat: " + str(ticks_per_beat))
 print("Tempo: " + str(avg_tempo))
@@ -85,27 +156,30 @@ print("Tempo: " + str(avg_tempo))
 # first order
 fmc_output_name = input_fn.split(".")[0] + "_pred_fmc.mid"
 fmc_output_path = os.path.join(output_dir, fmc_output_name)
-fmc_seq = []
-current_time = 0
 velocity = 110 # this is the one in 1.mid. Also the velocity in 2.mid seems to be different for each note.
-for pitch, dur in zip(pitch_pred_seq_fmc, duration_pred_seq_fmc):
-    fmc_seq.append({'event': 'note_on', 'note': pitch, 'start_time': current_time, 'duration': None, 'velocity': velocity})
-    fmc_seq.append({'event': 'note_off', 'note': pitch, 'start_time': current_time, 'duration': dur, 'velocity': 0})
-    current_time += dur
+fmc_seq = CreateMidi.notes_from_sequences(pitch_pred_seq_fmc, duration_pred_seq_fmc, velocity)
 
 # Tempo set to avg, ticks_per_beat calculated based on tempo.
-CreateMidi.create_midi_from_notes(fmc_output_path, fmc_seq, ticks_per_beat, avg_tempo)
+with profiler.stage("write"):
+    CreateMidi.create_midi_from_notes(fmc_output_path, fmc_seq, ticks_per_beat, avg_tempo)
 
 # second order
 smc_output_name = input_fn.split(".")[0] + "_pred_smc.mid"
 smc_output_path = os.path.join(output_dir, smc_output_name)
-smc_seq = []
-current_time = 0
-velocity = 110 # this is the one in 1.mid. Also the velocity in 2.mid seems to be different for each note.
-for pitch, dur in zip(pitch_pred_seq_smc, duration_pred_seq_smc):
-    smc_seq.append({'event': 'note_on', 'note': pitch, 'start_time': current_time, 'duration': None, 'velocity': velocity})
-    smc_seq.append({'event': 'note_off', 'note': pitch, 'start_time': current_time, 'duration': dur, 'velocity': 0})
-    current_time += dur
+smc_seq = CreateMidi.notes_from_sequences(pitch_pred_seq_smc, duration_pred_seq_smc, velocity)
 
 # Tempo set to avg, ticks_per_beat calculated based on tempo.
-CreateMidi.create_midi_from_notes(smc_output_path, smc_seq, ticks_per_beat, avg_tempo)
\ No newline at end of file
+with profiler.stage("write"):
+    CreateMidi.create_midi_from_notes(smc_output_path, smc_seq, ticks_per_beat, avg_tempo)
+
+if model_output_dir:
+    from generation_service import save_generation_models
+
+    duration_scale = avg_ticks_per_beat / duration_quantizer.resolution if quantize_durations else 1.0
+    save_generation_models(model_output_dir,
+                           {1: (pitch_model_fmc, duration_model_fmc), 2: (pitch_model_smc, duration_model_smc)},
+                           ticks_per_beat, avg_tempo, duration_scale)
+    print(f"Models saved to '{model_output_dir}'.")
+
+profiler.save_report(os.path.join(output_dir, "run_report.json"))
+profiler.stop()
\ No newline at end of file
@@ -0,0 +1,196 @@
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+from functools import wraps
+
+# Without reset_peak (Python < 3.9) the tracemalloc peak can only grow, so stage peaks are cumulative
+_RESET_PEAK = getattr(tracemalloc, "reset_peak", None)
+
+class _NullStage:
+    """Shared no-op context manager handed out when profiling is disabled."""
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+_NULL_STAGE = _NullStage()
+
+class _Stage:
+    """Times one entry into a named stage and records it on the profiler."""
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.start_time = 0.0
+        self.start_memory = 0
+        self.peak_memory = 0
+
+    def __enter__(self):
+        profiler = self.profiler
+        if profiler.trace_memory:
+            profiler._fold_memory_peak()
+            self.start_memory = tracemalloc.get_traced_memory()[0]
+            self.peak_memory = self.start_memory
+            profiler._active.append(self)
+        self.start_time = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        elapsed = time.perf_counter() - self.start_time
+        peak = None
+        profiler = self.profiler
+        if profiler.trace_memory:
+            profiler._fold_memory_peak()
+            profiler._active.remove(self)
+            peak = self.peak_memory - self.start_memory if _RESET_PEAK is not None else self.peak_memory
+        profiler._record(self.name, elapsed, peak)
+        return False
+
+class StageProfiler:
+    """
+    Lightweight per-stage timing and memory instrumentation.
+
+    Wrap pipeline stages with `with profiler.stage("train"):` or decorate functions with
+    `@profiler.timed("train")`. Repeated entries into the same stage are aggregated.
+    When disabled, `stage` returns a shared no-op context manager so the overhead is a
+    single attribute check per call.
+    """
+
+    def __init__(self, enabled=True, trace_memory=False, run_name=None):
+        """
+        Initialize the profiler.
+
+        Parameters:
+        -----------
+        enabled : bool
+            If False, all stages are no-ops and no report is produced.
+        trace_memory : bool
+            If True, record the tracemalloc peak (in bytes, above the stage's starting usage)
+            for every stage as peak_memory_bytes. This slows down allocation-heavy code noticeably.
+            Before Python 3.9 the peak cannot be reset between stages, so each stage records
+            the highest usage since tracing started as cumulative_peak_memory_bytes instead.
+        run_name : str or None
+            Name stored in the report. Defaults to the script name.
+        """
+        self.enabled = enabled
+        self.trace_memory = enabled and trace_memory
+        self.memory_peaks = "per_stage" if _RESET_PEAK is not None else "cumulative"
+        self.run_name = run_name or os.path.basename(sys.argv[0] or "run")
+        self.stages = {} # name -> aggregated stats, kept in order of first entry
+        self._active = [] # stages currently open, used to propagate memory peaks to outer stages
+        self._started_tracemalloc = False
+        self._run_start = time.perf_counter()
+        self._run_started_at = datetime.now().isoformat(timespec="seconds")
+
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+
+    def stage(self, name):
+        """
+        Context manager timing the enclosed block under the given stage name.
+
+        Parameters:
+        -----------
+        name : str
+            Name of the stage, e.g. "parse", "train" or "write".
+        """
+        if not self.enabled:
+            return _NULL_STAGE
+        return _Stage(self, name)
+
+    def timed(self, name=None):
+        """
+        Decorator timing every call of the wrapped function as a stage.
+
+        Parameters:
+        -----------
+        name : str or None
+            Name of the stage. Defaults to the function name.
+        """
+        def decorator(func):
+            if not self.enabled:
+                return func
+            stage_name = name or func.__name__
+
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                with _Stage(self, stage_name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def _fold_memory_peak(self):
+        """
+        Fold the tracemalloc peak since the last reset into every open stage, then reset it
+        so that nested stages each see their own peak.
+        """
+        peak = tracemalloc.get_traced_memory()[1]
+        for active_stage in self._active:
+            if peak > active_stage.peak_memory:
+                active_stage.peak_memory = peak
+        if _RESET_PEAK is not None:
+            _RESET_PEAK()
+
+    def _record(self, name, elapsed, peak_memory):
+        peak_key = "peak_memory_bytes" if self.memory_peaks == "per_stage" else "cumulative_peak_memory_bytes"
+        stats = self.stages.get(name)
+        if stats is None:
+            stats = {"calls": 0, "total_seconds": 0.0, "max_seconds": 0.0}
+            if self.trace_memory:
+                stats[peak_key] = 0
+            self.stages[name] = stats
+        stats["calls"] += 1
+        stats["total_seconds"] += elapsed
+        if elapsed > stats["max_seconds"]:
+            stats["max_seconds"] = elapsed
+        if peak_memory is not None and peak_memory > stats[peak_key]:
+            stats[peak_key] = peak_memory
+
+    def report(self):
+        """
+        Build the structured report of the run.
+
+        Returns:
+        --------
+        report : dict
+            Run metadata plus aggregated stats per stage, in order of first entry.
+        """
+        return {
+            "run_name": self.run_name,
+            "started_at": self._run_started_at,
+            "wall_seconds": time.perf_counter() - self._run_start,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "trace_memory": self.trace_memory,
+            "memory_peaks": self.memory_peaks if self.trace_memory else None,
+            "stages": self.stages,
+        }
+
+    def save_report(self, output_path):
+        """
+        Write the report as JSON. Does nothing when profiling is disabled.
+
+        Parameters:
+        -----------
+        output_path : str
+            Path of the JSON file to write.
+        """
+        if not self.enabled:
+            return
+        with open(output_path, "w") as f:
+            json.dump(self.report(), f, indent=2)
+        print(f"Profiling report '{output_path}' created.")
+
+    def stop(self):
+        """
+        Stop memory tracing if this profiler started it.
+        """
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
@@ -0,0 +1,37 @@
+import io
+
+import mido
+import numpy as np
+import pytest
+
+from create_midi import CreateMidi, MidiFileWriter
+
+def test_writer_matches_mido():
+    notes = [(60, 120), (np.int64(62), np.int64(240)), (64, 0)]
+    buffer = io.BytesIO()
+    with MidiFileWriter(buffer, ticks_per_beat=480, tempo=500000) as writer:
+        assert writer.write_notes(notes) == 3
+    expected = CreateMidi.create_midi_bytes(CreateMidi.notes_from_sequences(*zip(*notes)), 480, 500000)
+    assert buffer.getvalue() == expected
+
+@pytest.mark.parametrize("duration", [float("nan"), -1, 2.5, 120.0, "120", None])
+def test_add_note_rejects_invalid_duration(duration):
+    buffer = io.BytesIO()
+    with MidiFileWriter(buffer) as writer:
+        writer.add_note(60, 120)
+        written = buffer.tell()
+        with pytest.raises(ValueError):
+            writer.add_note(62, duration)
+        assert buffer.tell() == written
+    # The file is still complete, with only the valid note
+    midi = mido.MidiFile(file=io.BytesIO(buffer.getvalue()))
+    assert [message.note for message in midi.tracks[0] if message.type == 'note_on'] == [60]
+
+@pytest.mark.parametrize("note, velocity, channel", [(128, 110, 0), (60.0, 110, 0), (60, -1, 0), (60, 110, 16)])
+def test_add_note_rejects_invalid_note_velocity_and_channel(note, velocity, channel):
+    buffer = io.BytesIO()
+    with MidiFileWriter(buffer) as writer:
+        written = buffer.tell()
+        with pytest.raises(ValueError):
+            writer.add_note(note, 120, velocity, channel)
+        assert buffer.tell() == written
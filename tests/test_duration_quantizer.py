@@ -0,0 +1,28 @@
+import numpy as np
+
+from duration_quantizer import DurationQuantizer
+from model.VanillaFirstOrderMarkovChain import VanillaFirstOrderMarkovChain
+
+TICKS_PER_BEAT = 220 # resolution of the bundled training files
+
+def test_quantize_on_grid_keeps_duration_model():
+    # Durations already on the sixteenth and eighth-triplet grid of a 220 ticks per beat file
+    rng = np.random.default_rng(0)
+    grid = np.array([55, 73, 110, 147, 165, 220, 275, 293, 330, 440])
+    durations = rng.choice(grid, size=2000)
+    quantizer = DurationQuantizer(subdivisions=4, tuplets=(3,), max_beats=2.0, resolution=TICKS_PER_BEAT)
+    states = quantizer.quantize(durations, TICKS_PER_BEAT)
+    np.testing.assert_array_equal(states, durations)
+
+    raw_model = VanillaFirstOrderMarkovChain(set(durations.tolist()))
+    raw_model.calculate_transition_matrix([durations.tolist()], False)
+    quantized_model = VanillaFirstOrderMarkovChain(set(states.tolist()))
+    quantized_model.calculate_transition_matrix([states.tolist()], False)
+    np.testing.assert_array_equal(quantized_model.count_matrix, raw_model.count_matrix)
+    np.testing.assert_array_equal(quantized_model.transition_matrix, raw_model.transition_matrix)
+
+def test_to_ticks_round_trip():
+    quantizer = DurationQuantizer(resolution=TICKS_PER_BEAT)
+    states = quantizer.state_space()
+    assert quantizer.to_ticks(states, TICKS_PER_BEAT) == states
+    assert quantizer.to_ticks([TICKS_PER_BEAT], 2 * TICKS_PER_BEAT) == [2 * TICKS_PER_BEAT]
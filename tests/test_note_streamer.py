@@ -0,0 +1,36 @@
+import numpy as np
+import pytest
+
+from model.VanillaFirstOrderMarkovChain import VanillaFirstOrderMarkovChain
+from model.VanillaSecondOrderMarkovChain import VanillaSecondOrderMarkovChain
+from note_streamer import NoteStreamer
+
+PITCHES = list(range(55, 75))
+DURATIONS = [120, 240, 360, 480]
+
+def fitted_streamer(model_class, cdf_dtype):
+    rng = np.random.default_rng(0)
+    pitch_sequences = np.clip(64 + np.cumsum(rng.integers(-2, 3, size=(10, 100)), axis=1), 55, 74).tolist()
+    duration_sequences = rng.choice(DURATIONS, size=(10, 100)).tolist()
+    pitch_model = model_class(PITCHES, cdf_dtype=cdf_dtype)
+    pitch_model.calculate_transition_matrix(pitch_sequences)
+    duration_model = model_class(DURATIONS, cdf_dtype=cdf_dtype)
+    duration_model.calculate_transition_matrix(duration_sequences, False)
+    return NoteStreamer(pitch_model, duration_model)
+
+@pytest.mark.parametrize("model_class", [VanillaFirstOrderMarkovChain, VanillaSecondOrderMarkovChain])
+@pytest.mark.parametrize("cdf_dtype", [None, np.float32])
+def test_seeded_notes_ignore_global_random_state(model_class, cdf_dtype):
+    streamer = fitted_streamer(model_class, cdf_dtype)
+    expected = list(streamer.notes(random_seed=7, max_notes=100))
+
+    # Draws from the global random state and another stream between notes change nothing
+    notes = []
+    other = streamer.notes(random_seed=8)
+    for note in streamer.notes(random_seed=7, max_notes=100):
+        np.random.seed(0)
+        np.random.random_sample(3)
+        next(other)
+        notes.append(note)
+    assert notes == expected
+    assert list(streamer.notes(random_seed=8, max_notes=100)) != expected
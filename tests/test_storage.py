@@ -0,0 +1,33 @@
+import numpy as np
+import pytest
+
+from model.VanillaFirstOrderMarkovChain import VanillaFirstOrderMarkovChain
+from model.VanillaSecondOrderMarkovChain import VanillaSecondOrderMarkovChain
+
+STATES = list(range(40, 90))
+
+def pitch_walks(n_sequences, length, seed=0):
+    rng = np.random.default_rng(seed)
+    steps = rng.integers(-3, 4, size=(n_sequences, length))
+    return np.clip(60 + np.cumsum(steps, axis=1), STATES[0], STATES[-1]).tolist()
+
+@pytest.mark.parametrize("model_class", [VanillaFirstOrderMarkovChain, VanillaSecondOrderMarkovChain])
+@pytest.mark.parametrize("count_dtype, min_ratio", [(np.uint32, 2.6), (np.uint16, 4.0)])
+def test_cdf_storage_keeps_only_counts_and_cdf(model_class, count_dtype, min_ratio):
+    sequences = pitch_walks(20, 200)
+    dense = model_class(STATES)
+    dense.calculate_transition_matrix(sequences)
+    compact = model_class(STATES, count_dtype=count_dtype, prob_dtype=np.float32, cdf_dtype=np.uint16)
+    compact.calculate_transition_matrix(sequences)
+
+    cells = dense.get_count_array().size
+    assert compact.nbytes() == cells * (np.dtype(count_dtype).itemsize + np.dtype(np.uint16).itemsize)
+    ratio = dense.nbytes() / compact.nbytes()
+    print(f"{model_class.__name__} {np.dtype(count_dtype)}: {dense.nbytes()} -> {compact.nbytes()} bytes ({ratio:.2f}x)")
+    assert ratio >= min_ratio
+
+    # Probabilities are still available, derived from the counts
+    probs = compact.transition_matrix if model_class is VanillaFirstOrderMarkovChain else compact.transition_tensor
+    expected = dense.transition_matrix if model_class is VanillaFirstOrderMarkovChain else dense.transition_tensor
+    np.testing.assert_allclose(probs, expected, atol=1e-6)
+    assert compact.nbytes() == cells * (np.dtype(count_dtype).itemsize + np.dtype(np.uint16).itemsize)